@@ -13,21 +13,307 @@ from util.exception import FormatError, RequestError
 from util.warn import deprecated
 from twisted.internet import error
 from twisted.internet import reactor
-import netaddr
+from twisted.internet import defer
+from twisted.python import failure
+from collections import deque
+import codecs
+import copy
+import logging
+import math
+import random
+import socket
 import time
 import txthings.coap as coap
+import txthings.error as txerror
 import txthings.resource as resource
+from txthings.error import RequestTimedOut
 from ipaddress import ip_address
+from core.node import NodeID
+from core.telemetry import Telemetry
+from util import codec
+from core.interface import TOPOLOGY, SCHEDULE, MONITORING
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio  # asyncio backport for Python 2
+    except ImportError:
+        asyncio = None  # AsyncioCommunicator is not available
 
-coap.ACK_TIMEOUT = 10
-coap.DEFAULT_BLOCK_SIZE_EXP = 3  # Block size 128
-"""Default size exponent for blockwise transfers."""
+coap.ACK_TIMEOUT = 10  # Initial retransmission timeout of a node until its RTT has been measured
+coap.DEFAULT_BLOCK_SIZE_EXP = 6  # Block size 1024
+"""Largest size exponent for blockwise transfers. Each node is asked for its own size, see :func:`Communicator.block_size`."""
+MIN_BLOCK_SIZE_EXP = 2  # Block size 64
 
+logg = logging.getLogger('RiSCHER')
+
+
+class RttEstimator(object):
+    """
+    Round-trip time estimation of a single destination following CoCoA (draft-ietf-core-cocoa).
+
+    Exchanges acknowledged without retransmission give strong RTT samples, those needing one or two retransmissions give
+    weak samples measured from the first transmission. Each kind keeps its own smoothed RTT and variance and feeds the
+    overall retransmission timeout (rto), which also decides the backoff factor between retransmissions.
+    """
+
+    def __init__(self, initial=None):
+        self.rto = float(initial if initial is not None else coap.ACK_TIMEOUT)
+        self.strong = None
+        self.weak = None
+        self.samples = 0
+
+    @staticmethod
+    def _smooth(estimate, rtt):
+        if estimate is None:
+            return rtt, rtt / 2
+        srtt, rttvar = estimate
+        return 0.875 * srtt + 0.125 * rtt, 0.75 * rttvar + 0.25 * abs(srtt - rtt)
+
+    def update(self, rtt, retransmissions=0):
+        if retransmissions == 0:
+            self.strong = self._smooth(self.strong, rtt)
+            self.rto = 0.5 * (self.strong[0] + 4 * self.strong[1]) + 0.5 * self.rto
+        elif retransmissions <= 2:
+            self.weak = self._smooth(self.weak, rtt)
+            self.rto = 0.25 * (self.weak[0] + self.weak[1]) + 0.75 * self.rto
+        else:
+            return
+        self.samples += 1
+
+    def backoff(self):
+        if self.rto < 1:
+            return 3
+        elif self.rto > 3:
+            return 1.5
+        return 2
+
+    def srtt(self):
+        return self.strong[0] if self.strong else self.weak[0] if self.weak else None
+
+    def __str__(self):
+        return 'rto=%.3f srtt=%s samples=%d' % (self.rto, self.srtt(), self.samples)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class SizedRequester(coap.Requester):
+    """
+    txthings Requester splitting a request payload in blocks of the size of its Block1 option, if it has one, instead of
+    the module-wide coap.DEFAULT_BLOCK_SIZE_EXP, so that every node gets blocks of its own size.
+
+    The Requester reads the module-wide size only when it extracts the first block, in its constructor; the size of
+    the request is set there for that call alone and the later blocks follow the size the node answers with.
+    """
+
+    def __init__(self, protocol, app_request, *args):
+        block1 = app_request.opt.block1
+        default = coap.DEFAULT_BLOCK_SIZE_EXP
+        if block1 is not None:
+            coap.DEFAULT_BLOCK_SIZE_EXP = block1.size_exponent
+        try:
+            coap.Requester.__init__(self, protocol, app_request, *args)
+        finally:
+            coap.DEFAULT_BLOCK_SIZE_EXP = default
+
+
+class CoapEndpoint(coap.Coap):
+    """
+    CoAP protocol that times retransmissions of each confirmable message with the RTT estimator of its destination.
+    """
+
+    def __init__(self, endpoint, communicator):
+        coap.Coap.__init__(self, endpoint)
+        self.communicator = communicator
+        self.transmissions = {}  # message ID -> [time of first transmission, retransmissions so far]
+
+    def addExchange(self, message):
+        rto = self.communicator.estimator(message.remote).rto
+        timeout = random.uniform(rto, rto * coap.ACK_RANDOM_FACTOR)
+        next_retransmission = self.communicator.clock.callLater(timeout, self.retransmit, message, timeout, 0)
+        self.active_exchanges[message.mid] = (message, next_retransmission)
+        self.transmissions[message.mid] = [self.communicator.clock.seconds(), 0]
+
+    def removeExchange(self, message):
+        sent, next_retransmission = self.active_exchanges.pop(message.mid)
+        next_retransmission.cancel()
+        transmission = self.transmissions.pop(message.mid, None)
+        if transmission is not None:
+            self.communicator.sampled(sent.remote, self.communicator.clock.seconds() - transmission[0], transmission[1])
+
+    def request(self, request, observeCallback=None, block1Callback=None, block2Callback=None,
+                observeCallbackArgs=None, block1CallbackArgs=None, block2CallbackArgs=None,
+                observeCallbackKeywords=None, block1CallbackKeywords=None, block2CallbackKeywords=None):
+        return SizedRequester(self, request, observeCallback, block1Callback, block2Callback,
+                              observeCallbackArgs, block1CallbackArgs, block2CallbackArgs,
+                              observeCallbackKeywords, block1CallbackKeywords, block2CallbackKeywords).deferred
+
+    def sendMessage(self, message):
+        coap.Coap.sendMessage(self, message)
+        self.communicator.telemetry.sent(message.remote, len(message.encode()))
+
+    def datagramReceived(self, data, remote):
+        self.communicator.telemetry.received((ip_address(remote[0]), remote[1]), len(data))
+        coap.Coap.datagramReceived(self, data, remote)
+
+    def retransmit(self, message, timeout, retransmission_counter):
+        self.active_exchanges.pop(message.mid)
+        if retransmission_counter < coap.MAX_RETRANSMIT:
+            address, port = message.remote
+            data = message.encode()
+            self.transport.write(data, (str(address), port))
+            self.communicator.telemetry.retransmitted(message.remote)
+            self.communicator.telemetry.sent(message.remote, len(data))
+            retransmission_counter += 1
+            self.transmissions[message.mid][1] = retransmission_counter
+            timeout *= self.communicator.estimator(message.remote).backoff()
+            next_retransmission = self.communicator.clock.callLater(timeout, self.retransmit, message, timeout, retransmission_counter)
+            self.active_exchanges[message.mid] = (message, next_retransmission)
+        else:
+            self.transmissions.pop(message.mid, None)
+
+
+class Observation(object):
+    __slots__ = ('request', 'token', 'callback')
+
+    def __init__(self, request, token, callback):
+        self.request = request
+        self.token = token
+        self.callback = callback
+
+
+class ObserverRegistry(object):
+    """
+    Installed observations indexed by (NodeID, uri path), with a per-node index of observed paths for bulk removal.
+    """
 
-class Communicator(object):
     def __init__(self):
-        self.tickets = {}
-        self.observers = {}
+        self.entries = {}
+        self.paths = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, to_node, path):
+        return self.entries.get((to_node, path))
+
+    def add(self, to_node, path, request, token, callback):
+        observation = Observation(request, token, callback)
+        self.entries[(to_node, path)] = observation
+        self.paths.setdefault(to_node, set()).add(path)
+        return observation
+
+    def remove(self, to_node, path):
+        observation = self.entries.pop((to_node, path), None)
+        if observation is not None:
+            self.paths[to_node].discard(path)
+            if not self.paths[to_node]:
+                del self.paths[to_node]
+        return observation
+
+    def remove_node(self, to_node):
+        removed = []
+        for path in self.paths.pop(to_node, ()):
+            removed.append(self.entries.pop((to_node, path)))
+        return removed
+
+    def observed(self, to_node):
+        return list(self.paths.get(to_node, ()))
+
+
+class TicketIndex(object):
+    """
+    Two-way index between CoAP tokens and the tickets of the requests they carry.
+
+    Tokens of completed or failed exchanges are marked with expire() and dropped linger seconds later. Expired entries
+    are pruned lazily whenever the index is modified.
+    """
+
+    def __init__(self, linger=10, clock=None):
+        self.linger = linger
+        self.clock = clock if clock else reactor
+        self.by_token = {}
+        self.by_ticket = {}
+        self.expiring = deque()
+
+    def __len__(self):
+        return len(self.by_token)
+
+    def __contains__(self, token):
+        return token in self.by_token
+
+    def bind(self, token, ticket):
+        self.prune()
+        self.unbind(token)
+        self.by_token[token] = ticket
+        self.by_ticket.setdefault(ticket, set()).add(token)
+
+    def unbind(self, token):
+        ticket = self.by_token.pop(token, None)
+        if ticket is not None:
+            tokens = self.by_ticket[ticket]
+            tokens.discard(token)
+            if not tokens:
+                del self.by_ticket[ticket]
+        return ticket
+
+    def ticket(self, token):
+        return self.by_token.get(token)
+
+    def tokens(self, ticket):
+        return list(self.by_ticket.get(ticket, ()))
+
+    def forget(self, ticket):
+        for token in self.by_ticket.pop(ticket, ()):
+            del self.by_token[token]
+
+    def expire(self, token):
+        self.expiring.append((self.clock.seconds() + self.linger, token))
+        self.prune()
+
+    def prune(self):
+        now = self.clock.seconds()
+        while self.expiring and self.expiring[0][0] <= now:
+            self.unbind(self.expiring.popleft()[1])
+
+
+class Communicator(object):
+    """
+    Client of the CoAP resources of the nodes. Requests are exchanged over UDP by :class:`CoapEndpoint`; subclasses may
+    exchange them differently by overriding :func:`endpoint` (see :class:`MemoryCommunicator`). All timers run on clock,
+    the Twisted reactor unless a virtual clock e.g. twisted.internet.task.Clock is given.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock else reactor
+        self.tickets = TicketIndex(clock=self.clock)
+        self.observers = ObserverRegistry()
+        # Negotiated blockwise size exponent per node
+        self.block_sizes = {}
+        # Content-Format of structured payloads tried first with every node, and the nodes that fell back to JSON
+        self.content_format = codec.JSON
+        self.formats = {}
+        # RTT estimators per destination (ip, port)
+        self.estimators = {}
+        self.telemetry = Telemetry(self.clock)
+        # GETs that are queued or in flight, (node, uri) -> [(ticket, callback, errback, priority, timeout)] of requests
+        # waiting on the same reply
+        self.inflight = {}
+        # Deferreds of the exchanges on the wire per ticket, so that they can be cancelled
+        self.exchanges = {}
+        # (node, uri) of the GETs on the wire per ticket
+        self.leading = {}
+        # Timeouts of the GETs waiting on an identical one per ticket
+        self.deadlines = {}
+        # One long-lived CoAP protocol per IP version, multiplexing all exchanges by token and message ID
+        self.protocols = {}
+        self.ports = {}
+        # Reactor shutdown trigger closing the UDP ports, while any are open
+        self.trigger = None
 
     def start(self):
         try:
@@ -35,99 +321,363 @@ class Communicator(object):
         except Exception:
             pass
 
-    def ticket(self, ticket):
-        return self.tickets[ticket] if ticket in self.tickets else None
+    def stop(self):
+        if self.trigger is not None:
+            reactor.removeSystemEventTrigger(self.trigger)
+            self.trigger = None
+        for port in self.ports.values():
+            port.stopListening()
+        self.ports = {}
+        self.protocols = {}
+
+    def _shutdown(self):
+        # The trigger runs once, so it is not to be removed by stop
+        self.trigger = None
+        self.stop()
+
+    def endpoint(self, to_node):
+        version = to_node.ip.version
+        if version not in self.protocols:
+            if self.trigger is None:
+                self.trigger = reactor.addSystemEventTrigger('before', 'shutdown', self._shutdown)
+            protocol = CoapEndpoint(resource.Endpoint(None), self)
+            if version == 6:
+                self.ports[version] = reactor.listenUDP(0, protocol, interface='::')
+            else:
+                self.ports[version] = reactor.listenUDP(0, protocol)
+            self.protocols[version] = protocol
+        return self.protocols[version]
+
+    def estimator(self, remote):
+        if remote not in self.estimators:
+            self.estimators[remote] = RttEstimator()
+        return self.estimators[remote]
+
+    def sampled(self, remote, rtt, retransmissions=0):
+        """
+        Feed the RTT of an acknowledged exchange to the estimator and the telemetry of its destination.
+        """
+        self.estimator(remote).update(rtt, retransmissions)
+        self.telemetry.sampled(remote, rtt)
+
+    def rtt(self, to_node=None):
+        """
+        RTT estimates of one node or of all nodes contacted so far.
+
+        :param to_node: the node to inspect, or None for all nodes
+        :type to_node: NodeID
+        :return: the estimator of to_node, or a dictionary of NodeID -> RttEstimator
+        """
+        if to_node is not None:
+            return self.estimator((to_node.ip, to_node.port))
+        return dict((NodeID(ip, port), estimator) for (ip, port), estimator in self.estimators.items())
+
+    def ticket(self, token):
+        return self.tickets.ticket(token)
 
     def forget(self, ticket):
-        for k, v in self.tickets.items():
-            if v == ticket:
-                del self.tickets[k]
+        self.tickets.forget(ticket)
+
+    def _complete(self, result, token):
+        self.tickets.expire(token)
+        return result
+
+    def _closed(self, result, ticket, remote=None):
+        self.exchanges.pop(ticket, None)
+        self.leading.pop(ticket, None)
+        if remote is not None:
+            self.telemetry.settled(remote)
+        return result
+
+    def cancel(self, ticket):
+        """
+        Abort the request of a ticket. If it is on the wire, its errback fires with defer.CancelledError. The GETs
+        coalesced on it are not aborted: the first of them is sent in its place, with its own priority and the time left
+        to its timeout, and the others wait on it. Installed observations are not affected, see :func:`CANCEL_OBSERVE`.
+
+        :return: True if a pending request was found
+        :rtype: bool
+        """
+        found = False
+        for waiters in self.inflight.values():
+            for waiter in list(waiters):
+                if waiter[0] == ticket:
+                    waiters.remove(waiter)
+                    self._unwait(waiter)
+                    found = True
+        key = self.leading.pop(ticket, None)
+        d = self.exchanges.pop(ticket, None)
+        if d is not None:
+            waiters = self.inflight.pop(key, []) if key is not None else []
+            d.cancel()
+            if waiters:
+                waiter = waiters.pop(0)
+                self.inflight[key] = waiters
+                timeout = self._unwait(waiter)
+                self._submit(key[0], coap.GET, key[1], waiter[0], waiter[1], None, waiter[3], waiter[2], timeout)
+            found = True
+        return found
+
+    def _unwait(self, waiter):
+        """
+        Stop the timeout of a GET that no longer waits on an identical one.
+
+        :return: the time left to its timeout, None if it has none
+        """
+        call = self.deadlines.pop(waiter[0], None)
+        if call is None or not call.active():
+            return waiter[4]
+        call.cancel()
+        return max(call.getTime() - self.clock.seconds(), 0.001)
+
+    def _waited(self, key, ticket):
+        self.deadlines.pop(ticket, None)
+        for waiter in self.inflight.get(key, []):
+            if waiter[0] == ticket:
+                self.inflight[key].remove(waiter)
+                if waiter[2] is not None:
+                    defer.maybeDeferred(waiter[2], failure.Failure(defer.TimeoutError(waiter[4], 'Waiting on ' + key[1])), ticket)
                 return
 
-    def request(self, to_node, operation, uri, ticket, callback, payload=None):
-        if not payload:
-            payload = ''
+    def payload_format(self, to_node):
+        """
+        Content-Format of the payloads exchanged with a node. Nodes start at content_format and fall back to JSON
+        whenever they reply with 4.15 (Unsupported Content-Format) or 4.06 (Not Acceptable).
+
+        :rtype: int
+        """
+        return self.formats.get(to_node, self.content_format)
+
+    def block_size(self, to_node):
+        """
+        Size exponent of the blocks exchanged with a node. Nodes start at the largest size and fall back to smaller
+        blocks whenever they reply with 4.13 (Request Entity Too Large), to the size of its Size1 option if given. Lost or
+        timed out exchanges leave the size as it is.
+
+        :rtype: int (block size is 2**(exponent+4) bytes)
+        """
+        return self.block_sizes.get(to_node, coap.DEFAULT_BLOCK_SIZE_EXP)
+
+    def _shrink(self, to_node, size1=None):
+        size_exp = self.block_size(to_node)
+        if size1:
+            size_exp = min(size_exp - 1, int(math.log(size1, 2)) - 4)
+        else:
+            size_exp -= 1
+        self.block_sizes[to_node] = max(MIN_BLOCK_SIZE_EXP, size_exp)
+        return self.block_sizes[to_node]
+
+    def _send(self, to_node, operation, uri, payload, token=None, notify=None):
         tmp = uri.split('?')
-        if operation == coap.OBSERVE and to_node in self.observers:
-            for req in self.observers[to_node]:
-                tmp_path = ""
-                first_item = True
-                for x in req.opt.uri_path:
-                    if not first_item:
-                        tmp_path += "/"
-                    tmp_path += x
-                    first_item = False
-                if len(tmp) > 0 and tmp_path == tmp[0]:
-                    return
-
-        req = coap.Message(mtype=coap.CON, code=operation if operation != coap.OBSERVE else coap.GET, payload=payload)
+        content_format = self.payload_format(to_node)
+        # Structured payloads are encoded for the node, strings are sent as they are
+        body = payload if isinstance(payload, basestring) else codec.codec_of(content_format).encode(payload)
+        req = coap.Message(mtype=coap.CON, code=operation if operation != coap.OBSERVE else coap.GET, payload=body)
         req.opt.uri_path = tmp[0].split('/')
         if len(tmp) == 2:
             req.opt.uri_query = tmp[1].split('&')
         req.remote = (to_node.ip, to_node.port)
-        # request.opt.accept = coap.media_types_rev['application/json']
-        # request.opt.content_format = coap.media_types_rev['application/json']
-        protocol = coap.Coap(resource.Endpoint(None))
-        if to_node.ip.version == 6:
-            reactor.listenUDP(0, protocol, interface='::')
-        else:
-            reactor.listenUDP(0, protocol)
-        d = protocol.request(req)
+        if content_format != codec.JSON:
+            # JSON goes without options, as the nodes have always been addressed
+            req.opt.accept = content_format
+            if not isinstance(payload, basestring):
+                req.opt.content_format = content_format
+        size_exp = self.block_size(to_node)
+        if operation in (coap.GET, coap.OBSERVE):
+            req.opt.block2 = (0, False, size_exp)
+        elif len(body) > 2 ** (size_exp + 4):
+            # The payload goes in blocks of the size of the node, see SizedRequester
+            req.opt.block1 = (0, True, size_exp)
         if operation == coap.OBSERVE:
+            # Register at the node; its notifications are passed to notify
             req.opt.observe = 0
+        blocks = [1]
+
+        def count(response):
+            blocks[0] += 1
+            return defer.succeed(response)
+
+        d = self.endpoint(to_node).request(req, observeCallback=notify, block1Callback=count, block2Callback=count)
+        d.addBoth(self._transferred, to_node, operation, uri, payload, token if token else req.token, size_exp, blocks, notify, content_format)
+        return req, d
+
+    def _transferred(self, result, to_node, operation, uri, payload, token, size_exp, blocks, notify=None, content_format=codec.JSON):
+        if not isinstance(result, coap.Message):
+            return result
+        self.telemetry.answered((to_node.ip, to_node.port), result.code)
+        # Assembled blockwise responses carry the token of their last block
+        result.token = token
+        result.blocks = blocks[0]
+        if result.code == coap.REQUEST_ENTITY_TOO_LARGE and size_exp > MIN_BLOCK_SIZE_EXP:
+            size1 = result.opt.getOption(60)
+            if self.block_size(to_node) == size_exp:
+                self._shrink(to_node, size1[0].value if size1 else None)
+            logg.debug(str(to_node) + " refused blocks of " + str(2 ** (size_exp + 4)) + " bytes, retrying with " + str(2 ** (self.block_size(to_node) + 4)))
+            return self._retry(to_node, operation, uri, payload, token, notify)
+        if result.code in (coap.UNSUPPORTED_CONTENT_FORMAT, coap.NOT_ACCEPTABLE) and content_format != codec.JSON:
+            self.formats[to_node] = codec.JSON
+            logg.debug(str(to_node) + " refused Content-Format " + str(content_format) + ", falling back to JSON")
+            return self._retry(to_node, operation, uri, payload, token, notify)
+        block2 = result.opt.block2
+        if block2 is not None and block2.size_exponent < self.block_size(to_node):
+            self.block_sizes[to_node] = max(MIN_BLOCK_SIZE_EXP, block2.size_exponent)
+        if blocks[0] > 1:
+            logg.debug(str(to_node) + " " + uri + " took " + str(blocks[0]) + " blocks of " + str(2 ** (size_exp + 4)) + " bytes")
+        return result
+
+    def _retry(self, to_node, operation, uri, payload, token, notify=None):
+        """
+        Send a request again after the node refused its block size or Content-Format. The retry goes with a token of
+        its own, which is bound to the ticket of the first token; an observation is moved to the retry, so that the
+        notifications it brings reach their ticket and CANCEL_OBSERVE deregisters the right token.
+
+        :param token: the token of the first request
+        :return: the Deferred of the retry
+        """
+        req, d = self._send(to_node, operation, uri, payload, token, notify)
+        ticket = self.tickets.ticket(token)
+        if ticket is not None:
+            self.tickets.bind(req.token, ticket)
+        if operation == coap.OBSERVE:
+            observation = self.observers.get(to_node, uri.split('?')[0])
+            if observation is not None:
+                observation.request = req
+                observation.token = req.token
+        elif ticket is not None:
+            d.addBoth(self._complete, req.token)
+        return d
+
+    def request(self, to_node, operation, uri, ticket, callback, payload=None, errback=None, timeout=None):
+        if not payload:
+            payload = ''
+        tmp = uri.split('?')
+        if operation == coap.OBSERVE and (to_node, tmp[0]) in self.observers:
+            return
+
+        notify = None
+        if operation == coap.OBSERVE and callback is not None:
+            notify = lambda response: defer.maybeDeferred(callback, response)
+        try:
+            req, d = self._send(to_node, operation, uri, payload, notify=notify)
+        except Exception:
+            # Nothing was sent: fail the request and the GETs waiting on it, so that later GETs are sent again
+            reason = failure.Failure()
+            logg.error('Request ' + uri + ' to ' + str(to_node) + ' could not be sent: ' + reason.getErrorMessage())
+            if operation == coap.GET:
+                self._settle(reason, (to_node, uri))
+            if errback is not None:
+                defer.maybeDeferred(errback, reason, ticket)
+            return
+        if timeout:
+            # An exchange not answered in time fails with defer.TimeoutError
+            d.addTimeout(timeout, self.clock)
+        d.addErrback(self._timed_out, req.remote)
+        if operation == coap.GET:
+            d.addBoth(self._settle, (to_node, uri))
+            self.leading[ticket] = (to_node, uri)
+        if operation == coap.OBSERVE:
             # d = protocol.request(request)
             # requester = coap.Requester(protocol, request, observeCallback=callback, block1Callback=None, block2Callback=None, observeCallbackArgs=None, block1CallbackArgs=None, block2CallbackArgs=None, observeCallbackKeywords=None, block1CallbackKeywords=None, block2CallbackKeywords=None)
-            if to_node not in self.observers:
-                self.observers[to_node] = [req]
-            else:
-                self.observers[to_node] += [req]
+            self.observers.add(to_node, tmp[0], req, req.token, callback)
         else:
             req.opt.observe = 0
         # d = protocol.request(request)
         # requester = coap.Requester(protocol, request, observeCallback=None, block1Callback=None, block2Callback=None, observeCallbackArgs=None, block1CallbackArgs=None, block2CallbackArgs=None, observeCallbackKeywords=None, block1CallbackKeywords=None, block2CallbackKeywords=None)
-        if callback is not None:
+        if callback is not None and errback is not None:
+            d.addCallbacks(callback, errback, errbackArgs=(ticket,))
+        elif callback is not None:
             d.addCallback(callback)
+        elif errback is not None:
+            d.addErrback(errback, ticket)
         # requester.deferred.addCallback(callback)
-        self.tickets[req.token] = ticket
-        self.start()
+        if operation != coap.OBSERVE:
+            d.addBoth(self._complete, req.token)
+        self.telemetry.requested(req.remote, coap.requests.get(operation, 'OBSERVE'), tmp[0])
+        self.exchanges[ticket] = d
+        d.addBoth(self._closed, ticket, req.remote)
+        self.tickets.bind(req.token, ticket)
 
-    def GET(self, to_node, uri, ticket, callback):
-        reactor.callWhenRunning(self.request, to_node, coap.GET, uri, ticket, callback)
+    def _submit(self, to_node, operation, uri, ticket, callback, payload=None, priority=None, errback=None, timeout=None):
+        self.clock.callLater(0, self.request, to_node, operation, uri, ticket, callback, payload, errback, timeout)
+
+    def _timed_out(self, reason, remote):
+        if reason.check(RequestTimedOut, defer.TimeoutError):
+            self.telemetry.timed_out(remote)
+        return reason
+
+    def _settle(self, response, key):
+        waiters = self.inflight.pop(key, [])
+        for waiter in waiters:
+            self._unwait(waiter)
+        if not isinstance(response, coap.Message):
+            for ticket, callback, errback, priority, timeout in waiters:
+                if errback is not None:
+                    defer.maybeDeferred(errback, response, ticket)
+            return response
+        for ticket, callback, errback, priority, timeout in waiters:
+            # Every coalesced request sees the reply under a token of its own, so that it can be traced to its ticket
+            reply = copy.copy(response)
+            reply.token = response.token + '#' + str(ticket)
+            self.tickets.bind(reply.token, ticket)
+            if callback is not None:
+                defer.maybeDeferred(callback, reply).addBoth(self._complete, reply.token)
+            else:
+                self.tickets.expire(reply.token)
+        return response
 
-    def OBSERVE(self, to_node, uri, ticket, callback):
-        reactor.callWhenRunning(self.request, to_node, coap.OBSERVE, uri, ticket, callback)
+    def GET(self, to_node, uri, ticket, callback, priority=None, errback=None, timeout=None):
+        """
+        Request a resource of a node. A GET identical to one queued or on the wire is not sent: it waits on the reply of
+        the other one, or fails with defer.TimeoutError once its own timeout expires, whichever comes first.
+
+        Identical requests of the sessions of a :class:`core.schedule.Reflector` are merged before they get here (see
+        :func:`core.schedule.Reflector._flush`), but only those gathered in the same outbox flush. This covers the GETs
+        sent while an identical one is still waiting for its reply, and the callers outside a Reflector.
+        """
+        key = (to_node, uri)
+        if key in self.inflight:
+            self.inflight[key].append((ticket, callback, errback, priority, timeout))
+            if timeout:
+                self.deadlines[ticket] = self.clock.callLater(timeout, self._waited, key, ticket)
+            return
+        self.inflight[key] = []
+        self._submit(to_node, coap.GET, uri, ticket, callback, None, priority, errback, timeout)
+
+    def OBSERVE(self, to_node, uri, ticket, callback, priority=None, errback=None, timeout=None):
+        self._submit(to_node, coap.OBSERVE, uri, ticket, callback, None, priority, errback, timeout)
 
     def CANCEL_OBSERVE(self, to_node, uri, ticket, callback):
-        protocol = coap.Coap(resource.Endpoint(None))
-        ver = netaddr.IPAddress(to_node.ip).version
-        if ver == 6:
-            reactor.listenUDP(0, protocol, interface='::')
-        else:
-            reactor.listenUDP(0, protocol)
-        tmp = uri.split('?')
-        for req in self.observers[to_node]:
-            tmp_path = ""
-            first_item = True
-            for x in req.opt.uri_path:
-                if not first_item:
-                    tmp_path += "/"
-                tmp_path += x
-                first_item = False
-            if len(tmp) > 0 and tmp_path == tmp[0]:
-                req.opt.observe = 1
-                requester = coap.Requester(protocol, req, observeCallback=None, block1Callback=None,
-                                           block2Callback=None, observeCallbackArgs=None, block1CallbackArgs=None,
-                                           block2CallbackArgs=None, observeCallbackKeywords=None,
-                                           block1CallbackKeywords=None, block2CallbackKeywords=None)
-                if callback is not None:
-                    requester.deferred.addCallback(callback)
-                self.forget(ticket)
-
-    def POST(self, to_node, uri, payload, ticket, callback):
-        reactor.callWhenRunning(self.request, to_node, coap.POST, uri, ticket, callback, payload)
-
-    def DELETE(self, to_node, uri, ticket, callback):
-        reactor.callWhenRunning(self.request, to_node, coap.GET, uri, ticket, callback)
+        protocol = self.endpoint(to_node)
+        observation = self.observers.remove(to_node, uri.split('?')[0])
+        if observation is not None:
+            protocol.observations.pop((observation.token, observation.request.remote), None)
+            req = observation.request
+            req.opt.observe = 1
+            req.mid = None
+            d = protocol.request(req)
+            if callback is not None:
+                d.addCallback(callback)
+            self.forget(ticket)
+
+    def forget_node(self, to_node):
+        """
+        Drop every observation installed at a node e.g. once it has disconnected, without contacting the node.
+
+        :return: the removed observations
+        :rtype: list of Observation
+        """
+        observations = self.observers.remove_node(to_node)
+        for observation in observations:
+            self.tickets.unbind(observation.token)
+            for protocol in self.protocols.values():
+                protocol.observations.pop((observation.token, observation.request.remote), None)
+        return observations
+
+    def POST(self, to_node, uri, payload, ticket, callback, priority=None, errback=None, timeout=None):
+        self._submit(to_node, coap.POST, uri, ticket, callback, payload, priority, errback, timeout)
+
+    def DELETE(self, to_node, uri, ticket, callback, priority=None, errback=None, timeout=None):
+        self._submit(to_node, coap.DELETE, uri, ticket, callback, None, priority, errback, timeout)
 
     def test_callable(self, response):
         print(str(self.ticket(response.ticket)) + ' = ' + response.remote[0] + ':' + str(
@@ -140,38 +690,680 @@ class LazyCommunicator(Communicator):
         self.delay = delay
         self.timestamp = time.time()
 
-    def GET(self, to_node, uri, ticket, callback):
+    def GET(self, to_node, uri, ticket, callback, priority=None, errback=None, timeout=None):
         tmp = time.time() - self.timestamp - self.delay
         if tmp >= 0:
             self.timestamp = time.time()
-            reactor.callWhenRunning(self.request, to_node, coap.GET, uri, ticket, callback)
+            reactor.callWhenRunning(self.request, to_node, coap.GET, uri, ticket, callback, None, errback, timeout)
         else:
             self.timestamp += self.delay
-            reactor.callLater(-tmp, self.request, to_node, coap.GET, uri, ticket, callback)
+            reactor.callLater(-tmp, self.request, to_node, coap.GET, uri, ticket, callback, None, errback, timeout)
 
-    def OBSERVE(self, to_node, uri, ticket, callback):
+    def OBSERVE(self, to_node, uri, ticket, callback, priority=None, errback=None, timeout=None):
         tmp = time.time() - self.timestamp - self.delay
         if tmp >= 0:
             self.timestamp = time.time()
-            reactor.callWhenRunning(self.request, to_node, coap.OBSERVE, uri, ticket, callback)
+            reactor.callWhenRunning(self.request, to_node, coap.OBSERVE, uri, ticket, callback, None, errback, timeout)
         else:
             self.timestamp += self.delay
-            reactor.callLater(-tmp, self.request, to_node, coap.OBSERVE, uri, ticket, callback)
+            reactor.callLater(-tmp, self.request, to_node, coap.OBSERVE, uri, ticket, callback, None, errback, timeout)
 
-    def POST(self, to_node, uri, payload, ticket, callback):
+    def POST(self, to_node, uri, payload, ticket, callback, priority=None, errback=None, timeout=None):
         tmp = time.time() - self.timestamp - self.delay
         if tmp >= 0:
             self.timestamp = time.time()
-            reactor.callWhenRunning(self.request, to_node, coap.POST, uri, ticket, callback, payload)
+            reactor.callWhenRunning(self.request, to_node, coap.POST, uri, ticket, callback, payload, errback, timeout)
         else:
             self.timestamp += self.delay
-            reactor.callLater(-tmp, self.request, to_node, coap.POST, uri, ticket, callback, payload)
+            reactor.callLater(-tmp, self.request, to_node, coap.POST, uri, ticket, callback, payload, errback, timeout)
 
-    def DELETE(self, to_node, uri, ticket, callback):
+    def DELETE(self, to_node, uri, ticket, callback, priority=None, errback=None, timeout=None):
         tmp = time.time() - self.timestamp - self.delay
         if tmp >= 0:
             self.timestamp = time.time()
-            reactor.callWhenRunning(self.request, to_node, coap.DELETE, uri, ticket, callback)
+            reactor.callWhenRunning(self.request, to_node, coap.DELETE, uri, ticket, callback, None, errback, timeout)
         else:
             self.timestamp += self.delay
-            reactor.callLater(-tmp, self.request, to_node, coap.DELETE, uri, ticket, callback)
+            reactor.callLater(-tmp, self.request, to_node, coap.DELETE, uri, ticket, callback, None, errback, timeout)
+
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst, clock=None):
+        self.clock = clock if clock else reactor
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.timestamp = self.clock.seconds()
+
+    def refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def ready(self):
+        self.refill()
+        # Tolerate rounding errors, or a refill of (1-tokens)/rate sec may fall short of a full token
+        return self.tokens >= 1 - 1e-9
+
+    def consume(self):
+        self.tokens -= 1
+
+    def wait(self):
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class PacedCommunicator(Communicator):
+    """
+    Communicator pacing outbound requests with token buckets instead of one network-wide delay.
+
+    Every destination node has its own bucket of rate requests/sec and burst size. If a subtree function is given, it maps
+    a node to the key of the bottleneck it sits behind (e.g. the branch of the DoDAG it belongs to) and all nodes with the
+    same key additionally share a bucket of subtree_rate and subtree_burst. A request is sent only when both its buckets
+    hold a token, so disjoint subtrees are addressed in parallel while a shared link is still protected.
+
+    Requests carry a priority class (TOPOLOGY, SCHEDULE or MONITORING of :mod:`core.interface`). Whenever the buckets let
+    more than one class through, the class is picked by smooth weighted round robin over the classes with a sendable
+    request, so topology control overtakes a backlog of monitoring polls without starving it. Within a class the oldest
+    sendable request goes first.
+    """
+
+    WEIGHTS = {TOPOLOGY: 8, SCHEDULE: 4, MONITORING: 1}
+    """Default share of the sending opportunities per priority class"""
+
+    def __init__(self, rate, burst=1, subtree=None, subtree_rate=None, subtree_burst=None, weights=None, clock=None):
+        super(PacedCommunicator, self).__init__(clock)
+        self.rate = rate
+        self.burst = burst
+        self.subtree = subtree
+        self.subtree_rate = subtree_rate if subtree_rate else rate
+        self.subtree_burst = subtree_burst if subtree_burst else burst
+        self.weights = dict(weights) if weights else dict(PacedCommunicator.WEIGHTS)
+        self.credits = dict((priority, 0) for priority in self.weights)
+        self.buckets = {}
+        self.subtree_buckets = {}
+        self.pending = {}  # {priority: {NodeID: deque of (sequence number, request arguments)}}
+        self.sequence = 0
+        self.pacer = None
+
+    def _subtree_of(self, to_node):
+        return self.subtree(to_node) if self.subtree else None
+
+    def _bucket(self, to_node):
+        if to_node not in self.buckets:
+            self.buckets[to_node] = TokenBucket(self.rate, self.burst, self.clock)
+        return self.buckets[to_node]
+
+    def _subtree_bucket(self, key):
+        if key is None:
+            return None
+        if key not in self.subtree_buckets:
+            self.subtree_buckets[key] = TokenBucket(self.subtree_rate, self.subtree_burst, self.clock)
+        return self.subtree_buckets[key]
+
+    def _ready(self, to_node):
+        shared = self._subtree_bucket(self._subtree_of(to_node))
+        return self._bucket(to_node).ready() and (shared is None or shared.ready())
+
+    def _consume(self, to_node):
+        self._bucket(to_node).consume()
+        shared = self._subtree_bucket(self._subtree_of(to_node))
+        if shared is not None:
+            shared.consume()
+
+    def _wait(self, to_node):
+        shared = self._subtree_bucket(self._subtree_of(to_node))
+        return max(self._bucket(to_node).wait(), shared.wait() if shared is not None else 0.0)
+
+    def _pick(self, priorities):
+        """
+        Smooth weighted round robin: every contending class earns its weight, the richest one is served and pays the
+        total weight of the contenders.
+        """
+        total = 0
+        chosen = None
+        for priority in priorities:
+            self.credits[priority] += self.weights[priority]
+            total += self.weights[priority]
+            if chosen is None or (self.credits[priority], -priority) > (self.credits[chosen], -chosen):
+                chosen = priority
+        self.credits[chosen] -= total
+        return chosen
+
+    def _submit(self, to_node, operation, uri, ticket, callback, payload=None, priority=None, errback=None, timeout=None):
+        if priority is None:
+            priority = SCHEDULE
+        if priority not in self.weights:
+            self.weights[priority] = 1
+            self.credits[priority] = 0
+        queues = self.pending.setdefault(priority, {})
+        if to_node not in queues:
+            queues[to_node] = deque()
+        self.sequence += 1
+        queues[to_node].append((self.sequence, (to_node, operation, uri, ticket, callback, payload, errback, timeout)))
+        if self.pacer is None:
+            self.pacer = self.clock.callLater(0, self._drain)
+
+    def _drain(self):
+        self.pacer = None
+        while True:
+            # The oldest request of every class whose destination may be addressed right now
+            heads = {}
+            for priority, queues in self.pending.items():
+                head = None
+                for to_node, queue in queues.items():
+                    if (head is None or queue[0][0] < head[0]) and self._ready(to_node):
+                        head = (queue[0][0], to_node)
+                if head is not None:
+                    heads[priority] = head[1]
+            if not heads:
+                break
+            priority = self._pick(heads.keys())
+            to_node = heads[priority]
+            self._consume(to_node)
+            queue = self.pending[priority][to_node]
+            request = queue.popleft()[1]
+            if not queue:
+                del self.pending[priority][to_node]
+                if not self.pending[priority]:
+                    del self.pending[priority]
+            self.request(*request)
+        wait = None
+        for queues in self.pending.values():
+            for to_node in queues:
+                delay = self._wait(to_node)
+                wait = delay if wait is None else min(wait, delay)
+        if wait is not None:
+            self.pacer = self.clock.callLater(wait, self._drain)
+
+    def cancel(self, ticket):
+        for priority, queues in self.pending.items():
+            for to_node, queue in queues.items():
+                for position, (sequence, request) in enumerate(queue):
+                    if request[3] != ticket:
+                        continue
+                    key = (to_node, request[2])
+                    if request[1] == coap.GET and self.inflight.get(key):
+                        # A GET coalesced on the cancelled one takes its place in the queue, with the time left to its timeout
+                        waiter = self.inflight[key].pop(0)
+                        queue[position] = (sequence, request[:3] + (waiter[0], waiter[1], request[5], waiter[2], self._unwait(waiter)))
+                        return True
+                    if request[1] == coap.GET:
+                        self.inflight.pop(key, None)
+                    del queue[position]
+                    if not queue:
+                        del queues[to_node]
+                        if not queues:
+                            del self.pending[priority]
+                    return True
+        return super(PacedCommunicator, self).cancel(ticket)
+
+    def queue_depth(self):
+        """
+        Number of requests waiting per bucket and per priority class.
+
+        :return: {'node': {NodeID: depth}, 'subtree': {subtree key: depth}, 'priority': {class: depth}}
+        :rtype: dict
+        """
+        nodes = {}
+        subtrees = {}
+        priorities = {}
+        for priority, queues in self.pending.items():
+            for to_node, queue in queues.items():
+                nodes[to_node] = nodes.get(to_node, 0) + len(queue)
+                priorities[priority] = priorities.get(priority, 0) + len(queue)
+                key = self._subtree_of(to_node)
+                if key is not None:
+                    subtrees[key] = subtrees.get(key, 0) + len(queue)
+        return {'node': nodes, 'subtree': subtrees, 'priority': priorities}
+
+
+class MemoryEndpoint(object):
+    """
+    In-process stand-in of :class:`CoapEndpoint` delivering requests to the nodes of a :class:`util.emulator.Fleet` on
+    the fleet's clock. A request is answered after the round trip time of its node. Lost requests are retransmitted as
+    CoAP would and fail with RequestTimedOut after MAX_RETRANSMIT retransmissions. Observations are kept per
+    (token, remote) like txthings does, and a notification follows every change of an observed resource.
+    """
+
+    def __init__(self, communicator, fleet):
+        self.communicator = communicator
+        self.fleet = fleet
+        self.clock = fleet.clock
+        self.observations = {}
+        self.listening = set()
+        self.notifications = 0
+        self.message_id = fleet.random.randint(0, 65535)
+        self.token = fleet.random.randint(0, 65535)
+
+    def nextMessageID(self):
+        message_id = self.message_id
+        self.message_id = 0xFFFF & (1 + self.message_id)
+        return message_id
+
+    def nextToken(self):
+        self.token = (self.token + 1) & 0xffffffffffffffff
+        return codecs.decode(b"%08x" % self.token, "hex")
+
+    def request(self, req, observeCallback=None, block1Callback=None, block2Callback=None, **kwargs):
+        req.token = self.nextToken()
+        req.mid = self.nextMessageID()
+        d = defer.Deferred()
+        self._transmit(req, d, observeCallback, 0, self.clock.seconds())
+        return d
+
+    def _transmit(self, req, d, observeCallback, retransmissions, sent):
+        if d.called:
+            return
+        if retransmissions:
+            self.communicator.telemetry.retransmitted(req.remote)
+        self.communicator.telemetry.sent(req.remote, len(req.encode()))
+        node = self.fleet.node_at(req.remote[0])
+        if node is None or not node.online or self.fleet.random.random() < self.fleet.loss:
+            timeout = coap.ACK_TIMEOUT * 2 ** retransmissions
+            if retransmissions < coap.MAX_RETRANSMIT:
+                self.clock.callLater(timeout, self._transmit, req, d, observeCallback, retransmissions + 1, sent)
+            else:
+                self.clock.callLater(timeout, self._expire, d)
+            return
+        self.clock.callLater(self.fleet.delay(node), self._respond, node, req, d, observeCallback, retransmissions, sent)
+
+    def _expire(self, d):
+        if not d.called:
+            d.errback(RequestTimedOut())
+
+    def _answer(self, node, req):
+        response = node.serve(req)
+        response.mtype = coap.ACK
+        response.mid = req.mid
+        response.token = req.token
+        response.remote = req.remote
+        self.communicator.telemetry.received(req.remote, len(response.encode()))
+        return response
+
+    def _respond(self, node, req, d, observeCallback, retransmissions, sent):
+        if d.called:
+            return
+        self.communicator.sampled(req.remote, self.clock.seconds() - sent, retransmissions)
+        response = self._answer(node, req)
+        if observeCallback is not None and req.opt.observe == 0 and response.code == coap.CONTENT:
+            response.opt.observe = 0
+            self.observations[(req.token, req.remote)] = (observeCallback, node, req)
+            if node not in self.listening:
+                self.listening.add(node)
+                node.listeners.append(lambda path: self._changed(node, path))
+        d.callback(response)
+
+    def _changed(self, node, path):
+        for key, (callback, observed, req) in self.observations.items():
+            if observed is node and tuple(req.opt.uri_path[:len(path)]) == path:
+                self.clock.callLater(self.fleet.delay(node), self._notify, key)
+
+    def _notify(self, key):
+        if key not in self.observations:
+            return
+        callback, node, req = self.observations[key]
+        if not node.online:
+            return
+        response = self._answer(node, req)
+        self.notifications += 1
+        response.opt.observe = self.notifications
+        callback(response)
+
+
+class MemoryCommunicator(PacedCommunicator):
+    """
+    Communicator exchanging requests with an emulated :class:`util.emulator.Fleet` in-process instead of over UDP. The
+    responses reach the same callbacks as the real ones, on the clock of the fleet. With a twisted.internet.task.Clock
+    the exchanges are repeatable (for a given seed of the fleet) and run as fast as the clock is advanced e.g.::
+
+        clock = task.Clock()
+        fleet = Fleet(200, seed=1, clock=clock)
+        scheduler = SchedulerInterface('net', fleet.root.eui64, 5684, 'aaaa', client=MemoryCommunicator(fleet, 5))
+        fleet.start(listen=False)
+        scheduler.start()
+        clock.pump([0.01] * 10000)
+    """
+
+    def __init__(self, fleet, rate, burst=1, subtree=None, subtree_rate=None, subtree_burst=None, weights=None):
+        super(MemoryCommunicator, self).__init__(rate, burst, subtree, subtree_rate, subtree_burst, weights, fleet.clock)
+        self.fleet = fleet
+
+    def endpoint(self, to_node):
+        version = to_node.ip.version
+        if version not in self.protocols:
+            self.protocols[version] = MemoryEndpoint(self, self.fleet)
+        return self.protocols[version]
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.protocols = {}
+
+
+class LoopClock(object):
+    """
+    Twisted-style clock over an asyncio event loop. Deferred timeouts, LoopingCalls and the pacing of the communicators
+    take it in place of the reactor, so that they run on the loop.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def seconds(self):
+        return self.loop.time()
+
+    def callLater(self, delay, f, *args, **kw):
+        return LoopCall(self, delay, f, args, kw)
+
+
+class LoopCall(object):
+    """
+    Call scheduled on a :class:`LoopClock`, with the interface of twisted.internet.base.DelayedCall that the client uses.
+    """
+
+    def __init__(self, clock, delay, f, args, kw):
+        self.time = clock.seconds() + max(delay, 0)
+        self.f = f
+        self.args = args
+        self.kw = kw
+        self.called = False
+        self.cancelled = False
+        self.handle = clock.loop.call_at(self.time, self._run)
+
+    def _run(self):
+        self.called = True
+        self.f(*self.args, **self.kw)
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled
+        elif self.called:
+            raise error.AlreadyCalled
+        self.cancelled = True
+        self.handle.cancel()
+
+
+class AsyncioEndpoint(object):
+    """
+    CoAP client over an asyncio datagram endpoint, the counterpart of :class:`CoapEndpoint` for
+    :class:`AsyncioCommunicator`. Confirmable messages are retransmitted with the RTT estimator of their destination and
+    fail with RequestTimedOut after MAX_RETRANSMIT retransmissions. Blockwise transfers are carried out in both
+    directions, in blocks of the size of the Block1 option of a request if it has one, and observations are kept per
+    (token, remote) like txthings does.
+    """
+
+    def __init__(self, communicator):
+        self.communicator = communicator
+        self.clock = communicator.clock
+        self.transport = None
+        # Datagrams written before the socket was bound
+        self.backlog = []
+        self.message_id = random.randint(0, 65535)
+        self.token = random.randint(0, 65535)
+        # Confirmable messages waiting for their ACK, message ID -> [message, retransmission, first sent, retransmissions]
+        self.exchanges = {}
+        # Requests waiting for their response, (token, remote) -> Deferred
+        self.outgoing = {}
+        # Installed observations, (token, remote) -> (callback, uri path)
+        self.observations = {}
+        # Confirmable and non-confirmable messages received lately, (message ID, remote) -> ACK sent in reply
+        self.recent = {}
+
+    def nextMessageID(self):
+        message_id = self.message_id
+        self.message_id = 0xFFFF & (1 + self.message_id)
+        return message_id
+
+    def nextToken(self):
+        self.token = (self.token + 1) & 0xffffffffffffffff
+        return codecs.decode(b"%08x" % self.token, "hex")
+
+    def connection_made(self, transport):
+        self.transport = transport
+        backlog, self.backlog = self.backlog, []
+        for data, target in backlog:
+            transport.sendto(data, target)
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+    def error_received(self, exc):
+        logg.debug("Datagram endpoint error: " + str(exc))
+
+    def close(self):
+        for exchange in self.exchanges.values():
+            exchange[1].cancel()
+        self.exchanges = {}
+        if self.transport is not None:
+            self.transport.close()
+
+    def _write(self, message):
+        address, port = message.remote
+        data = message.encode()
+        if self.transport is None:
+            self.backlog.append((data, (str(address), port)))
+        else:
+            self.transport.sendto(data, (str(address), port))
+        self.communicator.telemetry.sent(message.remote, len(data))
+
+    def _reply(self, message, mtype):
+        reply = coap.Message(mtype=mtype, mid=message.mid, code=coap.EMPTY)
+        reply.remote = message.remote
+        self._write(reply)
+        return reply
+
+    def request(self, req, observeCallback=None, block1Callback=None, block2Callback=None, **kwargs):
+        size_exp = req.opt.block1.size_exponent if req.opt.block1 is not None else coap.DEFAULT_BLOCK_SIZE_EXP
+        if len(req.payload) > 2 ** (size_exp + 4):
+            first = req.extractBlock(0, size_exp)
+            req.opt.block1 = first.opt.block1
+        else:
+            first = req
+        d = self._exchange(first)
+        # The request carries the token of its first block, like a txthings request does
+        req.token = first.token
+        if observeCallback is not None and req.opt.observe is not None:
+            d.addCallback(self._observed, observeCallback, req.opt.uri_path)
+        d.addCallback(self._block1, req, block1Callback)
+        d.addCallback(self._block2, req, block2Callback)
+        return d
+
+    def _exchange(self, message):
+        if message.mtype is None:
+            message.mtype = coap.CON
+        message.token = self.nextToken()
+        message.mid = self.nextMessageID()
+        key = (message.token, message.remote)
+        d = defer.Deferred(lambda d: self._abandon(key, message.mid))
+        self.outgoing[key] = d
+        self._write(message)
+        if message.mtype == coap.CON:
+            rto = self.communicator.estimator(message.remote).rto
+            timeout = random.uniform(rto, rto * coap.ACK_RANDOM_FACTOR)
+            retransmission = self.clock.callLater(timeout, self._retransmit, message.mid, timeout)
+            self.exchanges[message.mid] = [message, retransmission, self.clock.seconds(), 0]
+        return d
+
+    def _abandon(self, key, mid):
+        self.outgoing.pop(key, None)
+        exchange = self.exchanges.pop(mid, None)
+        if exchange is not None:
+            exchange[1].cancel()
+
+    def _retransmit(self, mid, timeout):
+        exchange = self.exchanges[mid]
+        message = exchange[0]
+        if exchange[3] < coap.MAX_RETRANSMIT:
+            exchange[3] += 1
+            timeout *= self.communicator.estimator(message.remote).backoff()
+            exchange[1] = self.clock.callLater(timeout, self._retransmit, mid, timeout)
+            self._write(message)
+            self.communicator.telemetry.retransmitted(message.remote)
+        else:
+            del self.exchanges[mid]
+            d = self.outgoing.pop((message.token, message.remote), None)
+            if d is not None:
+                d.errback(RequestTimedOut())
+
+    def _observed(self, response, callback, path):
+        if response.opt.observe is not None:
+            self.observations[(response.token, response.remote)] = (callback, path)
+        return response
+
+    def _block1(self, response, req, block1Callback):
+        block1 = response.opt.block1
+        if req.opt.block1 is None or block1 is None or response.code != coap.CONTINUE:
+            return response
+        size_exp = min(block1.size_exponent, req.opt.block1.size_exponent)
+        number = (req.opt.block1.block_number + 1) * 2 ** (req.opt.block1.size_exponent - size_exp)
+        block = req.extractBlock(number, size_exp)
+        if block is None:
+            return response
+        req.opt.block1 = block.opt.block1
+        d = block1Callback(response) if block1Callback is not None else defer.succeed(response)
+        d.addCallback(lambda _: self._exchange(block))
+        d.addCallback(self._block1, req, block1Callback)
+        return d
+
+    def _block2(self, response, req, block2Callback, assembled=None):
+        block2 = response.opt.block2
+        if block2 is None:
+            return response if assembled is None else defer.fail(txerror.MissingBlock2Option())
+        if assembled is None:
+            if block2.block_number != 0:
+                return defer.fail(txerror.NotImplemented())
+            assembled = response
+        else:
+            try:
+                assembled.appendResponseBlock(response)
+            except txerror.Error as e:
+                return defer.fail(e)
+        if not block2.more:
+            return assembled
+        block = req.generateNextBlock2Request(response)
+        d = block2Callback(response) if block2Callback is not None else defer.succeed(response)
+        d.addCallback(lambda _: self._exchange(block))
+        d.addCallback(self._block2, req, block2Callback, assembled)
+        return d
+
+    def _notified(self, response, callback, path):
+        block2 = response.opt.block2
+        if block2 is None or not block2.more:
+            callback(response)
+        elif block2.block_number == 0:
+            req = coap.Message(code=coap.GET)
+            req.opt.uri_path = path
+            req.remote = response.remote
+            d = self._exchange(req.generateNextBlock2Request(response))
+            d.addCallback(self._block2, req, None, response)
+            d.addCallback(callback)
+
+    def _forget(self, key):
+        self.recent.pop(key, None)
+
+    def datagram_received(self, data, addr):
+        remote = (ip_address(unicode(addr[0])), addr[1])
+        self.communicator.telemetry.received(remote, len(data))
+        try:
+            message = coap.Message.decode(data, remote)
+        except Exception:
+            logg.debug("Malformed datagram from " + str(addr[0]))
+            return
+        if message.mtype in (coap.ACK, coap.RST):
+            exchange = self.exchanges.pop(message.mid, None)
+            if exchange is None:
+                return
+            exchange[1].cancel()
+            sent = exchange[0]
+            if message.mtype == coap.RST:
+                d = self.outgoing.pop((sent.token, sent.remote), None)
+                if d is not None:
+                    d.errback(RequestError("reset by " + str(sent.remote[0])))
+                return
+            self.communicator.sampled(sent.remote, self.clock.seconds() - exchange[2], exchange[3])
+            if message.code == coap.EMPTY:
+                # The response follows separately
+                return
+        else:
+            key = (message.mid, message.remote)
+            if key in self.recent:
+                if self.recent[key] is not None:
+                    self._write(self.recent[key])
+                return
+            self.recent[key] = None
+            self.clock.callLater(coap.EXCHANGE_LIFETIME, self._forget, key)
+        if not coap.isResponse(message.code):
+            # Nodes are not served, a ping or a request is reset
+            if message.mtype == coap.CON:
+                self._reply(message, coap.RST)
+            return
+        key = (message.token, message.remote)
+        if key in self.outgoing:
+            self._acknowledge(message)
+            self.outgoing.pop(key).callback(message)
+        elif key in self.observations:
+            self._acknowledge(message)
+            callback, path = self.observations[key]
+            if message.opt.observe is None:
+                del self.observations[key]
+            self._notified(message, callback, path)
+        elif message.mtype in (coap.CON, coap.NON):
+            self._reply(message, coap.RST)
+
+    def _acknowledge(self, message):
+        if message.mtype == coap.CON:
+            self.recent[(message.mid, message.remote)] = self._reply(message, coap.ACK)
+
+
+class AsyncioCommunicator(PacedCommunicator):
+    """
+    Communicator running on an asyncio event loop instead of the Twisted reactor, with the pacing of
+    :class:`PacedCommunicator` and the same callbacks and errbacks. It lets the scheduler be embedded in an asyncio
+    application, whose loop then runs it e.g.::
+
+        loop = asyncio.get_event_loop()
+        scheduler = SchedulerInterface('net', 'fd00::212:7401:1:101', 5684, 'aaaa', loop=loop)
+        loop.call_soon(scheduler.start)
+        loop.run_forever()
+
+    Requires asyncio, or its backport trollius on Python 2.
+    """
+
+    def __init__(self, rate, burst=1, subtree=None, subtree_rate=None, subtree_burst=None, weights=None, loop=None):
+        if asyncio is None:
+            raise ImportError("AsyncioCommunicator needs asyncio (trollius on Python 2)")
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        super(AsyncioCommunicator, self).__init__(rate, burst, subtree, subtree_rate, subtree_burst, weights, LoopClock(self.loop))
+
+    def endpoint(self, to_node):
+        version = to_node.ip.version
+        if version not in self.protocols:
+            protocol = AsyncioEndpoint(self)
+            if version == 6:
+                bind = self.loop.create_datagram_endpoint(lambda: protocol, local_addr=('::', 0), family=socket.AF_INET6)
+            else:
+                bind = self.loop.create_datagram_endpoint(lambda: protocol, local_addr=('0.0.0.0', 0), family=socket.AF_INET)
+            asyncio.ensure_future(bind, loop=self.loop)
+            self.protocols[version] = protocol
+        return self.protocols[version]
+
+    def start(self):
+        """
+        Run the loop, unless it runs already e.g. when the scheduler is started by an asyncio application.
+        """
+        if not self.loop.is_running():
+            self.loop.run_forever()
+
+    def stop(self):
+        for protocol in self.protocols.values():
+            protocol.close()
+        self.protocols = {}
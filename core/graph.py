@@ -15,6 +15,7 @@ import urllib2, logging
 from subprocess import call
 import os
 from core.node import NodeID
+from ipaddress import IPv6Address
 import StringIO
 
 logg = logging.getLogger('RiSCHER')
@@ -218,6 +219,9 @@ class DoDAG(object):
 			tmp = NodeID(node_id)
 		elif isinstance(node_id, NodeID):
 			tmp = node_id
+		elif isinstance(node_id, IPv6Address):
+			# An EUI-64 address e.g. the target of a cell
+			tmp = NodeID(NodeID.prefix + str(node_id))
 		for x in self.graph.nodes():
 			if x == tmp:
 				return x
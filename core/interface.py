@@ -8,33 +8,101 @@ __copyright__ = "Copyright 2015, The RICH Project"
 #__status__ = "Production"
 
 from collections import deque
-import copy
+
+# Priority classes of commands. Lower values are more urgent, see :class:`core.client.PacedCommunicator`
+TOPOLOGY = 0
+SCHEDULE = 1
+MONITORING = 2
+
+
+def _immutable(self, *args, **kwargs):
+	raise TypeError('command payloads are immutable')
+
+
+class FrozenDict(dict):
+	"""
+	A dict that cannot be changed, see :func:`freeze`. copy.copy returns a plain (mutable) dict.
+	"""
+	__slots__ = ()
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+	def __copy__(self):
+		return dict(self)
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __reduce__(self):
+		return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+	"""
+	A list that cannot be changed, see :func:`freeze`. copy.copy returns a plain (mutable) list.
+	"""
+	__slots__ = ()
+	__setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _immutable
+	append = extend = insert = pop = remove = reverse = sort = _immutable
+
+	def __copy__(self):
+		return list(self)
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __reduce__(self):
+		return FrozenList, (list(self),)
+
+
+def freeze(content):
+	"""
+	Immutable version of a payload: dicts and lists, nested or not, become :class:`FrozenDict` and :class:`FrozenList`.
+	They still are dicts and lists to the parsers and codecs. Payloads that are frozen already are returned as they are.
+	"""
+	if isinstance(content, (FrozenDict, FrozenList)):
+		return content
+	elif isinstance(content, dict):
+		return FrozenDict((k, freeze(v)) for k, v in content.iteritems())
+	elif isinstance(content, list):
+		return FrozenList(freeze(i) for i in content)
+	elif isinstance(content, tuple):
+		return tuple(freeze(i) for i in content)
+	return content
 
 class Command(object):
+	"""
+	A request to a node. Commands are slotted, their paths interned and their payloads frozen (see :func:`freeze`), so
+	that the many commands the :class:`core.schedule.Reflector` keeps while waiting for replies, or for notifications of
+	observations, are small and can be shared instead of copied.
+	"""
+	__slots__ = ('id', 'op', 'to', 'path', 'query', 'content', 'xtra', 'callback', 'priority', 'deadline')
 	token = 0
-	def __init__(self, op, to, uri, payload=None, callback=None):
+	def __init__(self, op, to, uri, payload=None, callback=None, priority=None, deadline=None):
 		self.id = Command.token
 		Command.token += 1
 		self.op = op
 		self.to = to
 		tmp = uri.split('?')
-		self.path = tmp[0]
+		self.path = intern(tmp[0]) if isinstance(tmp[0], str) else tmp[0]
 		self.query = None
 		if len(tmp) == 2:
 			self.query = tmp[1]
-		self.content = payload
+		self.content = freeze(payload)
 		# if isinstance(self.content, dict):
 		# 	for k,v in self.content.items():
 		# 		if isinstance(v,basestring):
 		# 			self.content[k]='"'+v+'"'
 		self.xtra = None
 		self.callback = callback
+		self.priority = priority
+		self.deadline = deadline
 
 	def __eq__(self, other):
 		return self.id == other.id
 
 	def __copy__(self):
-		comm = Command(self.op, self.to, self.uri, copy.copy(self.payload), self.callback)
+		# The payload is immutable hence shared
+		comm = Command(self.op, self.to, self.uri, self.content, self.callback, self.priority, self.deadline)
 		comm.id = self.id
 		tmp = self.attachment()
 		if isinstance(tmp, dict):
@@ -52,7 +120,7 @@ class Command(object):
 	def payload(self, load):
 		if load and "tna" in load and isinstance(load["tna"], str):
 			raise Exception("got you")
-		self.content = load
+		self.content = freeze(load)
 
 	@property
 	def uri(self):
@@ -80,9 +148,21 @@ class Command(object):
 
 
 class BlockQueue(object):
+	"""
+	Commands sent in blocks: the commands pushed between two calls of :func:`block` are sent together and the commands
+	after that barrier are popped only once all of them have been released.
+
+	Commands are kept in a list consumed from its head and every barrier is a (position, pending) pair, position being
+	the number of commands pushed before it and pending the set of commands of its block not released yet. Indexing,
+	pop, push, block, unblock and release take constant (amortized) time.
+	"""
 	def __init__(self):
-		self.items = deque([])
+		self.commands = []
+		self.barriers = deque([])
 		self.last_point = set()
+		# Index in commands of the next command to pop, and number of commands dropped from the front of the list
+		self._head = 0
+		self._base = 0
 		self._pointer = -1
 		self._size = 0
 
@@ -103,22 +183,15 @@ class BlockQueue(object):
 			raise KeyError
 		if item < 0:
 			item = self.__len__()+item
-		if item < 0 or len(self) == 0 or item >= 0 and item >= len(self):
+		if item < 0 or item >= len(self):
 			raise IndexError
-		counter = 0
-		index = 0
-		for i in self.items:
-			if counter == item and not isinstance(i, set):
-				return self.items[index]
-			if not isinstance(i, set):
-				counter += 1
-			index += 1
+		return self.commands[self._head + item]
 
 	def __setitem__(self, key, value):
 		if key < 0:
-			key = self._size - key
-		if 0 <= key <= self._size:
-			self.items[key] = value
+			key = self._size + key
+		if 0 <= key < self._size:
+			self.commands[self._head + key] = value
 		else:
 			raise IndexError('list assignment index out of range')
 
@@ -128,33 +201,46 @@ class BlockQueue(object):
 #	def __contains__(self, item):
 #		pass
 
+	def _position(self):
+		return self._base + self._head
+
+	def _end(self):
+		return self._base + len(self.commands)
+
 	def pop(self):
-		try:
-			if not isinstance(self.items[0], set):
-				if self.items[0] in self.last_point:
-					self.last_point.remove(self.items[0])
-				self._size -= 1
-				return self.items.popleft()
-			elif isinstance(self.items[0], set) and len(self.items[0]) == 0:
-				self.items.popleft()
-				return self.pop()
-			else:
+		while self.barriers and self.barriers[0][0] == self._position():
+			if len(self.barriers[0][1]) > 0:
 				return None
-		except IndexError:
+			self.barriers.popleft()
+		if self._head == len(self.commands):
 			return None
+		item = self.commands[self._head]
+		self.commands[self._head] = None
+		self._head += 1
+		self._size -= 1
+		self.last_point.discard(item)
+		if self._head > 32 and 2 * self._head > len(self.commands):
+			# Drop the popped commands once they are the bigger part of the list
+			del self.commands[:self._head]
+			self._base += self._head
+			self._head = 0
+		return item
+
+	def _extend(self, queue):
+		offset = self._end() - queue._position()
+		for position, pending in queue.barriers:
+			self.barriers.append((position + offset, pending))
+		self.commands.extend(queue.commands[queue._head:])
+		self._size += len(queue)
 
 	def push(self, item):
 		if isinstance(item, BlockQueue) and self.ready() and item.ready() and item.unprocessed():
-			self.items.extend(list(item.items))
-			self._size += len(item)
+			self._extend(item)
 		elif isinstance(item, BlockQueue) and self.ready() and not item.ready() and item.unprocessed():
-			self.items.extend(list(item.items))
-			self._size += len(item)
+			self._extend(item)
 			self.last_point = item.last_point
-		elif isinstance(item, BlockQueue) and not self.ready() and not item.ready() and item.unprocessed() and len(item.items) == len(item):
-			self.items.extend(list(item.items))
-			self._size += len(item)
-			self.last_point.union(item.last_point)
+		elif isinstance(item, BlockQueue) and not self.ready() and not item.ready() and item.unprocessed() and len(item.barriers) == 0:
+			self._extend(item)
 		elif isinstance(item, BlockQueue):
 			raise Exception('Impossible to append')
 		elif isinstance(item, list):
@@ -163,34 +249,39 @@ class BlockQueue(object):
 		elif item in self.last_point:
 			return False
 		else:
-			self.items.append(item)
+			self.commands.append(item)
 			self._size += 1
 			self.last_point.add(item)
 
 		return True
 
 	def release(self, item):
-		for i in self.items:
-			if isinstance(i, set):
-				for j in list(i):
-					if item == j:
-						i.remove(j)
-						return True
-				break
+		if len(self.barriers) == 0:
+			return False
+		pending = self.barriers[0][1]
+		if item in pending:
+			pending.remove(item)
+			return True
+		# Copies of a command equal the command
+		for j in list(pending):
+			if item == j:
+				pending.remove(j)
+				return True
 		return False
 
 	def block(self):
 		if len(self.last_point) > 0:
-			self.items.append(self.last_point)
+			self.barriers.append((self._end(), self.last_point))
 			self.last_point = set()
 			return True
 		return False
 
 	def unblock(self):
 		if len(self.last_point) == 0:
-			x=self.items.pop()
-			assert isinstance(x,set)
-			self.last_point = x
+			position, pending = self.barriers[-1]
+			assert position == self._end()
+			self.barriers.pop()
+			self.last_point = pending
 			return True
 		return False
 
@@ -204,37 +295,141 @@ class BlockQueue(object):
 		return len(self.last_point) == 0
 
 	def unprocessed(self):
-		attendees = 0
-		for i in self.items:
-			if not isinstance(self.items[0], set):
-				attendees += 1
-			elif len(i) > attendees:
-				return False
-			else:
-				attendees = 0
-		return True
+		return len(self.barriers) == 0 or self.barriers[0][0] != self._position() or len(self.barriers[0][1]) == 0
 
 	def __str__(self):
 		tmp = ''
-		_counter = 0
-		_idx = 0
-		for i in self.items:
-			if isinstance(i, set):
-				assembly = []
-				for j in reversed(range(_idx)):
-					if isinstance(self.items[j], set):
-						break
-					assembly.append(j-_idx+_counter)
-				tmp += str(sorted(assembly))+'\n'
-			else:
-				tmp += str(_counter)+' -> '+str(i)+'\n'
-				_counter += 1
-			_idx += 1
+		first = self._position()
+		start = first
+		barriers = deque(self.barriers)
+		for position in range(first, self._end() + 1):
+			while barriers and barriers[0][0] == position:
+				tmp += str(range(start - first, position - first))+'\n'
+				start = position
+				barriers.popleft()
+			if position < self._end():
+				tmp += str(position - first)+' -> '+str(self.commands[position - self._base])+'\n'
 		if len(self.last_point) > 0:
-			assembly = []
-			for j in reversed(range(_idx)):
-				if isinstance(self.items[j], set):
-					break
-				assembly.append(j-_idx+_counter)
-			tmp += str(sorted(assembly))+'++\n'
-		return tmp
\ No newline at end of file
+			tmp += str(range(start - first, self._end() - first))+'++\n'
+		return tmp
+
+
+class CommandGraph(object):
+	"""
+	Commands with explicit dependencies. A command is popped as soon as all the commands it was pushed after have been
+	released, so independent chains of commands progress concurrently instead of waiting for a whole block. A
+	:class:`BlockQueue` can still be used to build (part of) a graph: each of its commands comes after all the commands
+	of its previous block, e.g.::
+
+		g = CommandGraph()
+		frame = g.push(Command('post', node, terms.get_resource_uri('6TOP', 'SLOTFRAME'), {'ns': 101}))
+		for neighbor in neighbors:
+			g.push(Command('post', node, terms.get_resource_uri('6TOP', 'CELLLIST'), cell_to(neighbor)), after=frame)
+
+	It offers the interface of :class:`BlockQueue` that sessions rely on i.e. pop, release, finished, len and iteration.
+	"""
+	def __init__(self):
+		# Commands in the order they were pushed
+		self.commands = []
+		# Commands ready to be popped
+		self.ready = deque([])
+		# Commands are tracked by id, as sessions release copies of them (see :func:`core.schedule.Reflector._push_command`)
+		# Unreleased dependencies per id of command still to be popped
+		self.blockers = {}
+		# Commands waiting on each id
+		self.dependents = {}
+		self.popped = set()
+		self.released = set()
+		self._size = 0
+
+	def __iter__(self):
+		return iter([c for c in self.commands if c.id not in self.popped])
+
+	def __len__(self):
+		return self._size
+
+	def __contains__(self, item):
+		return item.id in self.blockers or item.id in self.popped
+
+	def push(self, item, after=None):
+		"""
+		Add a command, a list of commands or a :class:`BlockQueue` to the graph.
+
+		:param item: the commands to add
+		:param after: commands of the graph that must be released before item is popped
+		:type after: Command or list of Command
+		:return: the commands the pushed item ends with (e.g. the last block of a BlockQueue), to push others after them
+		:rtype: list of Command
+		:raises: ValueError if a command of after has not been pushed to the graph
+		"""
+		if after is None:
+			after = []
+		elif not isinstance(after, list):
+			after = [after]
+		for i in after:
+			if i not in self:
+				raise ValueError('Dependency not in the graph: ' + str(i))
+		if isinstance(item, BlockQueue):
+			return self._push_blocks(item, after)
+		elif isinstance(item, list):
+			ends = []
+			for i in item:
+				ends.extend(self.push(i, after))
+			return ends
+		elif item in self:
+			return []
+		pending = set(i.id for i in after if i.id not in self.released)
+		self.commands.append(item)
+		self.blockers[item.id] = len(pending)
+		for i in pending:
+			self.dependents.setdefault(i, []).append(item)
+		if not pending:
+			self.ready.append(item)
+		self._size += 1
+		return [item]
+
+	def _push_blocks(self, queue, after):
+		if not queue.unprocessed():
+			raise Exception('Impossible to append')
+		boundaries = [position - queue._position() for position, pending in queue.barriers]
+		previous = after
+		block = []
+		for index in range(len(queue)):
+			comm = queue[index]
+			if boundaries and index == boundaries[0]:
+				previous = block or previous
+				block = []
+				while boundaries and boundaries[0] == index:
+					boundaries.pop(0)
+			block.extend(self.push(comm, previous))
+		return block or previous
+
+	def pop(self):
+		if not self.ready:
+			return None
+		item = self.ready.popleft()
+		del self.blockers[item.id]
+		self.popped.add(item.id)
+		self._size -= 1
+		return item
+
+	def release(self, item):
+		if item.id not in self.popped or item.id in self.released:
+			return False
+		self.released.add(item.id)
+		for i in self.dependents.pop(item.id, []):
+			self.blockers[i.id] -= 1
+			if self.blockers[i.id] == 0:
+				self.ready.append(i)
+		return True
+
+	def finished(self):
+		return self._size == 0
+
+	def __str__(self):
+		tmp = ''
+		for c in self.commands:
+			if c.id not in self.popped:
+				state = '' if self.blockers[c.id] == 0 else ' waits on ' + str(self.blockers[c.id])
+				tmp += str(c) + state + '\n'
+		return tmp
@@ -29,7 +29,8 @@ class NodeID(object):
 			# if self.ip.count(':') == 3:
 			# 	self.ip = NodeID.prefix + '::' + self.ip
 			# self.eui_64_ip = ''
-			if self.prefix in temp_ip:
+			# Strip the prefix, or the '::' of an EUI-64 address e.g. the target of a cell as posted
+			if self.prefix in temp_ip or temp_ip.startswith('::'):
 				temp_ip = temp_ip.split(u'::')[-1]
 			self.eui_64_ip = ip_address(u'::' + temp_ip)
 			self.ip = ip_address(self.prefix + str(self.eui_64_ip))
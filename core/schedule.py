@@ -9,13 +9,14 @@ __copyright__ = "Copyright 2014, The RICH Project"
 
 from core.interface import Command
 
-from core.client import LazyCommunicator
+from core.client import PacedCommunicator, AsyncioCommunicator
 from core.graph import DoDAG
 from core.node import NodeID, BROADCASTID
 from util import parser
 import json
-from core.slotframe import Slotframe, Cell
-from util import terms, exception, logger
+from core.slotframe import Slotframe, ColumnarSlotframe, Cell, numpy
+from core import snapshot
+from util import terms, exception, logger, codec
 from txthings import coap
 import logging
 from core import interface
@@ -23,15 +24,140 @@ import copy
 import datetime
 from twisted.internet import task
 import socket
+import struct
 import time
 from sets import Set
 import re
+from collections import OrderedDict
 from util.Visualizer import FrankFancyStreamingInterface
 
 logg = logging.getLogger('RiSCHER')
 logg.setLevel(logging.DEBUG)
 
 
+class Pending(object):
+	"""
+	Entry of :attr:`Reflector.cache`: a command sent and waiting for a reply (or notifications, if observed) and the
+	session it belongs to.
+	"""
+	__slots__ = ('command', 'session', 'time')
+
+	def __init__(self, command, session):
+		self.command = command
+		self.session = session
+		# When the command was sent, or last notified if observed
+		self.time = None
+
+	def __str__(self):
+		return str(self.command) + ' (session ' + str(self.session) + ')'
+
+
+# Upper bounds (sec) of the age groups of the cache entries in leak reports, the last group is unbounded
+AGE_BUCKETS = (10, 60, 600, 3600)
+
+
+class CommandCache(object):
+	"""
+	The :class:`Pending` entries of a :class:`Reflector` by command id, in the order they were sent or last notified.
+	Entries that are too many or too old are picked by :func:`stale` for the Reflector to evict:
+
+	- beyond size requests, the least recently sent ones
+	- requests sent more than ttl seconds ago
+	- observations not notified for observe_ttl seconds
+
+	Observations do not count towards size: nothing observes a resource again once its observation is evicted, so they
+	are only bounded by observe_ttl.
+	"""
+
+	def __init__(self, clock, size=None, ttl=None, observe_ttl=None):
+		self.clock = clock
+		self.size = size
+		self.ttl = ttl
+		self.observe_ttl = observe_ttl
+		self.entries = OrderedDict()
+
+	def __contains__(self, token):
+		return token in self.entries
+
+	def __getitem__(self, token):
+		return self.entries[token]
+
+	def __setitem__(self, token, entry):
+		self.entries.pop(token, None)
+		entry.time = self.clock.seconds()
+		self.entries[token] = entry
+
+	def __delitem__(self, token):
+		del self.entries[token]
+
+	def __len__(self):
+		return len(self.entries)
+
+	def pop(self, token, *default):
+		return self.entries.pop(token, *default)
+
+	def items(self):
+		return self.entries.items()
+
+	def values(self):
+		return self.entries.values()
+
+	def touch(self, token):
+		"""
+		Mark an entry as just heard of e.g. on a notification of an observation.
+		"""
+		self[token] = self.entries[token]
+
+	def bounded(self):
+		return self.size is not None or self.ttl is not None or self.observe_ttl is not None
+
+	def stale(self):
+		"""
+		:return: the ids of the entries to be evicted, the oldest first
+		:rtype: list
+		"""
+		now = self.clock.seconds()
+		excess = 0
+		if self.size is not None:
+			excess = sum(1 for entry in self.entries.itervalues() if entry.command.op != 'observe') - self.size
+		ttls = [ttl for ttl in (self.ttl, self.observe_ttl) if ttl is not None]
+		stale = []
+		for token, entry in self.entries.iteritems():
+			observation = entry.command.op == 'observe'
+			if excess > 0 and not observation:
+				stale.append(token)
+				excess -= 1
+				continue
+			ttl = self.observe_ttl if observation else self.ttl
+			if ttl is not None and now - entry.time >= ttl:
+				stale.append(token)
+			elif excess <= 0 and (not ttls or now - entry.time < min(ttls)):
+				# Entries are in order of time, none of the rest is old enough
+				break
+		return stale
+
+	def report(self):
+		"""
+		Summary of the entries to spot leaks.
+
+		:return: the number of entries per 'op path' of their commands, per age group (upper bound in seconds, 'inf' for
+			the last) and the age of the oldest entry
+		:rtype: dict
+		"""
+		now = self.clock.seconds()
+		by_command = {}
+		by_age = dict((str(bound), 0) for bound in AGE_BUCKETS + ('inf',))
+		oldest = None
+		for entry in self.entries.itervalues():
+			key = entry.command.op + ' ' + entry.command.path
+			by_command[key] = by_command.get(key, 0) + 1
+			age = now - entry.time
+			by_age[str(next((bound for bound in AGE_BUCKETS if age < bound), 'inf'))] += 1
+			if oldest is None or age > oldest:
+				oldest = age
+		return {'entries': len(self.entries), 'by_command': by_command, 'by_age': by_age, 'oldest': oldest}
+
+
 class Reflector(object):
 	"""
 	Handle all the communication with the RICH network in a concurrent way.
@@ -51,6 +177,9 @@ class Reflector(object):
 	Besides the user-defined sessions, this class maintains the RPL DoDAG by installing a children observer to every node
 	of the network.
 
+	The slotframes, the DoDAG and the blacklists can be saved to a snapshot periodically and restored after a restart,
+	see :func:`save_snapshot` and :func:`load_snapshot`.
+
 	The class provides a callback system for the following operations and resources:
 
 	- GET & OBSERVE on RPL children of a node: the returned list of children is compared against current RPL DoDAG to determing (dis)connected nodes
@@ -60,11 +189,14 @@ class Reflector(object):
 	- GET, OBSERVE, POST & DELETE any user-defined resource
 	"""
 
-	def __init__(self, net_name, lbr_ip, lbr_port, prefix, visualizer=None):
+	def __init__(self, net_name, lbr_ip, lbr_port, prefix, visualizer=None, rate=1, burst=1, branch_rate=1, branch_burst=2, weights=None, command_timeout=None, session_timeout=None, client=None, clock=None, content_format=None, telemetry_interval=None, merge_window=0, cache_size=None, cache_ttl=None, observe_ttl=None, leak_report_interval=None, snapshot_file=None, snapshot_interval=None, warm_start=False, loop=None):
 		"""
 		Configure :class:`Reflector` with a network name and the EUI64 address and port of the border router. Initialize
 		the DoDAG tree with a single node, the border router.
 
+		Outbound requests are paced per destination node and per DoDAG branch (the subtree below a child of the border
+		router) with token buckets, see :class:`core.client.PacedCommunicator`.
+
 		:param net_name: a name for the network this scheduler handles
 		:type net_name: str
 		:param lbr_ip: EUI64 address of the border router
@@ -75,14 +207,89 @@ class Reflector(object):
 		:type prefix:str
 		:param visualizer: a dictionary with keys: VHost: host of active live viewer, PubInterface: interfaces on which the logger publisher service is binded,
 																	PKeyFolder: folder with publisher service private key
+		:param rate: requests per second sent to a single node
+		:type rate: float
+		:param burst: requests a single node may receive back-to-back
+		:type burst: int
+		:param branch_rate: requests per second sent to all nodes of a DoDAG branch together
+		:type branch_rate: float
+		:param branch_burst: requests a DoDAG branch may receive back-to-back
+		:type branch_burst: int
+		:param weights: share of the sending opportunities per priority class of commands, see :func:`_priority_of`
+		:type weights: dict
+		:param command_timeout: seconds a node has to answer a command without its own deadline, None to rely on CoAP only
+		:type command_timeout: float
+		:param session_timeout: seconds after which an unfinished session is cancelled, None for no limit
+		:type session_timeout: float
+		:param client: the communicator to reach the nodes e.g. :class:`core.client.MemoryCommunicator`, None for UDP
+		:type client: :class:`core.client.Communicator`
+		:param clock: clock of the timers, the reactor unless a virtual clock is given; the client's clock if client is given
+		:type clock: twisted.internet.interfaces.IReactorTime
+		:param content_format: encoding of payloads tried first with every node e.g. :data:`util.codec.CBOR`, nodes that
+			refuse it fall back to JSON; None for JSON only
+		:type content_format: int
+		:param telemetry_interval: seconds between logged summaries of the transport telemetry, None for none (the
+			telemetry is kept regardless, see :class:`core.telemetry.Telemetry`)
+		:type telemetry_interval: float
+		:param merge_window: seconds the cell installations and the GET/DELETE requests of all sessions are gathered per
+			node before being merged and sent, see :func:`_flush`; 0 gathers those of the same reactor iteration, None
+			merges only within a block of a session
+		:type merge_window: float
+		:param cache_size: commands waiting for a reply kept at most, the least recently sent are evicted beyond that;
+			None for no limit. Observations do not count, see observe_ttl
+		:type cache_size: int
+		:param cache_ttl: seconds after which a command still waiting for a reply is evicted, None for never
+		:type cache_ttl: float
+		:param observe_ttl: seconds after which an observation that sent no notification is cancelled, None for never.
+			Mind that rpl/dag notifies only on changes of the DoDAG
+		:type observe_ttl: float
+		:param leak_report_interval: seconds between logged reports of the cache and sessions, see :func:`leaks`; None for
+			none
+		:type leak_report_interval: float
+		:param snapshot_file: the file of the snapshots, see :func:`save_snapshot`
+		:type snapshot_file: str
+		:param snapshot_interval: seconds between snapshots written to snapshot_file, None for none
+		:type snapshot_interval: float
+		:param warm_start: resume from the snapshot in snapshot_file, if any, instead of rediscovering the network, see
+			:func:`load_snapshot`
+		:type warm_start: bool
+		:param loop: asyncio event loop to run on instead of the Twisted reactor, see
+			:class:`core.client.AsyncioCommunicator`; ignored if client is given
+		:type loop: asyncio.AbstractEventLoop
 		"""
 		NodeID.prefix = prefix
 		self.root_id = NodeID(lbr_ip, lbr_port)
 		logg.info("scheduler interface started with LBR=" + str(self.root_id))
-		self.client = LazyCommunicator(1)
+		if client is None and loop is not None:
+			client = AsyncioCommunicator(rate, burst, subtree=self._branch_of, subtree_rate=branch_rate, subtree_burst=branch_burst, weights=weights, loop=loop)
+		elif client is None:
+			client = PacedCommunicator(rate, burst, subtree=self._branch_of, subtree_rate=branch_rate, subtree_burst=branch_burst, weights=weights, clock=clock)
+		elif getattr(client, 'subtree', False) is None:
+			client.subtree = self._branch_of
+		if content_format is not None:
+			client.content_format = content_format
+		self.client = client
+		self.clock = client.clock
+		self.telemetry_interval = telemetry_interval
 		self.dodag = DoDAG(net_name, self.root_id, visualizer)
-		self.cache = {}
+		# Commands waiting for a reply (or notifications) per id, see :class:`Pending`
+		self.cache = CommandCache(self.clock, cache_size, cache_ttl, observe_ttl)
+		self.leak_report_interval = leak_report_interval
+		self.snapshot_file = snapshot_file
+		self.snapshot_interval = snapshot_interval
+		self.warm_start = warm_start
+		# Nodes restored from a snapshot not contacted yet, and those whose cells are being checked, see :func:`_validate`
+		self.unvalidated = set()
+		self.validating = {}
 		self.sessions = {}
+		# Expiry timers of the sessions, see :func:`cancel_session`
+		self.session_timers = {}
+		self.command_timeout = command_timeout
+		self.session_timeout = session_timeout
+		# Commands ready to be merged per destination node, as (command, session id) pairs, see :func:`_dispatch`
+		self.outbox = {}
+		self.merge_window = merge_window
+		self.merge_timer = None
 		self.start_commands = []
 		self.count_sessions = 0
 		#nodes who are temporary lost from the network are stored in here
@@ -110,6 +317,25 @@ class Reflector(object):
 			self.Streamer = FrankFancyStreamingInterface("", "", "", "", empty=True)
 
 
+	def _branch_of(self, node_id):
+		"""
+		Find the DoDAG branch a node belongs to i.e. its ancestor that is a direct child of the border router. All requests
+		to nodes of the same branch cross the same link of the border router.
+
+		:param node_id: the node to locate
+		:type node_id: :class:`node.NodeID`
+		:return: the direct child of the border router leading to node_id, the node itself if unknown or the border router
+		:rtype: :class:`node.NodeID`
+		"""
+		branch = node_id
+		visited = set([branch])
+		parent = self.dodag.get_parent(branch)
+		while parent is not None and parent != self.root_id and parent not in visited:
+			branch = parent
+			visited.add(branch)
+			parent = self.dodag.get_parent(branch)
+		return branch
+
 	def _start(self):
 		"""
 		registers the looping call for the :func:`_TimeTick` into the twisted library
@@ -117,7 +343,18 @@ class Reflector(object):
 		:return None
 		"""
 		l = task.LoopingCall(self._TimeTick)
+		l.clock = self.clock
 		l.start(1.0)
+		if self.telemetry_interval:
+			self.client.telemetry.start(self.telemetry_interval)
+		if self.leak_report_interval:
+			leaks = task.LoopingCall(self._report_leaks)
+			leaks.clock = self.clock
+			leaks.start(self.leak_report_interval, now=False)
+		if self.snapshot_file and self.snapshot_interval:
+			snapshots = task.LoopingCall(self._save_snapshot)
+			snapshots.clock = self.clock
+			snapshots.start(self.snapshot_interval, now=False)
 		comms = self.start_commands
 		self.start_commands = None
 		for comm in reversed(comms):
@@ -128,64 +365,191 @@ class Reflector(object):
 
 	def _decache(self, token):
 		"""
-		Remove and return the cache entry (= a command) with the given token (= id)
+		Remove and return the cache entry (= a command and its session) with the given token (= id)
 
 		:param token: the token/id of the command to be detected and removed
 		:type token: int
-		:return: the command with the specified token
-		:rtype: Command, or None if not found
+		:return: the entry of the command with the specified token
+		:rtype: Pending, or None if not found
 		"""
 
 		entry = None
 		if token is not None:
 			entry = self.cache[token]
-			if entry['command'].op != 'observe':
+			if entry.command.op != 'observe':
 				#self.client.forget(token)
 				del self.cache[token]
+			else:
+				self.cache.touch(token)
 		return entry
 
 	def _create_session(self, assembly):
 		"""
-		Creates and initiates a session given a BlockQueue. The session is registered to this object and all the commands
-		of its first block are sent to their destinations.
+		Creates and initiates a session given a BlockQueue or a CommandGraph. The session is registered to this object and
+		all the commands that can be sent right away (the first block of a BlockQueue, the commands of a CommandGraph that
+		depend on no other) are sent to their destinations.
 
-		:param assembly: a stack of blocks of commands to be sent to the network nodes
-		:type assembly: BlockQueue
+		:param assembly: the commands to be sent to the network nodes
+		:type assembly: BlockQueue or CommandGraph
 		"""
 		if assembly and len(assembly) > 0:
 			self.count_sessions += 1
-			# Register the BlockQueue to the list of sessions
+			# Register the session to the list of sessions
 			self.sessions[self.count_sessions] = assembly
-			# Iterate over the commands of the first block of the new session
-			comm = self.sessions[self.count_sessions].pop()
-			while comm:
-				# Transmit each command
-				self._push_command(comm, self.count_sessions)
-				if self.count_sessions not in self.sessions or len(self.sessions[self.count_sessions]) == 0:
-					break
-				comm = self.sessions[self.count_sessions].pop()
+			if self.session_timeout:
+				self.session_timers[self.count_sessions] = self.clock.callLater(self.session_timeout, self._expire_session, self.count_sessions)
+			# Transmit the commands of the first block of the new session
+			self._dispatch(self._next_block(self.count_sessions), self.count_sessions)
+
+	def _next_block(self, session_id):
+		"""
+		Pop all the commands of a session that can be transmitted now i.e. the commands of the current block of a BlockQueue
+		or those of a CommandGraph whose dependencies have all replied.
+
+		:param session_id: identifier of the session whose commands are popped
+		:type session_id: int
+		:return: the commands to be transmitted, empty if all remaining commands still wait on pending replies
+		:rtype: list of Command
+		"""
+		comms = []
+		session = self.sessions[session_id]
+		# Note that pop returns None if the remaining commands still wait on pending replies
+		comm = session.pop()
+		while comm:
+			comms.append(comm)
+			if len(session) == 0:
+				break
+			comm = session.pop()
+		return comms
+
+	def _batchable(self, comm):
+		"""
+		Check if a command is a plain cell installation i.e. a POST 6t/6/cl with a single cell payload on a slotframe
+		already known to the node and no application-defined callback.
+
+		:param comm: the command to be checked
+		:type comm: Command
+		:rtype: bool
+		"""
+		return isinstance(comm, Command) and not comm.callback and comm.op == 'post' and comm.query is None \
+			and comm.path == terms.get_resource_uri('6TOP', 'CELLLIST') and isinstance(comm.payload, dict) \
+			and isinstance(comm.payload.get(terms.resources['6TOP']['CELLLIST']['SLOTFRAME']['LABEL']), (long, int))
+
+	def _mergeable(self, comm):
+		"""
+		Check if a command may be sent together with other commands of any session: a cell installation (see
+		:func:`_batchable`) or a plain GET or DELETE without payload, attachments or application-defined callback, which is
+		sent once for all the identical ones.
+
+		:param comm: the command to be checked
+		:type comm: Command
+		:rtype: bool
+		"""
+		return self._batchable(comm) or (isinstance(comm, Command) and not comm.callback and comm.op in ('get', 'delete')
+			and comm.payload is None and not comm.attachment())
+
+	def _dispatch(self, comms, session_id):
+		"""
+		Transmit the commands of a session that are ready. Mergeable commands (see :func:`_mergeable`) are parked in the
+		outbox of their destination instead, where those of all sessions are gathered for merge_window seconds and then
+		sent by :func:`_flush`.
+
+		:param comms: the commands of the session ready to be sent
+		:type comms: list of Command
+		:param session_id: identifier of the session the commands belong to
+		:type session_id: int
+		"""
+		for comm in comms:
+			if self._mergeable(comm):
+				self.outbox.setdefault(comm.to, []).append((comm, session_id))
+			else:
+				self._push_command(comm, session_id)
+		if self.outbox and self.merge_window is None:
+			self._flush()
+		elif self.outbox and self.merge_timer is None:
+			self.merge_timer = self.clock.callLater(self.merge_window, self._flush)
+
+	def _flush(self):
+		"""
+		Send the commands gathered in the outboxes. The cell installations to a node are merged into a single POST 6t/6/cl
+		with a list payload, which the node answers with a list of cell identifiers, and identical GET or DELETE requests
+		to a node are sent once. A merged command keeps its constituents and their sessions in the 'merged' attachment, so
+		that each of them is released from its own session once the reply arrives (see :func:`_touch_session`). Commands of
+		sessions cancelled in the meantime were removed from the outboxes by :func:`cancel_session`.
+
+		Only the commands of one flush are merged here. A GET identical to one sent by an earlier flush, and still waiting
+		for its reply, waits on that one in the communicator instead, see :func:`core.client.Communicator.GET`.
+		"""
+		self.merge_timer = None
+		outbox = self.outbox
+		self.outbox = {}
+		for to, entries in outbox.items():
+			cells = [(comm, session_id) for comm, session_id in entries if self._batchable(comm)]
+			groups = [cells] if cells else []
+			identical = {}
+			for comm, session_id in entries:
+				if not self._batchable(comm):
+					if (comm.op, comm.uri) not in identical:
+						identical[(comm.op, comm.uri)] = []
+						groups.append(identical[(comm.op, comm.uri)])
+					identical[(comm.op, comm.uri)].append((comm, session_id))
+			for group in groups:
+				if len(group) == 1:
+					self._push_command(group[0][0], group[0][1])
+				else:
+					# The merged command belongs to no session, its constituents do
+					self._push_command(self._merge(group), None)
+
+	def _merge(self, group):
+		"""
+		Build the command that carries a group of cell installations or of identical requests to the same node.
+
+		:param group: the (command, session id) pairs to be merged
+		:type group: list of tuple
+		:rtype: Command
+		"""
+		first = group[0][0]
+		priorities = [comm.priority for comm, session_id in group if comm.priority is not None]
+		deadlines = [comm.deadline for comm, session_id in group if comm.deadline]
+		if self._batchable(first):
+			merged = Command('post', first.to, terms.get_resource_uri('6TOP', 'CELLLIST'), [comm.payload for comm, session_id in group])
+		else:
+			merged = Command(first.op, first.to, first.uri)
+		merged.priority = min(priorities) if priorities else None
+		merged.deadline = min(deadlines) if deadlines else None
+		merged.attach(merged=group)
+		return merged
 
 	def _TimeTick(self):
 		"""
 		This function is ran every second and decreases the value of the lost_children dictionary item with as key the
 		mac address of the lost child.
 		When this value is 0 the disconnection procedure of this node is started. Also :func:`_DumpGraph` is called to
-		create a snapshot of the system after disconnection
+		create a snapshot of the system after disconnection. Stale entries of a bounded cache are evicted too.
 
 		:return: None
 		"""
+		if self.cache.bounded():
+			self._sweep()
 		#iterate throught the lost children list and subtract 1 from each entry
 		for key, value in self.lost_children.iteritems():
 			#if time is over pop this item and disconnect it, otherwise just decrement
 			if value == 0:
 				#save its children
 				children = self.dodag.get_children(key)
+				nodes = set(self.dodag.graph.nodes())
 				#disconnect the node and execute commands for this disconnect
 				if self.dodag.detach_node(key):
 					try:
 						self._DumpGraph()
 					except:
 						logg.critical("Graphviz not installed corrected")
+					# observations of the lost node, and of the subtree detached with it, will never be answered again
+					for node in nodes.difference(self.dodag.graph.nodes()):
+						self.client.forget_node(node)
+						self.evict_node(node)
+						self.unvalidated.discard(node)
+						self.validating.pop(node, None)
 					self.communicate(self._disconnect(key, children))
 					self.communicate(self.disconnected(key))
 				self.lost_children.pop(key,0)
@@ -200,8 +564,7 @@ class Reflector(object):
 
 	def _touch_session(self, achieved_comm, session_id):
 		"""
-		Remove a given command from a session. Send subsequent block of commands if the given command was the last pending
-		command of the current block of the session.
+		Remove a given command from a session. Send the commands of the session that waited only on the given command.
 
 		:param achieved_comm: command that needs to be deleted from the session
 		:type achieved_comm: Command
@@ -209,20 +572,78 @@ class Reflector(object):
 		:type session_id: int
 		"""
 
+		# A merged command is not part of any session itself. Its constituents are.
+		merged = achieved_comm.attachment('merged')
+		if merged:
+			for comm, merged_session in merged:
+				self._touch_session(comm, merged_session)
+			return
 		if session_id in self.sessions:
 			# Get the BlockQueue corresponding to the session_id
 			session = self.sessions[session_id]
-			# Unblock the achieved_comm from the current block of session. Open up the next block if current is finished
+			# Release the achieved_comm in the session, readying the commands that waited only on it
 			session.release(achieved_comm)
 			# if more commands are in the session, transmit them to their destinations
 			if not session.finished():
-				# Note that pop returns None if the current block has still pending replies of commands
-				comm = session.pop()
-				while comm:
-					self._push_command(comm, session_id)
-					comm = session.pop()
-			else:
+				self._dispatch(self._next_block(session_id), session_id)
+			elif not any(s == session_id for entries in self.outbox.values() for comm, s in entries):
+				# The session is over once its commands parked in an outbox are answered too
 				del self.sessions[session_id]
+				timer = self.session_timers.pop(session_id, None)
+				if timer is not None and timer.active():
+					timer.cancel()
+
+	def _failed(self, failure, token):
+		"""
+		Errback of all commands. Triggered when a command got no reply i.e. its deadline passed, CoAP gave up on it or it
+		was cancelled. The command is released from its session, so that the session carries on with its next block, and
+		the application is notified through :func:`failed`.
+
+		:param failure: the reason of the failure
+		:type failure: :class:`twisted.python.failure.Failure`
+		:param token: the id of the failed command
+		:type token: int
+		"""
+		if token not in self.cache:
+			return None
+		entry = self.cache.pop(token)
+		logg.warning("Command " + str(entry.command.id) + " to " + str(entry.command.to) + " failed: " + entry.command.op + " " + entry.command.uri + " >> " + failure.getErrorMessage())
+		self._touch_session(entry.command, entry.session)
+		merged = entry.command.attachment('merged')
+		for comm in [c for c, s in merged] if merged else [entry.command]:
+			self.communicate(self.failed(comm, failure.value))
+		return None
+
+	def _expire_session(self, session_id):
+		"""
+		Cancel a session that did not finish within the session timeout and report its pending commands as failed.
+
+		:param session_id: identifier of the expired session
+		:type session_id: int
+		"""
+		self.session_timers.pop(session_id, None)
+		pending = [comm for comm, s in self._pending(session_id)]
+		if self.cancel_session(session_id):
+			logg.warning("Session " + str(session_id) + " expired with " + str(len(pending)) + " commands pending")
+			for comm in pending:
+				self.communicate(self.failed(comm, exception.Expired('session ' + str(session_id) + ' expired')))
+
+	def _pending(self, session_id):
+		"""
+		The commands of a session sent or parked in an outbox but not answered yet, the constituents of merged commands
+		included.
+
+		:param session_id: identifier of the session
+		:type session_id: int
+		:return: (command, session id) pairs
+		:rtype: list of tuple
+		"""
+		pending = []
+		for entry in self.cache.values():
+			pending.extend(entry.command.attachment('merged') or [(entry.command, entry.session)])
+		for entries in self.outbox.values():
+			pending.extend(entries)
+		return [(comm, s) for comm, s in pending if s == session_id]
 
 	def _get_rpl_dag(self, response):
 		"""
@@ -237,26 +658,26 @@ class Reflector(object):
 		tk = self.client.ticket(response.token)
 		if tk not in self.cache:
 			return
-		session_id = self.cache[tk]["session"]
+		session_id = self.cache[tk].session
 		#check if the response is valid
 		node_id = NodeID(response.remote[0], response.remote[1])
 
 		if response.code != coap.CONTENT:
 			tmp = str(node_id) + ' returned a ' + coap.responses[response.code] + '\n\tRequest: ' + str(self.cache[tk])
 			cached_entry = self._decache(tk)
-			self._touch_session(cached_entry['command'], session_id)
+			self._touch_session(cached_entry.command, session_id)
 			raise exception.UnsupportedCase(tmp)
 
 		#report to the logger
-		logg.debug("Observed rpl/dag from " + str(response.remote[0]) + " >> " + parser.clean_payload(response.payload))
+		logg.debug("Observed rpl/dag from " + str(response.remote[0]) + " >> " + codec.text(response))
 		try:
-			#json parse the payload and decache the token
-			payload = json.loads(parser.clean_payload(response.payload))
+			#parse the payload and decache the token
+			payload = codec.decode(response)
 			cached_entry = self._decache(tk)
 			#pass the seperate pieces of information to their functions
-			if cached_entry['command'].uri.startswith(terms.get_resource_uri('RPL','DAG','PARENT')):
+			if cached_entry.command.uri.startswith(terms.get_resource_uri('RPL','DAG','PARENT')):
 				self._observe_rpl_parent(payload, node_id)
-			elif cached_entry['command'].uri.startswith(terms.get_resource_uri('RPL','DAG','CHILD')):
+			elif cached_entry.command.uri.startswith(terms.get_resource_uri('RPL','DAG','CHILD')):
 				self._observe_rpl_children(payload, node_id)
 			else:
 				self._observe_rpl_parent(payload[terms.resources['RPL']['DAG']['PARENT']['LABEL']], node_id)
@@ -266,7 +687,7 @@ class Reflector(object):
 
 		# Make sure the command is removed from the session it belongs to. If the session is empty, it will also be removed
 		# from the session registry. Otherwise, commands from the next block of this session will be transmitted
-		self._touch_session(cached_entry['command'], session_id)
+		self._touch_session(cached_entry.command, session_id)
 
 		for n in self.dodag.graph.nodes():
 			if len(self.dodag.get_neighbors(n)) == 0:
@@ -323,6 +744,8 @@ class Reflector(object):
 		#  build and send a BlockQueue session to install a children list observer to the new node
 		#  let user-defined function add a new session if needed
 		for k in observed_children:
+			if k in self.unvalidated:
+				self.communicate(self._validate(k))
 			if not self.dodag.check_node(k):
 				#self._DumpGraph()
 				logg.debug("Node {} joined the network with parent {}".format(k, parent_id))
@@ -448,7 +871,7 @@ class Reflector(object):
 	# 	tk = self.client.token(response.token)
 	# 	if tk not in self.cache:
 	# 		return
-	# 	session_id = self.cache[tk]["session"]
+	# 	session_id = self.cache[tk].session
 	# 	#check if the response is valid
 	# 	node_id = NodeID(response.remote[0], response.remote[1])
 	# 	if self.dodag.attach_node(node_id):
@@ -457,7 +880,7 @@ class Reflector(object):
 	# 	if response.code != coap.CONTENT:
 	# 		tmp = str(node_id) + ' returned a ' + coap.responses[response.code] + '\n\tRequest: ' + str(self.cache[tk])
 	# 		cached_entry = self._decache(tk)
-	# 		self._touch_session(cached_entry['command'], session_id)
+	# 		self._touch_session(cached_entry.command, session_id)
 	# 		raise exception.UnsupportedCase(tmp)
 	#
 	# 	#report to the logger
@@ -467,9 +890,9 @@ class Reflector(object):
 	# 		payload = json.loads(parser.clean_payload(response.payload))
 	# 		cached_entry = self._decache(tk)
 	# 		#pass the seperate pieces of information to their functions
-	# 		if cached_entry['command'].uri.startswith(terms.get_resource_uri('RPL','DAG','PARENT')):
+	# 		if cached_entry.command.uri.startswith(terms.get_resource_uri('RPL','DAG','PARENT')):
 	# 			self._observe_rpl_parent(payload, node_id)
-	# 		elif cached_entry['command'].uri.startswith(terms.get_resource_uri('RPL','DAG','CHILD')):
+	# 		elif cached_entry.command.uri.startswith(terms.get_resource_uri('RPL','DAG','CHILD')):
 	# 			self._observe_rpl_children(payload, node_id)
 	# 		else:
 	# 			self._observe_rpl_parent(payload[terms.resources['RPL']['DAG']['PARENT']['LABEL']], node_id)
@@ -479,7 +902,7 @@ class Reflector(object):
 	#
 	# 	# Make sure the command is removed from the session it belongs to. If the session is empty, it will also be removed
 	# 	# from the session registry. Otherwise, commands from the next block of this session will be transmitted
-	# 	self._touch_session(cached_entry['command'], session_id)
+	# 	self._touch_session(cached_entry.command, session_id)
 
 	def _post_6top_slotframe(self, response):
 		"""
@@ -499,20 +922,19 @@ class Reflector(object):
 		tk = self.client.ticket(response.token)
 		if tk not in self.cache:
 			return
-		session_id = self.cache[tk]["session"]
+		session_id = self.cache[tk].session
 		node_id = NodeID(response.remote[0], response.remote[1])
 		if response.code != coap.CONTENT:
 			tmp = str(node_id) + ' returned a ' + coap.responses[response.code] + '\n\tRequest: ' + str(self.cache[tk])
 			cached_entry = self._decache(tk)
-			self._touch_session(cached_entry['command'], session_id)
+			self._touch_session(cached_entry.command, session_id)
 			raise exception.UnsupportedCase(tmp)
-		clean_payload = parser.clean_payload(response.payload)
-		logg.debug("Node " + str(response.remote[0]) + " replied on a slotframe post with " + clean_payload + " i.e. MID:" + str(response.mid))
+		logg.debug("Node " + str(response.remote[0]) + " replied on a slotframe post with " + codec.text(response) + " i.e. MID:" + str(response.mid))
 		try:
-			payload = json.loads(clean_payload)
+			payload = codec.decode(response)
 			###################
-			posted_frames = self.cache[tk]['command'].attachment()['frames']
-			posted_payload = self.cache[tk]['command'].payload
+			posted_frames = self.cache[tk].command.attachment()['frames']
+			posted_payload = self.cache[tk].command.payload
 			if isinstance(posted_payload, dict) and len(payload) == 1:
 				posted_payload = [posted_payload]
 			i = 0
@@ -527,9 +949,9 @@ class Reflector(object):
 				i += 1
 		except ValueError as ve:
 			logg.critical(ve.message+'. Command is skipped')
-			self.communicate(self.framed(node_id, None, None, self.cache[tk]['command'].payload))
+			self.communicate(self.framed(node_id, None, None, self.cache[tk].command.payload))
 		cached_entry = self._decache(tk)
-		self._touch_session(cached_entry['command'], session_id)
+		self._touch_session(cached_entry.command, session_id)
 
 	def _post_6top_link(self, response):
 		"""
@@ -547,54 +969,64 @@ class Reflector(object):
 		tk = self.client.ticket(response.token)
 		if tk not in self.cache:
 			return
-		session_id = self.cache[tk]["session"]
+		session_id = self.cache[tk].session
 		node_id = NodeID(response.remote[0], response.remote[1])
 		if response.code != coap.CONTENT:
 			tmp = str(node_id) + ' returned a ' + coap.responses[response.code] + '\n\tRequest: ' + str(self.cache[tk])
-			self._decache(tk)
+			cached_entry = self._decache(tk)
+			self._touch_session(cached_entry.command, session_id)
 			raise exception.UnsupportedCase(tmp)
-		clean_payload = parser.clean_payload(response.payload)
-		logg.debug("Node " + str(response.remote[0]) + " replied on a cell post with " + clean_payload + " i.e. MID:" + str(response.mid))
+		logg.debug("Node " + str(response.remote[0]) + " replied on a cell post with " + codec.text(response) + " i.e. MID:" + str(response.mid))
+		# Extract from cache the payload of the command that triggered this response, the cells of a merged command in a list
+		posted = self.cache[tk].command.payload
 		try:
-			payload = json.loads(clean_payload)
-			###################
-			# Extract from cache the payload of te command that triggered this response
-			old_payload = self.cache[tk]['command'].payload
-			# If successful installation of link, insert the link into local link container
-			if isinstance(payload, list):
-				for i in payload:
-					if isinstance(i, (int, long)):
-						success = i > 0
-						so = old_payload[terms.resources['6TOP']['CELLLIST']['SLOTOFFSET']['LABEL']]
-						co = old_payload[terms.resources['6TOP']['CELLLIST']['CHANNELOFFSET']['LABEL']]
-						fd = old_payload[terms.resources['6TOP']['CELLLIST']['SLOTFRAME']['LABEL']]
-						lo = old_payload[terms.resources['6TOP']['CELLLIST']['LINKOPTION']['LABEL']]
-						lt = old_payload[terms.resources['6TOP']['CELLLIST']['LINKTYPE']['LABEL']]
-						tna = old_payload[terms.resources['6TOP']['CELLLIST']['TARGETADDRESS']['LABEL']]
-						frame = None
-						for f in self.frames.values():
-							if f.get_alias_id(node_id) == int(fd):
-								frame = f
-								break
-						if not frame:
-							logg.critical("Node " + str(response.remote[0]) + " responded on link post with invalid sotframe id")
-							raise ValueError("plexi in panic. local and remote misalignment.")
-						if success and frame:
-							self.communicate(self._cell(node_id, so, co, frame, lo, lt, self.dodag.get_node(tna), old_payload))
-							self.communicate(self.celled(node_id, so, co, frame, lo, lt, self.dodag.get_node(tna), old_payload))
-						else:
-							logg.warning("Node " + str(response.remote[0]) + " could not set the link " + str(i))
-							self.communicate(self.celled(node_id, so, co, frame, None, None, self.dodag.get_node(tna), old_payload))
-					else:
-						logg.critical("Node " + str(response.remote[0]) + " replied on a link post with invalid payload format i.e. " + str(i) + ". Integer was expected.")
-						self.communicate(self.celled(node_id, None, None, None, None, None, None, old_payload))
+			payload = codec.decode(response)
 		except ValueError as ve:
-			logg.critical(ve.message+'. Command is skipped')
-			self.communicate(self.celled(node_id, None, None, None, None, None, None, old_payload))
+			logg.critical(ve.message + '. Command is skipped')
+			payload = []
+		if not isinstance(payload, list):
+			payload = []
+		# A merged command carries one cell per reply item, in the same order
+		cells = posted if isinstance(posted, list) else [posted] * max(len(payload), 1)
+		if len(payload) != len(cells):
+			logg.critical("Node " + str(response.remote[0]) + " replied on a post of " + str(len(cells)) + " links with " + str(len(payload)) + " results i.e. " + codec.text(response))
+		for index, old_payload in enumerate(cells):
+			i = payload[index] if index < len(payload) else None
+			if not isinstance(i, (int, long)):
+				if i is not None:
+					logg.critical("Node " + str(response.remote[0]) + " replied on a link post with invalid payload format i.e. " + str(i) + ". Integer was expected.")
+				self.communicate(self.celled(node_id, None, None, None, None, None, None, old_payload))
+				continue
+			# If successful installation of link, insert the link into local link container
+			try:
+				success = i > 0
+				so = old_payload[terms.resources['6TOP']['CELLLIST']['SLOTOFFSET']['LABEL']]
+				co = old_payload[terms.resources['6TOP']['CELLLIST']['CHANNELOFFSET']['LABEL']]
+				fd = old_payload[terms.resources['6TOP']['CELLLIST']['SLOTFRAME']['LABEL']]
+				lo = old_payload[terms.resources['6TOP']['CELLLIST']['LINKOPTION']['LABEL']]
+				lt = old_payload[terms.resources['6TOP']['CELLLIST']['LINKTYPE']['LABEL']]
+				tna = old_payload[terms.resources['6TOP']['CELLLIST']['TARGETADDRESS']['LABEL']]
+				frame = None
+				for f in self.frames.values():
+					if f.get_alias_id(node_id) == int(fd):
+						frame = f
+						break
+				if not frame:
+					logg.critical("Node " + str(response.remote[0]) + " responded on link post with invalid sotframe id")
+					raise ValueError("plexi in panic. local and remote misalignment.")
+				if success and frame:
+					self.communicate(self._cell(node_id, so, co, frame, lo, lt, self.dodag.get_node(tna), old_payload))
+					self.communicate(self.celled(node_id, so, co, frame, lo, lt, self.dodag.get_node(tna), old_payload))
+				else:
+					logg.warning("Node " + str(response.remote[0]) + " could not set the link " + str(i))
+					self.communicate(self.celled(node_id, so, co, frame, None, None, self.dodag.get_node(tna), old_payload))
+			except ValueError as ve:
+				logg.critical(ve.message + '. Command is skipped')
+				self.communicate(self.celled(node_id, None, None, None, None, None, None, old_payload))
 
 		# Remove cached command that triggered this response
 		cached_entry = self._decache(tk)
-		self._touch_session(cached_entry['command'], session_id)
+		self._touch_session(cached_entry.command, session_id)
 
 	def _post_6top_statistics(self, response):
 		"""
@@ -617,18 +1049,18 @@ class Reflector(object):
 		if tk not in self.cache:
 			return
 		cache_entry = self.cache[tk]
-		session_id = self.cache[tk]["session"]
+		session_id = self.cache[tk].session
 		node_id = NodeID(response.remote[0], response.remote[1])
-		uri = cache_entry['command'].uri
+		uri = cache_entry.command.uri
 		if response.code != coap.CHANGED:
 			tmp = str(node_id) + ' returned a ' + coap.responses[response.code] + '\n\tRequest: ' + str(self.cache[tk])
 			cached_entry = self._decache(tk)
-			self._touch_session(cached_entry['command'], session_id)
+			self._touch_session(cached_entry.command, session_id)
 			raise exception.UnsupportedCase(tmp)
 
 		self.communicate(self.reported(node_id, uri, coap.CHANGED))
 		cached_entry = self._decache(tk)
-		self._touch_session(cached_entry['command'], session_id)
+		self._touch_session(cached_entry.command, session_id)
 
 	def _delete_6top_link(self, response):
 		"""
@@ -643,17 +1075,18 @@ class Reflector(object):
 		if tk not in self.cache:
 			return
 		cache_entry = self.cache[tk]
-		session_id = cache_entry["session"]
+		session_id = cache_entry.session
 		node_id = NodeID(response.remote[0], response.remote[1])
 		if response.code != coap.CONTENT:
 			tmp = str(node_id) + ' returned a ' + coap.responses[response.code] + '\n\tRequest: ' + str(self.cache[tk])
-			self._decache(tk)
+			cached_entry = self._decache(tk)
+			self._touch_session(cached_entry.command, session_id)
 			raise exception.UnsupportedCase(tmp)
-		clean_payload = parser.clean_payload(response.payload)
+		clean_payload = codec.text(response)
 		cached_entry = self._decache(tk)
-		self.communicate(self._delete(node_id, cache_entry['command'].uri, clean_payload))
-		self.communicate(self.deleted(node_id, cache_entry['command'].uri, clean_payload))
-		self._touch_session(cached_entry['command'], session_id)
+		self.communicate(self._delete(node_id, cache_entry.command.uri, clean_payload))
+		self.communicate(self.deleted(node_id, cache_entry.command.uri, clean_payload))
+		self._touch_session(cached_entry.command, session_id)
 
 	def _get_resource(self, response):
 		"""
@@ -674,28 +1107,28 @@ class Reflector(object):
 		if tk not in self.cache:
 			return
 		cache_entry = self.cache[tk]
-		session_id = cache_entry["session"]
+		session_id = cache_entry.session
 		node_id = NodeID(response.remote[0], response.remote[1])
-		uri = cache_entry['command'].uri
+		uri = cache_entry.command.uri
 		if response.code == coap.NOT_FOUND:
 			logg.debug("Probe on " + str(response.remote[0]) + " did not find anything on "+uri+" i.e. MID:" + str(response.mid))
 			self.communicate(self.reported(node_id, uri, None))
 		elif response.code != coap.CONTENT:
 			tmp = str(node_id) + ' returned a ' + coap.responses[response.code] + '\n\tRequest: ' + uri + '>' + response.payload
-			self._decache(tk)
+			cached_entry = self._decache(tk)
+			self._touch_session(cached_entry.command, session_id)
 			raise exception.UnsupportedCase(tmp)
 		else:
-			clean_payload = parser.clean_payload(response.payload)
-			#logg.debug("Probe on " + str(response.remote[0]) + " reported " + str(clean_payload) + " i.e. MID:" + str(response.mid))
+			#logg.debug("Probe on " + str(response.remote[0]) + " reported " + codec.text(response) + " i.e. MID:" + str(response.mid))
 			#try:
-			payload = json.loads(clean_payload)
+			payload = codec.decode(response)
 			self.communicate(self._report(node_id, uri, payload))
 			self.communicate(self.reported(node_id, uri, payload))
 			#except ValueError as ve:
 			#	logg.critical(ve.message+'. Command is skipped')
 			#	self.communicate(self.reported(node_id, uri, None))
 		cached_entry = self._decache(tk)
-		self._touch_session(cached_entry['command'], session_id)
+		self._touch_session(cached_entry.command, session_id)
 
 	def _push_command(self, comm, session):
 		"""
@@ -715,6 +1148,7 @@ class Reflector(object):
 						comm.callback = self._get_rpl_dag
 				elif comm.uri.startswith(terms.get_resource_uri('6TOP', 'SLOTFRAME')):
 					if comm.op == 'post':
+						posted = []
 						for f in comm.payload if isinstance(comm.payload, list) else [comm.payload]:
 							to_be_transferred_id = f[terms.resources['6TOP']['SLOTFRAME']['ID']['LABEL']]
 							slotframes = comm.attachment('frames')
@@ -723,11 +1157,15 @@ class Reflector(object):
 								logg.warning("Posting frame to " + str(comm.to) + " FAILED >> " + comm.op + " " + comm.uri + " -- " + str(comm.payload) + " ** INCORRECT SLOTFRAME ID **")
 								return
 							elif current_frame_id is not None and current_frame_id != to_be_transferred_id:
+								# Payloads are immutable: the frame is posted anew with the id the node knows it by
+								f = copy.copy(f)
 								f[terms.resources['6TOP']['SLOTFRAME']['ID']['LABEL']] = current_frame_id
 								slotframe = slotframes[to_be_transferred_id]
 								del slotframes[to_be_transferred_id]
 								slotframes[current_frame_id] = slotframe
 								comm.attach(frames=slotframes)
+							posted.append(f)
+						comm.payload = posted if isinstance(comm.payload, list) else posted[0]
 						comm.callback = self._post_6top_slotframe
 					elif comm.op == 'get' or comm.op == 'observe':
 						comm.callback = self._get_resource
@@ -736,9 +1174,10 @@ class Reflector(object):
 				elif comm.uri.startswith(terms.get_resource_uri('6TOP', 'CELLLIST')):
 					if comm.op == 'post':
 						comm.callback = self._post_6top_link
-						if not isinstance(comm.payload[terms.resources['6TOP']['CELLLIST']['SLOTFRAME']['LABEL']], (long, int)):
-							logg.warning("Link " + str(comm.payload) + " to " + str(comm.to) + " was not posted. Slotframe not known to node")
-							return
+						for c in comm.payload if isinstance(comm.payload, list) else [comm.payload]:
+							if not isinstance(c[terms.resources['6TOP']['CELLLIST']['SLOTFRAME']['LABEL']], (long, int)):
+								logg.warning("Link " + str(c) + " to " + str(comm.to) + " was not posted. Slotframe not known to node")
+								return
 					elif comm.op == 'get' or comm.op == 'observe':
 						slotframe = comm.attachment('frame')
 						if isinstance(slotframe, Slotframe):
@@ -771,16 +1210,39 @@ class Reflector(object):
 					comm.callback = self._post_6top_statistics
 				else:
 					comm.callback = self._get_resource
-			self.cache[comm.id] = {'session': session, 'command': copy.copy(comm) }
+			if comm.priority is None:
+				comm.priority = self._priority_of(comm)
+			# The command is cached as it is, its payload is immutable
+			self.cache[comm.id] = Pending(comm, session)
+			if self.cache.size is not None and len(self.cache) > self.cache.size:
+				self._sweep()
 			logg.debug("Sending to " + str(comm.to) + " >> " + comm.op + " " + comm.uri + " -- " + str(comm.payload))
+			deadline = comm.deadline if comm.deadline else self.command_timeout
 			if comm.op == 'get':
-				self.client.GET(comm.to, comm.uri, comm.id, comm.callback)
+				self.client.GET(comm.to, comm.uri, comm.id, comm.callback, comm.priority, self._failed, deadline)
 			elif comm.op == 'observe':
-				self.client.OBSERVE(comm.to, comm.uri, comm.id, comm.callback)
+				self.client.OBSERVE(comm.to, comm.uri, comm.id, comm.callback, comm.priority, self._failed, deadline)
 			elif comm.op == 'post':
-				self.client.POST(comm.to, comm.uri, parser.construct_payload(comm.payload), comm.id, comm.callback)
+				self.client.POST(comm.to, comm.uri, comm.payload, comm.id, comm.callback, comm.priority, self._failed, deadline)
 			elif comm.op == 'delete':
-				self.client.DELETE(comm.to, comm.uri, comm.id, comm.callback)
+				self.client.DELETE(comm.to, comm.uri, comm.id, comm.callback, comm.priority, self._failed, deadline)
+
+	def _priority_of(self, comm):
+		"""
+		Classify a command that was not given a priority by the application. RPL resources decide on (dis)connections of
+		nodes and are topology control. Installing or removing slotframes and cells changes the schedule. Anything else
+		e.g. reading cells, neighbors, queues or statistics is monitoring.
+
+		:param comm: the command to be classified
+		:type comm: Command
+		:return: interface.TOPOLOGY, interface.SCHEDULE or interface.MONITORING
+		:rtype: int
+		"""
+		if comm.uri.startswith(terms.get_resource_uri('RPL')):
+			return interface.TOPOLOGY
+		if comm.op in ['post', 'delete'] and (comm.uri.startswith(terms.get_resource_uri('6TOP', 'SLOTFRAME')) or comm.uri.startswith(terms.get_resource_uri('6TOP', 'CELLLIST'))):
+			return interface.SCHEDULE
+		return interface.MONITORING
 
 	def _connect(self, child, parent, old_parent=None):
 		"""
@@ -798,6 +1260,23 @@ class Reflector(object):
 		self.Streamer.AddNode(str(child), str(parent))
 		return q
 
+	def _validate(self, node_id):
+		"""
+		is called when a node restored from a snapshot is first reported by its parent. Like :func:`_connect`, installs the
+		observer for the dodaginfo resource, but instead of fetching its slotframes and cells, only fetches the ids of its
+		cells. These are fetched too only if their number differs from that of the snapshot, see :func:`_report`.
+		"""
+		self.unvalidated.discard(node_id)
+		q = interface.BlockQueue()
+		q.push(Command('observe', node_id, terms.get_resource_uri('RPL', 'DAG')))
+		if not self.observeflag:
+			self.validating[node_id] = sum(len(frame.get_cells_of(node_id)) for frame in self.frames.values())
+			q.push(Command('get', node_id, terms.get_resource_uri('6TOP', 'CELLLIST', 'ID')))
+		q.block()
+		if node_id != self.root_id:
+			self.Streamer.AddNode(str(node_id), str(self.dodag.get_parent(node_id)))
+		return q
+
 	def _disconnect(self, node_id, children):
 	# handles the case of a node disconnects from the network
 		logg.debug(str(node_id) + " was removed from the network")
@@ -845,7 +1324,7 @@ class Reflector(object):
 	def _cell(self, who, slotoffs, channeloffs, frame, linkoption, linktype, target, old_payload):
 		# handles the actions performed when a node receives his cell/s
 		# add the cell to the appropriate cell container
-		frame.cell_container.append(Cell(who, slotoffs, channeloffs, frame.get_alias_id(who), linktype, linkoption, target))
+		frame.append_link(Cell(who, slotoffs, channeloffs, frame.get_alias_id(who), linktype, linkoption, target))
 		logg.debug(str(who) + " installed new cell in frame " + frame.name + " at slotoffset=" + str(slotoffs) + " and channel offset=" + str(channeloffs))
 		self.Streamer.ChangeCell(who, slotoffs, channeloffs, frame, "foo", 1)
 		return None
@@ -965,6 +1444,17 @@ class Reflector(object):
 		elif str(resource) == terms.get_resource_uri('6TOP', 'CELLLIST', 'ID'):
 			payload = copy.copy(info)
 			q = interface.BlockQueue()
+			if who in self.validating:
+				# The node was restored from a snapshot, see _validate
+				expected = self.validating.pop(who)
+				if len(payload) == expected:
+					logg.debug(str(who) + ' holds the ' + str(expected) + ' cells of the snapshot')
+					return None
+				logg.info(str(who) + ' holds ' + str(len(payload)) + ' cells instead of the ' + str(expected) + ' of the snapshot. Its slotframes and cells are fetched again')
+				for frame in self.frames.values():
+					frame.delete_cells(frame.get_cells_of(who))
+				q.push(Command('get', who, terms.get_resource_uri('6TOP', 'SLOTFRAME')))
+				q.block()
 			for link_id in payload:
 				q.push(Command('get', who, terms.get_resource_uri('6TOP', 'CELLLIST', ID=link_id)))
 			q.block()
@@ -989,13 +1479,209 @@ class Reflector(object):
 			self.start_commands.append(assembly)
 			return
 
-		if isinstance(assembly, interface.BlockQueue):
+		if isinstance(assembly, (interface.BlockQueue, interface.CommandGraph)):
 			self._create_session(assembly)
 		elif isinstance(assembly, list):
 			for i in assembly:
-				if isinstance(i, interface.BlockQueue):
+				if isinstance(i, (interface.BlockQueue, interface.CommandGraph)):
 					self._create_session(i)
 
+	def cancel_session(self, session_id):
+		"""
+		Abandon a session: its commands still waiting for a reply are cancelled, those parked in an outbox are dropped and
+		its remaining blocks are never sent. Observations already installed by the session are kept.
+
+		:param session_id: identifier of the session, as counted by count_sessions
+		:type session_id: int
+		:return: True if the session was still running
+		:rtype: bool
+		"""
+		if session_id not in self.sessions:
+			return False
+		del self.sessions[session_id]
+		timer = self.session_timers.pop(session_id, None)
+		if timer is not None and timer.active():
+			timer.cancel()
+		for to, entries in self.outbox.items():
+			entries = [(comm, s) for comm, s in entries if s != session_id]
+			if entries:
+				self.outbox[to] = entries
+			else:
+				del self.outbox[to]
+		for token, entry in self.cache.items():
+			# A merged command is cancelled along with the last of the sessions of its constituents
+			sessions = set(s for comm, s in entry.command.attachment('merged') or [(entry.command, entry.session)])
+			if session_id in sessions and not sessions & set(self.sessions) and entry.command.op != 'observe':
+				# Drop the cache entry first so that the cancellation is not reported as a failure
+				del self.cache[token]
+				self.client.cancel(token)
+		return True
+
+	def evict_node(self, node_id):
+		"""
+		Drop the commands to a node that left the network, its observations included, without contacting it. Their
+		sessions carry on as if they had failed.
+
+		:param node_id: the node that left
+		:type node_id: NodeID
+		:return: the number of evicted commands
+		:rtype: int
+		"""
+		evicted = 0
+		for token, entry in self.cache.items():
+			if entry.command.to == node_id and token in self.cache:
+				self._evict(token, str(node_id) + ' left the network', False)
+				evicted += 1
+		for comm, session_id in self.outbox.pop(node_id, []):
+			self._touch_session(comm, session_id)
+			self.communicate(self.failed(comm, exception.Expired(str(node_id) + ' left the network')))
+			evicted += 1
+		return evicted
+
+	def _sweep(self):
+		"""
+		Evict the entries of the cache that are too many or too old, see :class:`CommandCache`.
+		"""
+		for token in self.cache.stale():
+			if token in self.cache:
+				self._evict(token, 'evicted from the cache after ' + str(round(self.clock.seconds() - self.cache[token].time, 1)) + 's')
+
+	def _evict(self, token, reason, contact=True):
+		"""
+		Drop a cache entry. A request is cancelled, released from its session and reported as failed; an observation is
+		cancelled at the node, unless it should not be contacted.
+
+		:param token: the id of the command
+		:type token: int
+		:param reason: why the command is evicted
+		:type reason: str
+		:param contact: False if the node is not to be contacted
+		:type contact: bool
+		"""
+		# Drop the cache entry first so that the cancellation is not reported by :func:`_failed` too
+		entry = self.cache.pop(token)
+		logg.warning("Command " + str(token) + " " + entry.command.op + " " + entry.command.uri + " to " + str(entry.command.to) + " " + reason)
+		if entry.command.op == 'observe':
+			if contact:
+				self.client.CANCEL_OBSERVE(entry.command.to, entry.command.uri, token, None)
+			return
+		self.client.cancel(token)
+		self._touch_session(entry.command, entry.session)
+		merged = entry.command.attachment('merged')
+		for comm in [c for c, s in merged] if merged else [entry.command]:
+			self.communicate(self.failed(comm, exception.Expired(reason)))
+
+	def leaks(self):
+		"""
+		Report of the commands and sessions held, to spot what keeps growing. A session none of whose commands is pending
+		can never finish i.e. it is stalled, e.g. because a callback raised before releasing its command.
+
+		:return: the report of the cache (see :func:`CommandCache.report`) plus the number of sessions, the ids of the
+			stalled ones and the number of commands in outboxes
+		:rtype: dict
+		"""
+		report = self.cache.report()
+		pending = set()
+		for entry in self.cache.values():
+			pending.update(s for c, s in entry.command.attachment('merged') or [(entry.command, entry.session)])
+		outboxed = 0
+		for entries in self.outbox.values():
+			pending.update(s for c, s in entries)
+			outboxed += len(entries)
+		report['sessions'] = len(self.sessions)
+		report['stalled'] = sorted(session_id for session_id in self.sessions if session_id not in pending)
+		report['outbox'] = outboxed
+		return report
+
+	def _report_leaks(self):
+		report = self.leaks()
+		logg.info('Leaks: ' + str(report['entries']) + ' commands cached, oldest ' + str(report['oldest']) + 's, by age ' +
+				str(report['by_age']) + ', by command ' + str(report['by_command']) + '; ' + str(report['sessions']) +
+				' sessions, ' + str(len(report['stalled'])) + ' stalled ' + str(report['stalled'][:10]) + '; ' +
+				str(report['outbox']) + ' commands in outboxes')
+
+	def save_snapshot(self, path=None):
+		"""
+		Write the slotframes with their cells and node-assigned ids, the DoDAG and the blacklists to a binary snapshot,
+		atomically, see :mod:`core.snapshot`.
+
+		:param path: the file to write, snapshot_file if None
+		:type path: str
+		:return: the size of the snapshot in bytes
+		:rtype: int
+		:raises: IOError or OSError if the file cannot be written
+		"""
+		data = snapshot.dumps(self.dodag, self.frames, self.blacklisted, self.clock.seconds())
+		snapshot.save(path or self.snapshot_file, data)
+		return len(data)
+
+	def _save_snapshot(self):
+		try:
+			size = self.save_snapshot()
+		except (IOError, OSError, ValueError, struct.error) as e:
+			logg.critical('Snapshot could not be saved to ' + str(self.snapshot_file) + ': ' + str(e))
+			return
+		logg.debug('Snapshot of ' + str(len(self.dodag.graph.nodes())) + ' nodes saved to ' + str(self.snapshot_file) + ' (' + str(size) + 'B)')
+
+	def load_snapshot(self, path=None):
+		"""
+		Restore the slotframes, the DoDAG and the blacklists of a snapshot, see :func:`save_snapshot`. Cells of a slotframe
+		already registered under the same name replace its cells, other slotframes are registered. The restored nodes are
+		trusted until their parents report them: then their dodaginfo is observed again and their cells are fetched
+		only if the node holds another number of them, see :func:`_validate`. Nodes that left in the meantime are
+		detected as lost children. Mind that :func:`connected` is not called for the restored nodes.
+
+		:param path: the file to read, snapshot_file if None
+		:type path: str
+		:return: True if the snapshot was restored, False if there is no valid snapshot of this network
+		:rtype: bool
+		"""
+		path = path or self.snapshot_file
+		try:
+			restored = snapshot.load(path)
+		except (IOError, ValueError) as e:
+			logg.warning('No snapshot restored from ' + str(path) + ': ' + str(e))
+			return False
+		if restored.root != self.root_id:
+			logg.warning('Snapshot ' + str(path) + ' is of the network of ' + str(restored.root) + '. It is not restored.')
+			return False
+		for child, parent in restored.edges:
+			self.dodag.attach_child(child, parent)
+		for name, slots, columnar, fds, cells in restored.frames:
+			frame = self.frames.get(name)
+			if frame is None:
+				frame = ColumnarSlotframe(name, slots) if columnar and numpy is not None else Slotframe(name, slots)
+				self.frames[name] = frame
+			elif frame.slots != slots:
+				logg.warning('Slotframe ' + name + ' has ' + str(frame.slots) + ' slots, ' + str(slots) + ' in the snapshot. It is not restored.')
+				continue
+			else:
+				frame.delete_cells(list(frame.cell_container))
+			frame.fds.update(fds)
+			for cell in cells:
+				frame.append_link(cell)
+			self.blacklisted.setdefault(name, [])
+		self.blacklisted.update(restored.blacklisted)
+		self.unvalidated = restored.nodes()
+		logg.info('Restored ' + str(len(self.unvalidated)) + ' nodes and ' + str(len(restored.frames)) + ' slotframes from the snapshot of ' + str(path) + ' taken at ' + str(restored.time))
+		return True
+
+	def cancel_command(self, command_id):
+		"""
+		Cancel a command that was sent and waits for a reply. Its session carries on as if the command had been answered.
+
+		:param command_id: the id of the command
+		:type command_id: int
+		:return: True if the command was waiting for a reply
+		:rtype: bool
+		"""
+		if command_id not in self.cache:
+			return False
+		entry = self.cache.pop(command_id)
+		self.client.cancel(command_id)
+		self._touch_session(entry.command, entry.session)
+		return True
+
 	def connected(self, child, parent=None, old_parent=None):
 		"""
 		api call back for when a new node connects to the network
@@ -1042,18 +1728,35 @@ class Reflector(object):
 	def reported(self, node, resource, value):
 		pass
 
+	def failed(self, command, reason):
+		"""
+		api callback for when a command got no reply i.e. its deadline passed, it was cancelled or its session expired.
+		The command has already been released from its session.
+
+		:param command: the failed command
+		:type command: :class:`interface.Command`
+		:param reason: the cause of the failure e.g. defer.TimeoutError or exception.Expired
+		:type reason: Exception
+		:return: a BlockQueue or list of BlockQueues of commands to be sent to the network, or None
+		"""
+		pass
+
 
 class SchedulerInterface(Reflector):
 
 	def start(self):
-		q = interface.BlockQueue()
-		q.push(Command('observe', self.root_id, terms.get_resource_uri('RPL', 'DAG')))
-		if not self.observeflag:
-			q.push(Command('get', self.root_id, terms.get_resource_uri('6TOP', 'SLOTFRAME')))
+		if self.warm_start and self.load_snapshot():
+			# The other nodes are validated as their parents report them
+			self.communicate(self._validate(self.root_id))
+		else:
+			q = interface.BlockQueue()
+			q.push(Command('observe', self.root_id, terms.get_resource_uri('RPL', 'DAG')))
+			if not self.observeflag:
+				q.push(Command('get', self.root_id, terms.get_resource_uri('6TOP', 'SLOTFRAME')))
+				q.block()
+				q.push(Command('get', self.root_id, terms.get_resource_uri('6TOP', 'CELLLIST', 'ID')))
 			q.block()
-			q.push(Command('get', self.root_id, terms.get_resource_uri('6TOP', 'CELLLIST', 'ID')))
-		q.block()
-		self.communicate(q)
+			self.communicate(q)
 
 		super(SchedulerInterface, self)._start()
 
@@ -1181,12 +1884,11 @@ class SchedulerInterface(Reflector):
 
 		found_tx = None
 		found_rx = []
-		for c in slotframe.cell_container:
-			if c.slot == slot and c.channel == channel:
-				if destination is not None and c.option & 1 == 1 and c.owner == source and c.tna == (destination if destination is not None else BROADCASTID):
-					found_tx = c.owner
-				elif destination is not None and c.option & 2 == 2 and c.tna == source and ((c.owner == destination) if destination is not None else c.owner in self.dodag.get_neighbors()):
-					found_rx.append(c.owner)
+		for c in slotframe.get_cells_similar_to(slot=slot, channel=channel):
+			if destination is not None and c.option & 1 == 1 and c.owner == source and c.tna == (destination if destination is not None else BROADCASTID):
+				found_tx = c.owner
+			elif destination is not None and c.option & 2 == 2 and c.tna == source and ((c.owner == destination) if destination is not None else c.owner in self.dodag.get_neighbors()):
+				found_rx.append(c.owner)
 		cells = []
 		if destination is not None:
 			if not found_tx and (target is None or target == source):
@@ -1205,14 +1907,7 @@ class SchedulerInterface(Reflector):
 		rx_cells = []
 		tx_cells = []
 		for c in cells:
-			comm = Command('post', c.owner, terms.get_resource_uri('6TOP', 'CELLLIST'), {
-				terms.resources['6TOP']['CELLLIST']['SLOTOFFSET']['LABEL']: c.slot,
-				terms.resources['6TOP']['CELLLIST']['CHANNELOFFSET']['LABEL']: c.channel,
-				terms.resources['6TOP']['CELLLIST']['SLOTFRAME']['LABEL']: c.slotframe,
-				terms.resources['6TOP']['CELLLIST']['LINKOPTION']['LABEL']: c.option,
-				terms.resources['6TOP']['CELLLIST']['LINKTYPE']['LABEL']: c.type,
-				terms.resources['6TOP']['CELLLIST']['TARGETADDRESS']['LABEL']: c.tna.eui_64_ip
-			})
+			comm = self._post_cell(c)
 			if c.option & 1 == 1:
 				tx_cells.append(comm)
 			elif c.option & 2 == 2:
@@ -1241,6 +1936,58 @@ class SchedulerInterface(Reflector):
 				return q
 		return None
 
+	def reconcile(self, slotframe, desired):
+		"""
+		Turn the cells of some nodes into the desired ones with as few commands as possible, instead of deleting and
+		posting cells one decision at a time. Desired cells equivalent to installed ones are left alone, the others are
+		deleted or posted as computed by :func:`core.slotframe.Slotframe.diff`. Deleted cells leave the slotframe right
+		away, added cells join it once their nodes confirm them.
+
+		:param slotframe: the slotframe to change
+		:type slotframe: Slotframe
+		:param desired: the cells every node should own in the slotframe; nodes left out keep their cells and a node
+			with no cells loses all of them. The slotframe id of the desired cells is ignored.
+		:type desired: dict of (NodeID : iterable of Cell)
+		:return: one BlockQueue per node to change, deleting its cells in a first block and posting the new ones in a
+			second, so that a cell may take the place of another
+		:rtype: list of BlockQueue
+		"""
+		assert isinstance(slotframe, Slotframe)
+		changes = slotframe.diff(desired)
+		queues = []
+		deleted = []
+		for node in changes.nodes():
+			alias = slotframe.get_alias_id(node)
+			if alias is None:
+				logg.warning('Slotframe ' + str(slotframe) + ' is not installed at ' + str(node) + '. Operation is skipped.')
+				continue
+			q = interface.BlockQueue()
+			for c in changes.to_delete(node):
+				q.push(self._delete_cell(c))
+				self.Streamer.ChangeCell(c.owner, c.slot, c.channel, str(slotframe), "foo", 0)
+				deleted.append(c)
+			q.block()
+			for c in changes.to_add(node):
+				q.push(self._post_cell(Cell(node, c.slot, c.channel, alias, c.type, c.option, c.tna)))
+			q.block()
+			queues.append(q)
+		slotframe.delete_cells(deleted)
+		logg.debug('Reconciled ' + str(slotframe) + ': ' + str(changes))
+		return queues
+
+	def _post_cell(self, c):
+		return Command('post', c.owner, terms.get_resource_uri('6TOP', 'CELLLIST'), {
+			terms.resources['6TOP']['CELLLIST']['SLOTOFFSET']['LABEL']: c.slot,
+			terms.resources['6TOP']['CELLLIST']['CHANNELOFFSET']['LABEL']: c.channel,
+			terms.resources['6TOP']['CELLLIST']['SLOTFRAME']['LABEL']: c.slotframe,
+			terms.resources['6TOP']['CELLLIST']['LINKOPTION']['LABEL']: c.option,
+			terms.resources['6TOP']['CELLLIST']['LINKTYPE']['LABEL']: c.type,
+			terms.resources['6TOP']['CELLLIST']['TARGETADDRESS']['LABEL']: c.tna.eui_64_ip
+		})
+
+	def _delete_cell(self, c):
+		return Command('delete', c.owner, terms.get_resource_uri('6TOP', 'CELLLIST', SLOTFRAME=c.slotframe, SLOTOFFSET=c.slot, CHANNELOFFSET=c.channel))
+
 	def get_neighbor_of(self, node, observable, neighbor=None):
 		assert isinstance(node, NodeID)
 		assert observable is False or observable is True
@@ -1320,8 +2067,12 @@ class SchedulerInterface(Reflector):
 		if rx != BROADCASTID:
 			c1 = Cell(tx,slot,0,slotframe.get_alias_id(tx),0,1,rx)
 			c2 = Cell(rx,slot,0,slotframe.get_alias_id(rx),0,2,tx)
+			# A cell of tx or rx at that slot conflicts for sure, see _conflict
+			if slotframe.busy(slot, tx) or slotframe.busy(slot, rx):
+				return True
 
-		for item in slotframe.cell_container+reservations:
+		# Only cells at the same slot may conflict
+		for item in slotframe.get_cells_similar_to(slot=slot)+[item for item in reservations if item.slot == slot]:
 			if self._conflict(c1,item) or self._conflict(c2,item):
 				return True
 		return False
@@ -1329,7 +2080,7 @@ class SchedulerInterface(Reflector):
 	def interfere(self, slot, tx, rx, slotframe, reservations):
 		assert isinstance(slotframe, Slotframe) and slotframe in self.frames.values()
 		channels = []
-		for item in slotframe.cell_container+reservations:
+		for item in slotframe.get_cells_similar_to(slot=slot)+[item for item in reservations if item.slot == slot]:
 			if item.slot == slot:
 				if item.option & 1 == 1:
 					Txi = item.owner
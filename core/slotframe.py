@@ -7,8 +7,121 @@ __copyright__ = "Copyright 2014, The RICH Project"
 #__license__ = "GPL"
 #__status__ = "Production"
 
+from core.node import NodeID
+import itertools
+from collections import OrderedDict
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+# Channel offsets available to every slot
+CHANNELS = 16
+
+
+class Occupancy(object):
+	"""
+	Bitsets of the cells of a slotframe: bit c of channels[s] is set if a cell uses channel c at slot s and bit s of
+	slots[n] if node n owns, or is the target of, a cell at slot s. The number of cells behind every bit is counted, so
+	that the bit is cleared when the last of them is removed. Cells with a slot or channel that is not a non-negative
+	integer are not counted.
+	"""
+
+	def __init__(self):
+		self.channels = {}
+		self.slots = {}
+		self.cells = {}			# (slot, channel) -> cells
+		self.node_cells = {}	# (node, slot) -> cells
+
+	def add(self, slot, channel, owner, tna):
+		if not isinstance(slot, (int, long)) or not isinstance(channel, (int, long)) or slot < 0 or channel < 0:
+			return
+		if self._count(self.cells, (slot, channel), 1):
+			self.channels[slot] = self.channels.get(slot, 0) | 1 << channel
+		for node in set([owner, tna]).difference([None]):
+			if self._count(self.node_cells, (node, slot), 1):
+				self.slots[node] = self.slots.get(node, 0) | 1 << slot
+
+	def remove(self, slot, channel, owner, tna):
+		if not isinstance(slot, (int, long)) or not isinstance(channel, (int, long)) or slot < 0 or channel < 0:
+			return
+		if self._count(self.cells, (slot, channel), -1):
+			self.channels[slot] &= ~(1 << channel)
+		for node in set([owner, tna]).difference([None]):
+			if self._count(self.node_cells, (node, slot), -1):
+				self.slots[node] &= ~(1 << slot)
+
+	def _count(self, counts, key, step):
+		"""
+		:return: True if the count went from 0 to 1 or from 1 to 0 i.e. the bit of key has to change
+		"""
+		count = counts.get(key, 0) + step
+		if count:
+			counts[key] = count
+		else:
+			counts.pop(key, None)
+		return count == (1 if step > 0 else 0)
+
+	def busy(self, slot, node):
+		return bool(self.slots.get(node, 0) >> slot & 1)
+
+	def free_channels(self, slot):
+		used = self.channels.get(slot, 0)
+		return [channel for channel in range(CHANNELS) if not used >> channel & 1]
+
+	def free_cells(self, slots, tx, rx=None):
+		busy = self.slots.get(tx, 0) | (self.slots.get(rx, 0) if rx is not None else 0)
+		free = []
+		for slot in range(slots):
+			if not busy >> slot & 1:
+				used = self.channels.get(slot, 0)
+				free.extend((slot, channel) for channel in range(CHANNELS) if not used >> channel & 1)
+		return free
+
+
+def _key(value, types):
+	"""
+	The value if it can be looked up in an index i.e. its equality is that of its hash, None otherwise.
+	"""
+	return value if isinstance(value, types) else None
+
+
+class CellView(object):
+	"""
+	Read-only view of the cells of a :class:`Slotframe`, see :attr:`Slotframe.cell_container`.
+	"""
+	__slots__ = ('_cells',)
+
+	def __init__(self, cells):
+		self._cells = cells
+
+	def __len__(self):
+		return len(self._cells)
+
+	def __iter__(self):
+		return iter(self._cells)
+
+	def __getitem__(self, index):
+		return self._cells[index]
+
+	def __contains__(self, cell):
+		return cell in self._cells
+
+
 class Slotframe(object):
+	"""
+	A slotframe and the cells scheduled in it. Besides cell_container, the cells are indexed by owner, target, slot,
+	(slot, channel) and link option, so that queries do not scan all the cells. So is the :class:`Occupancy` of the
+	slots and channels, which answers :func:`free_channels`, :func:`busy` and :func:`free_cells` with bit operations.
+
+	The indexes hold as long as the cells change only through the slotframe: cell_container is a read-only view, cells
+	are added with add_link or append_link and removed with delete_cells or delete_links_of, and a :class:`Cell` cannot
+	be changed while a slotframe holds it. Assigning cell_container replaces all the cells.
+	"""
 	def __init__(self, name, slots):
+		self.indexes = None			# Cells by attribute (key : value) format --> (attribute : {value : [cells]})
+		self.occupancy = None		# Occupancy of the cells in the indexes
 		self.cell_container = []	# Cell container of this slotframe
 		self.slots = slots			# Size of this slotframe in number of slots
 		self.name = name			# SchedulerInterface-assigned reference name of this slotframe
@@ -29,9 +142,110 @@ class Slotframe(object):
 	def set_alias_id(self, node, id):
 		self.fds[node] = id
 
+	@property
+	def cell_container(self):
+		"""
+		The cells of this slotframe in the order they were added, a read-only :class:`CellView`
+		"""
+		return self._view
+
+	@cell_container.setter
+	def cell_container(self, cells):
+		cells = list(cells)
+		if self.indexes is not None:
+			for cell in self._cells:
+				cell._frames -= 1
+		self._cells = []
+		self._view = CellView(self._cells)
+		self.indexes = {'owner': {}, 'tna': {}, 'slot': {}, 'coords': {}, 'link_option': {}}
+		self.occupancy = Occupancy()
+		for cell in cells:
+			self.append_link(cell)
+
+	def _index(self):
+		return self.indexes
+
+	def _keys(self, cell):
+		return (('owner', cell.owner), ('tna', cell.tna), ('slot', cell.slot), ('coords', (cell.slot, cell.channel)),
+				('link_option', cell.option))
+
+	def _add_to_index(self, cell):
+		for index, key in self._keys(cell):
+			bucket = self.indexes[index].get(key)
+			if bucket is None:
+				self.indexes[index][key] = [cell]
+			else:
+				bucket.append(cell)
+		self.occupancy.add(cell.slot, cell.channel, cell.owner, cell.tna)
+		cell._frames += 1
+
+	def _remove_from_index(self, cells):
+		removed = set(id(cell) for cell in cells)
+		buckets = set()
+		for cell in cells:
+			buckets.update(self._keys(cell))
+			self.occupancy.remove(cell.slot, cell.channel, cell.owner, cell.tna)
+			cell._frames -= 1
+		# Every bucket is filtered once, however many of its cells are removed
+		for index, key in buckets:
+			bucket = [cell for cell in self.indexes[index][key] if id(cell) not in removed]
+			if bucket:
+				self.indexes[index][key] = bucket
+			else:
+				del self.indexes[index][key]
+
+	def _candidates(self, slot=None, channel=None, owner=None, tna=None, link_option=None):
+		"""
+		The smallest indexed set of cells that includes all those with the given attributes, all cells if none of them
+		can be looked up.
+		"""
+		indexes = self._index()
+		slot = _key(slot, (int, long))
+		channel = _key(channel, (int, long))
+		owner = _key(owner, NodeID)
+		tna = _key(tna, NodeID)
+		link_option = _key(link_option, (int, long))
+		if slot is not None and channel is not None:
+			return indexes['coords'].get((slot, channel), [])
+		for index, key in (('owner', owner), ('tna', tna), ('slot', slot), ('link_option', link_option)):
+			if key is not None:
+				return indexes[index].get(key, [])
+		return self.cell_container
+
+	def _occupancy(self):
+		self._index()
+		return self.occupancy
+
+	def free_channels(self, slot):
+		"""
+		:return: the channels no cell uses at a slot, the first free one first
+		:rtype: list of int
+		"""
+		return self._occupancy().free_channels(slot)
+
+	def busy(self, slot, node):
+		"""
+		:return: True if the node owns, or is the target of, a cell at the slot
+		:rtype: bool
+		"""
+		return self._occupancy().busy(slot, node)
+
+	def free_cells(self, tx, rx=None):
+		"""
+		The (slot, channel) pairs a link from tx to rx may use: neither node has a cell at the slot and no cell uses the
+		channel at the slot. Links between other nodes may still interfere, see :func:`core.schedule.Reflector.interfere`.
+
+		:param tx: the transmitting node
+		:type tx: NodeID
+		:param rx: the receiving node, None for broadcast
+		:type rx: NodeID
+		:rtype: list of (int, int)
+		"""
+		return self._occupancy().free_cells(self.slots, tx, rx)
+
 	def get_link_by_coords(self, slot, channel, owner):
 		links = []
-		for i in self.cell_container:
+		for i in self._candidates(slot if slot else None, channel if channel else None, owner if owner else None):
 			if (i.slot == slot if slot else True) and (i.channel == channel if channel else True) and (i.owner == owner if owner else True):
 				links.append(i)
 		return links
@@ -41,7 +255,7 @@ class Slotframe(object):
 			return False
 		same_cell_links = self.get_link_by_coords(link.slot, link.channel, None)
 		if not same_cell_links:
-			self.cell_container.append(link)
+			self.append_link(link)
 			return True
 		else:
 			for l in same_cell_links:
@@ -49,11 +263,16 @@ class Slotframe(object):
 					return False
 		return True
 
-
+	def append_link(self, link):
+		"""
+		Add a cell as it is, without the checks of :func:`add_link`.
+		"""
+		self._cells.append(link)
+		self._add_to_index(link)
 
 	def get_cells_similar_to(self, **kwargs):
 		matching_cells = []
-		for i in self.cell_container:
+		for i in self._candidates(kwargs.get('slot'), kwargs.get('channel'), kwargs.get('owner'), kwargs.get('tna'), kwargs.get('link_option')):
 			if 'owner' in kwargs.keys() and kwargs['owner'] != i.owner:
 				continue
 			if 'slot' in kwargs.keys() and kwargs['slot'] != i.slot:
@@ -73,15 +292,18 @@ class Slotframe(object):
 
 	def get_cells_of(self, node_id):
 		all_cells = []
-		for item in self.cell_container:
+		for item in self._candidates(owner=node_id):
 			if item.owner == node_id:
 				all_cells.append(item)
 		return all_cells
 
 	def delete_links_of(self, node_id):
 		deleted_cell_container = []
-		for item in self.cell_container:
-			if item.owner == node_id or item.tna == node_id:
+		for item in self._candidates(owner=node_id):
+			if item.owner == node_id:
+				deleted_cell_container.append(item)
+		for item in self._candidates(tna=node_id):
+			if item.tna == node_id and item.owner != node_id:
 				deleted_cell_container.append(item)
 		self.delete_cells(deleted_cell_container)
 		# for dltd in deleted_cell_container:
@@ -89,8 +311,57 @@ class Slotframe(object):
 		return deleted_cell_container
 
 	def delete_cells(self, cells):
+		"""
+		Remove cells from the slotframe in a single pass over cell_container.
+
+		:raises: ValueError if a cell is not in the slotframe, after removing the others
+		"""
+		indexes = self._index()
+		removed = {}
 		for cell in cells:
-			self.cell_container.remove(cell)
+			if id(cell) not in removed and cell in indexes['coords'].get((cell.slot, cell.channel), []):
+				removed[id(cell)] = cell
+		self._remove_from_index(removed.values())
+		self._cells[:] = [cell for cell in self._cells if id(cell) not in removed]
+		if len(removed) < len(cells):
+			raise ValueError('Slotframe.delete_cells(x): x not in slotframe')
+
+	def diff(self, desired):
+		"""
+		The changes that turn the cells of some nodes into the desired ones. Cells are compared by slot, channel, link
+		option, link type and target, so a desired cell equivalent to an existing one costs nothing. A deleted and an
+		added cell of the same node with the same option, type and target are paired as a move.
+
+		:param desired: the cells every node should own in this slotframe; nodes left out keep their cells and a node
+			with no cells loses all of them
+		:type desired: dict of (NodeID : iterable of Cell)
+		:rtype: CellDiff
+		"""
+		changes = CellDiff()
+		for node, cells in desired.items():
+			current = OrderedDict()
+			for cell in self.get_cells_of(node):
+				current.setdefault(CellDiff.key(cell), cell)
+			wanted = OrderedDict()
+			for cell in cells:
+				wanted.setdefault(CellDiff.key(cell), cell)
+			deleted = [cell for key, cell in current.items() if key not in wanted]
+			added = [cell for key, cell in wanted.items() if key not in current]
+			moved = []
+			for old in list(deleted):
+				for new in added:
+					if (old.option, old.type, old.tna) == (new.option, new.type, new.tna):
+						deleted.remove(old)
+						added.remove(new)
+						moved.append((old, new))
+						break
+			if deleted:
+				changes.deleted[node] = deleted
+			if added:
+				changes.added[node] = added
+			if moved:
+				changes.moved[node] = moved
+		return changes
 
 	# def set_remote_cell_id(self,who,channel,slot,remote_id):
 	# 	for c in self.cell_container:
@@ -102,6 +373,10 @@ class Slotframe(object):
 		return self.name
 
 class Cell(object):
+	"""
+	A cell of a node in a slotframe. A cell cannot be changed while a :class:`Slotframe` holds it, as the slotframe
+	indexes it by its attributes: delete it, change a copy (copy.copy returns a cell in no slotframe) and add that.
+	"""
 	def __init__(self, node, so, co, fd, lt, lo, tna):
 		self._owner = node		# The node to which this cell belongs to
 		self._slotframe_id = fd		# The local frame id (that of the owner), the cell belongs to
@@ -110,6 +385,17 @@ class Cell(object):
 		self._link_type = lt
 		self._link_option = lo 		# For unicast Tx is 1, for unicast Rx is 2, for broadcast Tx is 9, for broadcast Rx is 10
 		self._target = tna
+		self._frames = 0		# Number of slotframes holding this cell
+
+	def __copy__(self):
+		cell = object.__new__(type(self))
+		cell.__dict__.update(self.__dict__)
+		cell._frames = 0
+		return cell
+
+	def _changing(self):
+		if self._frames:
+			raise TypeError('cells are immutable while in a slotframe')
 
 	@property
 	def owner(self):
@@ -117,6 +403,7 @@ class Cell(object):
 
 	@owner.setter
 	def owner(self, node):
+		self._changing()
 		self._owner = node
 
 	@property
@@ -125,6 +412,7 @@ class Cell(object):
 
 	@slotframe.setter
 	def slotframe(self, frame):
+		self._changing()
 		self._slotframe_id = frame
 
 	@property
@@ -133,6 +421,7 @@ class Cell(object):
 
 	@channel.setter
 	def channel(self, channel_offset):
+		self._changing()
 		self._channel = channel_offset
 
 	@property
@@ -141,6 +430,7 @@ class Cell(object):
 
 	@slot.setter
 	def slot(self, slot_offset):
+		self._changing()
 		self._slot = slot_offset
 
 	@property
@@ -149,6 +439,7 @@ class Cell(object):
 
 	@tna.setter
 	def tna(self, node):
+		self._changing()
 		self._target = node
 
 	@property
@@ -157,6 +448,7 @@ class Cell(object):
 
 	@type.setter
 	def type(self, lt):
+		self._changing()
 		self._link_type = lt
 
 	@property
@@ -165,10 +457,263 @@ class Cell(object):
 
 	@option.setter
 	def option(self, lo):
-		self.link_option = lo
+		self._changing()
+		self._link_option = lo
 
 	def __str__(self):
 		ownership = str(self.owner)+'/'+str(self.slotframe)
 		coordinates = '['+str(self.slot)+','+str(self.channel)+']'
 		properties = '{'+str(self.type)+','+str(self.option)+'}'
 		return ownership+':'+coordinates+':'+':'+properties
+
+
+class CellDiff(object):
+	"""
+	The cells to delete, add and move per node to reach a desired schedule, see :func:`Slotframe.diff`. Every deletion
+	and addition is one command to the owner of the cell, a move is both: the old cell is deleted, the new one added.
+	"""
+
+	def __init__(self):
+		self.deleted = {}	# node -> [Cell]
+		self.added = {}		# node -> [Cell]
+		self.moved = {}		# node -> [(old Cell, new Cell)]
+
+	@staticmethod
+	def key(cell):
+		return cell.slot, cell.channel, cell.option, cell.type, cell.tna
+
+	def nodes(self):
+		return set(self.deleted.keys() + self.added.keys() + self.moved.keys())
+
+	def to_delete(self, node):
+		return self.deleted.get(node, []) + [old for old, new in self.moved.get(node, [])]
+
+	def to_add(self, node):
+		return self.added.get(node, []) + [new for old, new in self.moved.get(node, [])]
+
+	def __len__(self):
+		"""
+		:return: the number of commands of the changes
+		"""
+		return sum(len(cells) for cells in self.deleted.values() + self.added.values()) + \
+			2 * sum(len(pairs) for pairs in self.moved.values())
+
+	def __str__(self):
+		return '-' + str(sum(len(cells) for cells in self.deleted.values())) + ' +' + \
+			str(sum(len(cells) for cells in self.added.values())) + ' ~' + \
+			str(sum(len(pairs) for pairs in self.moved.values())) + ' cells at ' + str(len(self.nodes())) + ' nodes'
+
+
+# Value of the integer columns of a CellTable for None e.g. the alias of a slotframe not installed at the owner yet
+NONE = -1
+
+
+class TableCell(Cell):
+	"""
+	A cell read from a :class:`CellTable`, a snapshot of its row: changing it does not change the table. Cells read from
+	the same row are equal.
+	"""
+
+	def __eq__(self, other):
+		return getattr(other, 'key', None) == self.key
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash(self.key)
+
+
+class CellTable(object):
+	"""
+	Cells stored column-wise in a structured numpy array: slot, channel, link option, link type and slotframe alias as
+	integers, owner and target as indices of a list of the nodes seen (NONE for None). A cell added gets a key, from a
+	counter shared by all tables, that locates its row.
+
+	Rows stay in the order the cells were added. A deleted row is only marked as such, until more than half of the rows
+	are deleted and the array is compacted.
+	"""
+	DTYPE = [('key', 'i8'), ('slot', 'i4'), ('channel', 'i4'), ('option', 'i4'), ('type', 'i4'), ('frame', 'i4'),
+			('owner', 'i4'), ('tna', 'i4'), ('live', '?')]
+	keys = itertools.count()
+
+	def __init__(self, capacity=64):
+		self.rows = numpy.zeros(capacity, dtype=CellTable.DTYPE)
+		self.size = 0		# Rows in use, deleted or not
+		self.dead = 0		# Rows deleted
+		self.appended = []	# Rows added since the last read, written to the array in bulk
+		self.nodes = []
+		self.node_index = {}
+		self.occupancy = Occupancy()
+
+	def __len__(self):
+		return self.size + len(self.appended) - self.dead
+
+	def _rows(self):
+		"""
+		:return: the rows in use, the appended ones included
+		:rtype: numpy.ndarray
+		"""
+		if self.appended:
+			if self.size + len(self.appended) > len(self.rows):
+				rows = numpy.zeros(max(2 * len(self.rows), self.size + len(self.appended)), dtype=CellTable.DTYPE)
+				rows[:self.size] = self.rows[:self.size]
+				self.rows = rows
+			self.rows[self.size:self.size + len(self.appended)] = self.appended
+			self.size += len(self.appended)
+			self.appended = []
+		return self.rows[:self.size]
+
+	def _intern(self, node):
+		if node is None:
+			return NONE
+		if node not in self.node_index:
+			self.node_index[node] = len(self.nodes)
+			self.nodes.append(node)
+		return self.node_index[node]
+
+	def _node(self, index):
+		return self.nodes[index] if index != NONE else None
+
+	def append(self, cell):
+		"""
+		:return: the key of the cell
+		:rtype: int
+		"""
+		key = next(CellTable.keys)
+		self.occupancy.add(cell.slot, cell.channel, cell.owner, cell.tna)
+		self.appended.append((key, cell.slot, cell.channel, cell.option, cell.type,
+							cell.slotframe if cell.slotframe is not None else NONE, self._intern(cell.owner), self._intern(cell.tna), True))
+		return key
+
+	def match(self, **columns):
+		"""
+		Rows of the cells with the given values e.g. match(slot=3, owner=node). Nodes never added and values that are not
+		integers (or None) match no cell.
+
+		:return: a boolean mask of the rows in use
+		:rtype: numpy.ndarray
+		"""
+		rows = self._rows()
+		mask = rows['live'].copy()
+		for column, value in columns.items():
+			if column in ('owner', 'tna'):
+				value = NONE if value is None else self.node_index.get(value)
+			elif value is None:
+				value = NONE
+			elif not isinstance(value, (int, long)):
+				value = None
+			if value is None:
+				return numpy.zeros(self.size, dtype=bool)
+			mask &= rows[column] == value
+		return mask
+
+	def cells(self, mask=None):
+		"""
+		:return: the cells of the rows of a mask, all the cells if no mask is given
+		:rtype: list of TableCell
+		"""
+		rows = self._rows()
+		rows = rows[mask] if mask is not None else rows[rows['live']]
+		cells = []
+		for key, slot, channel, option, type, frame, owner, tna, live in rows.tolist():
+			cell = TableCell(self._node(owner), slot, channel, frame if frame != NONE else None, type, option, self._node(tna))
+			cell.key = key
+			cells.append(cell)
+		return cells
+
+	def locate(self, keys):
+		"""
+		:return: the rows of the cells with the given keys, None for those not in the table
+		:rtype: list
+		"""
+		positions = numpy.searchsorted(self._rows()['key'], keys).tolist() if keys else []
+		return [row if row < self.size and self.rows[row]['key'] == key and self.rows[row]['live'] else None for key, row in zip(keys, positions)]
+
+	def delete(self, mask):
+		"""
+		Delete the cells of the rows of a mask (or index array) at once.
+		"""
+		rows = self._rows()
+		deleted = numpy.zeros(self.size, dtype=bool)
+		deleted[mask] = True
+		deleted &= rows['live']
+		for slot, channel, owner, tna in rows[deleted][['slot', 'channel', 'owner', 'tna']].tolist():
+			self.occupancy.remove(slot, channel, self._node(owner), self._node(tna))
+		rows['live'][deleted] = False
+		self.dead += int(deleted.sum())
+		if self.dead * 2 > self.size:
+			live = rows[rows['live']]
+			self.rows = numpy.zeros(max(64, 2 * len(live)), dtype=CellTable.DTYPE)
+			self.rows[:len(live)] = live
+			self.size = len(live)
+			self.dead = 0
+
+
+class ColumnarSlotframe(Slotframe):
+	"""
+	A :class:`Slotframe` whose cells are kept in a :class:`CellTable` instead of Cell objects, for schedules of tens of
+	thousands of cells. Queries filter the columns in bulk and return :class:`TableCell` snapshots.
+
+	cell_container is a list of the cells built on every access: iterate it, do not change it. Cells are added with
+	add_link or append_link and removed with delete_cells or delete_links_of. Owners and targets are compared as
+	hashable nodes and the other attributes as integers.
+	"""
+	# Query keywords of get_cells_similar_to per column
+	COLUMNS = {'owner': 'owner', 'tna': 'tna', 'slot': 'slot', 'channel': 'channel', 'link_option': 'option',
+			'link_type': 'type', 'slotframe': 'frame'}
+
+	def __init__(self, name, slots):
+		if numpy is None:
+			raise ImportError('ColumnarSlotframe requires numpy')
+		self.table = CellTable()
+		super(ColumnarSlotframe, self).__init__(name, slots)
+
+	@property
+	def cell_container(self):
+		return self.table.cells()
+
+	@cell_container.setter
+	def cell_container(self, cells):
+		self.table = CellTable()
+		for cell in cells:
+			self.append_link(cell)
+
+	def _occupancy(self):
+		return self.table.occupancy
+
+	def get_link_by_coords(self, slot, channel, owner):
+		columns = {}
+		if slot:
+			columns['slot'] = slot
+		if channel:
+			columns['channel'] = channel
+		if owner:
+			columns['owner'] = owner
+		return self.table.cells(self.table.match(**columns))
+
+	def append_link(self, link):
+		link.key = self.table.append(link)
+
+	def get_cells_similar_to(self, **kwargs):
+		columns = dict((ColumnarSlotframe.COLUMNS[k], v) for k, v in kwargs.items() if k in ColumnarSlotframe.COLUMNS)
+		return self.table.cells(self.table.match(**columns))
+
+	def get_cells_of(self, node_id):
+		return self.table.cells(self.table.match(owner=node_id))
+
+	def delete_links_of(self, node_id):
+		mask = self.table.match(owner=node_id) | self.table.match(tna=node_id)
+		deleted_cell_container = self.table.cells(mask)
+		self.table.delete(mask)
+		return deleted_cell_container
+
+	def delete_cells(self, cells):
+		"""
+		:raises: ValueError if a cell is not in the slotframe, after removing the others
+		"""
+		rows = self.table.locate([getattr(cell, 'key', -1) for cell in cells])
+		found = sorted(set(row for row in rows if row is not None))
+		self.table.delete(numpy.array(found, dtype=int))
+		if len(found) < len(cells):
+			raise ValueError('Slotframe.delete_cells(x): x not in slotframe')
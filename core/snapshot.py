@@ -0,0 +1,266 @@
+"""
+Binary snapshots of the centralized schedule and topology: the slotframes with their cells and node-assigned ids, the
+DoDAG and the blacklisted cells of a :class:`core.schedule.Reflector`. A snapshot lets a restarted Reflector resume
+from what it knew instead of rediscovering every node and cell, see :func:`core.schedule.Reflector.load_snapshot`.
+
+All integers are big-endian. Every node is stored once and referred to by its index in the node table::
+
+	header		magic 'PLXS', version, time (double), number of nodes
+	nodes		IPv6 address (16 bytes) and port per node
+	dodag		index of the root, number of edges, (child, parent) indexes per edge
+	slotframes	number of slotframes, then per slotframe: name, slots, columnar flag, number of node-assigned ids,
+				number of cells, (node, id) per node-assigned id, (owner, slot, channel, id, type, option, target) per cell
+	blacklists	number of blacklists, then per blacklist: name of the slotframe, number of cells, (channel, slot) per cell
+	checksum	CRC-32 of all the above
+"""
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2014, The RICH Project"
+#__maintainer__ = "XYZ"
+#__license__ = "GPL"
+#__status__ = "Production"
+
+from core.node import NodeID
+from core.slotframe import Cell, NONE
+from ipaddress import IPv6Address
+import os
+import struct
+import tempfile
+import zlib
+
+MAGIC = 'PLXS'
+VERSION = 1
+
+# Node index of a missing node e.g. the target of a cell without one
+NO_NODE = 0xffff
+# Type or option of a cell without one
+NO_BYTE = 0xff
+
+_HEADER = struct.Struct('>4sBdI')
+_NODE = struct.Struct('>16sH')
+_DODAG = struct.Struct('>HI')
+_EDGE = struct.Struct('>HH')
+_COUNT = struct.Struct('>H')
+_FRAME = struct.Struct('>HBHI')
+_ALIAS = struct.Struct('>Hi')
+_CELL = struct.Struct('>HHHiBBH')
+_LENGTH = struct.Struct('>I')
+_BLACKLISTED = struct.Struct('>hh')
+_CHECKSUM = struct.Struct('>I')
+
+
+class Snapshot(object):
+	"""
+	The content of a snapshot: nodes are :class:`core.node.NodeID` and cells :class:`core.slotframe.Cell`.
+	"""
+
+	def __init__(self):
+		self.time = 0.0
+		self.root = None
+		self.edges = []			# (child, parent) pairs of the DoDAG
+		self.frames = []		# (name, slots, columnar, {node : id}, [Cell]) per slotframe
+		self.blacklisted = {}	# name of slotframe -> [[channel, slot]]
+
+	def nodes(self):
+		"""
+		:return: the nodes of the DoDAG, root included
+		:rtype: set
+		"""
+		nodes = set([self.root]) if self.root is not None else set()
+		for child, parent in self.edges:
+			nodes.add(child)
+			nodes.add(parent)
+		return nodes
+
+
+def _text(value):
+	text = value.encode('utf-8') if isinstance(value, unicode) else str(value)
+	return _COUNT.pack(len(text)) + text
+
+
+def _small(value):
+	return value if isinstance(value, (int, long)) and -2 ** 31 <= value < 2 ** 31 else NONE
+
+
+def _byte(value):
+	return NO_BYTE if value is None else value
+
+
+def _storable(cell):
+	return all(isinstance(value, (int, long)) and 0 <= value <= 0xffff for value in (cell.slot, cell.channel)) and \
+		all(value is None or isinstance(value, (int, long)) and 0 <= value < NO_BYTE for value in (cell.type, cell.option))
+
+
+def dumps(dodag, frames, blacklisted, time=0.0):
+	"""
+	Encode the topology and schedule of a Reflector.
+
+	:param dodag: the DoDAG tree
+	:type dodag: :class:`core.graph.DoDAG`
+	:param frames: the slotframes by name
+	:type frames: dict
+	:param blacklisted: the blacklisted [channel, slot] pairs by name of slotframe
+	:type blacklisted: dict
+	:param time: the time of the snapshot
+	:type time: float
+	:rtype: str
+	:raises: ValueError if there are more nodes than the node table can refer to, or if a blacklisted cell does not fit
+		its field
+
+	Cells whose slot or channel is not a 16-bit unsigned integer, or whose type or option is neither None nor below
+	NO_BYTE, are left out. A restored node then reports more cells
+	than the snapshot holds, so its cells are fetched again (see :func:`core.schedule.Reflector.load_snapshot`).
+	"""
+	index = {}
+	nodes = []
+
+	def node(node_id):
+		if node_id is None:
+			return NO_NODE
+		# Hashing a NodeID formats it, hashing its address does not
+		key = node_id.ip, node_id.port
+		i = index.get(key)
+		if i is None:
+			if len(nodes) == NO_NODE:
+				raise ValueError('Too many nodes for a snapshot')
+			i = index[key] = len(nodes)
+			nodes.append(node_id)
+		return i
+
+	parts = []
+	edges = []
+	for child in dodag.graph.nodes():
+		parent = dodag.get_parent(child)
+		if parent is not None:
+			edges.append(_EDGE.pack(node(child), node(parent)))
+	parts.append(_DODAG.pack(node(dodag.root), len(edges)))
+	parts.extend(edges)
+	parts.append(_COUNT.pack(len(frames)))
+	for name, frame in sorted(frames.items()):
+		cells = [c for c in frame.cell_container if _storable(c)]
+		parts.append(_text(name))
+		parts.append(_FRAME.pack(frame.slots, 1 if getattr(frame, 'table', None) is not None else 0, len(frame.fds), len(cells)))
+		for node_id, alias in frame.fds.items():
+			parts.append(_ALIAS.pack(node(node_id), _small(alias)))
+		for c in cells:
+			parts.append(_CELL.pack(node(c.owner), c.slot, c.channel, _small(c.slotframe), _byte(c.type),
+									_byte(c.option), node(c.tna)))
+	parts.append(_COUNT.pack(len(blacklisted)))
+	for name, cells in sorted(blacklisted.items()):
+		parts.append(_text(name))
+		parts.append(_LENGTH.pack(len(cells)))
+		try:
+			parts.extend(_BLACKLISTED.pack(channel, slot) for channel, slot in cells)
+		except struct.error as e:
+			raise ValueError('blacklisted cell of ' + str(name) + ': ' + str(e))
+	head = [_HEADER.pack(MAGIC, VERSION, time, len(nodes))]
+	head.extend(_NODE.pack(str(n.ip.packed), int(n.port)) for n in nodes)
+	data = ''.join(head + parts)
+	return data + _CHECKSUM.pack(zlib.crc32(data) & 0xffffffff)
+
+
+def loads(data):
+	"""
+	Decode a snapshot.
+
+	:rtype: Snapshot
+	:raises: ValueError if the data is not a snapshot of this version, is truncated or is corrupt
+	"""
+	if len(data) < _HEADER.size + _CHECKSUM.size:
+		raise ValueError('truncated snapshot')
+	if _CHECKSUM.unpack_from(data, len(data) - _CHECKSUM.size)[0] != zlib.crc32(data[:-_CHECKSUM.size]) & 0xffffffff:
+		raise ValueError('corrupt snapshot')
+	try:
+		return _decode(data)
+	except struct.error:
+		raise ValueError('truncated snapshot')
+
+
+def _decode(data):
+	magic, version, time, count = _HEADER.unpack_from(data, 0)
+	if magic != MAGIC or version != VERSION:
+		raise ValueError('not a version ' + str(VERSION) + ' snapshot')
+	snapshot = Snapshot()
+	snapshot.time = time
+	offset = _HEADER.size
+	nodes = []
+	for i in range(count):
+		address, port = _NODE.unpack_from(data, offset)
+		offset += _NODE.size
+		nodes.append(NodeID(str(IPv6Address(bytearray(address))), port))
+
+	def node(i):
+		if i == NO_NODE:
+			return None
+		if i >= len(nodes):
+			raise ValueError('node ' + str(i) + ' out of the node table')
+		return nodes[i]
+
+	def text():
+		length = _COUNT.unpack_from(data, offset)[0]
+		return data[offset + _COUNT.size:offset + _COUNT.size + length], offset + _COUNT.size + length
+
+	root, count = _DODAG.unpack_from(data, offset)
+	offset += _DODAG.size
+	snapshot.root = node(root)
+	for i in range(count):
+		child, parent = _EDGE.unpack_from(data, offset)
+		offset += _EDGE.size
+		snapshot.edges.append((node(child), node(parent)))
+	count = _COUNT.unpack_from(data, offset)[0]
+	offset += _COUNT.size
+	for i in range(count):
+		name, offset = text()
+		slots, columnar, aliases, cells = _FRAME.unpack_from(data, offset)
+		offset += _FRAME.size
+		fds = {}
+		for j in range(aliases):
+			i, alias = _ALIAS.unpack_from(data, offset)
+			offset += _ALIAS.size
+			fds[node(i)] = alias if alias != NONE else None
+		frame_cells = []
+		for j in range(cells):
+			owner, slot, channel, alias, lt, lo, tna = _CELL.unpack_from(data, offset)
+			offset += _CELL.size
+			frame_cells.append(Cell(node(owner), slot, channel, alias if alias != NONE else None, lt if lt != NO_BYTE else None,
+									lo if lo != NO_BYTE else None, node(tna)))
+		snapshot.frames.append((name, slots, bool(columnar), fds, frame_cells))
+	count = _COUNT.unpack_from(data, offset)[0]
+	offset += _COUNT.size
+	for i in range(count):
+		name, offset = text()
+		cells = _LENGTH.unpack_from(data, offset)[0]
+		offset += _LENGTH.size
+		snapshot.blacklisted[name] = [list(_BLACKLISTED.unpack_from(data, offset + j * _BLACKLISTED.size)) for j in range(cells)]
+		offset += cells * _BLACKLISTED.size
+	if offset != len(data) - _CHECKSUM.size:
+		raise ValueError('trailing bytes after snapshot')
+	return snapshot
+
+
+def save(path, data):
+	"""
+	Write data to path atomically: it is written to a temporary file of the same directory, flushed to disk and renamed
+	to path, so path holds either the previous or the new content, whenever the process stops.
+	"""
+	directory = os.path.dirname(os.path.abspath(path))
+	fd, temporary = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=directory)
+	try:
+		with os.fdopen(fd, 'wb') as stream:
+			stream.write(data)
+			stream.flush()
+			os.fsync(stream.fileno())
+		os.rename(temporary, path)
+	except:
+		os.remove(temporary)
+		raise
+
+
+def load(path):
+	"""
+	:rtype: Snapshot
+	:raises: IOError if path cannot be read, ValueError if it does not hold a valid snapshot
+	"""
+	with open(path, 'rb') as stream:
+		return loads(stream.read())
@@ -0,0 +1,205 @@
+__author__ = "George Exarchakos"
+__version__ = "0.0.1"
+__email__ = "g.exarchakos@tue.nl"
+__copyright__ = "Copyright 2014, The RICH Project"
+#__maintainer__ = "XYZ"
+#__license__ = "GPL"
+#__status__ = "Production"
+
+from core.node import NodeID
+from twisted.internet import reactor, task
+import bisect
+import logging
+
+logg = logging.getLogger('RiSCHER')
+
+# Upper bounds (sec) of the RTT histogram buckets, the last bucket is unbounded
+RTT_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30)
+
+
+class Histogram(object):
+	"""
+	Counts of samples per bucket, with the count, sum, minimum and maximum of all samples.
+	"""
+
+	def __init__(self, bounds=RTT_BUCKETS):
+		self.bounds = bounds
+		self.counts = [0] * (len(bounds) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.min = None
+		self.max = None
+
+	def add(self, value):
+		self.counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+
+	def mean(self):
+		return self.sum / self.count if self.count else None
+
+	def percentile(self, fraction):
+		"""
+		:param fraction: e.g. 0.95 for the 95th percentile
+		:return: the upper bound of the bucket of the percentile (the maximum for the last bucket), None without samples
+		"""
+		if not self.count:
+			return None
+		rank = fraction * self.count
+		seen = 0
+		for i, count in enumerate(self.counts):
+			seen += count
+			if seen >= rank and count:
+				return self.bounds[i] if i < len(self.bounds) else self.max
+		return self.max
+
+	def as_dict(self):
+		return {'count': self.count, 'mean': self.mean(), 'min': self.min, 'max': self.max,
+				'p50': self.percentile(0.5), 'p95': self.percentile(0.95),
+				'buckets': dict(zip([str(b) for b in self.bounds] + ['inf'], self.counts))}
+
+
+class LinkTelemetry(object):
+	"""
+	Counters, RTT histogram and in-flight gauge of the exchanges with one node, or with all of them together.
+	"""
+
+	def __init__(self):
+		self.requests = {}  # (method, resource) -> requests sent
+		self.responses = {}  # response code -> responses received
+		self.rtt = Histogram()
+		self.retransmissions = 0
+		self.timeouts = 0
+		self.bytes_out = 0
+		self.bytes_in = 0
+		self.inflight = 0
+
+	def as_dict(self):
+		sent = sum(self.requests.values())
+		return {'requests': sent,
+				'by_resource': dict((method + ' ' + resource, count) for (method, resource), count in self.requests.items()),
+				'responses': dict(self.responses),
+				'rtt': self.rtt.as_dict(),
+				'retransmissions': self.retransmissions,
+				'retransmission_ratio': float(self.retransmissions) / sent if sent else 0.0,
+				'timeouts': self.timeouts,
+				'bytes_out': self.bytes_out,
+				'bytes_in': self.bytes_in,
+				'inflight': self.inflight}
+
+
+def _node(remote):
+	# NodeID prepends its IPv6 prefix to any address, so IPv4 remotes are left as they are
+	ip, port = remote
+	return NodeID(ip, port) if ip.version == 6 else remote
+
+
+class Telemetry(object):
+	"""
+	Transport telemetry of a :class:`core.client.Communicator`, per node and overall. Nodes are keyed by (ip, port) like
+	the RTT estimators and reported as :class:`core.node.NodeID`, or as the raw (ip, port) pair if they are IPv4.
+
+	The communicator and its endpoints feed it; :func:`snapshot` and :func:`rank` query it, e.g. the 5 nodes with the
+	most retransmissions per request::
+
+		communicator.telemetry.rank('retransmission_ratio', 5)
+	"""
+
+	def __init__(self, clock=None):
+		self.clock = clock if clock else reactor
+		self.links = {}
+		self.total = LinkTelemetry()
+		self.loop = None
+
+	def link(self, remote):
+		if remote not in self.links:
+			self.links[remote] = LinkTelemetry()
+		return self.links[remote]
+
+	def requested(self, remote, method, resource):
+		key = (method, resource)
+		for t in (self.link(remote), self.total):
+			t.requests[key] = t.requests.get(key, 0) + 1
+			t.inflight += 1
+
+	def answered(self, remote, code):
+		for t in (self.link(remote), self.total):
+			t.responses[code] = t.responses.get(code, 0) + 1
+
+	def settled(self, remote):
+		for t in (self.link(remote), self.total):
+			t.inflight -= 1
+
+	def sampled(self, remote, rtt):
+		self.link(remote).rtt.add(rtt)
+		self.total.rtt.add(rtt)
+
+	def retransmitted(self, remote):
+		self.link(remote).retransmissions += 1
+		self.total.retransmissions += 1
+
+	def timed_out(self, remote):
+		self.link(remote).timeouts += 1
+		self.total.timeouts += 1
+
+	def sent(self, remote, size):
+		self.link(remote).bytes_out += size
+		self.total.bytes_out += size
+
+	def received(self, remote, size):
+		self.link(remote).bytes_in += size
+		self.total.bytes_in += size
+
+	def snapshot(self, to_node=None):
+		"""
+		Telemetry of one node, or of the network as a whole plus every node.
+
+		:param to_node: the node to inspect, or None for all
+		:type to_node: NodeID
+		:return: a dictionary of counters, or {'total': counters, 'nodes': {NodeID: counters}}
+		:rtype: dict
+		"""
+		if to_node is not None:
+			link = self.links.get((to_node.ip, to_node.port))
+			return link.as_dict() if link else LinkTelemetry().as_dict()
+		return {'time': self.clock.seconds(), 'total': self.total.as_dict(),
+				'nodes': dict((_node(remote), link.as_dict()) for remote, link in self.links.items())}
+
+	def rank(self, metric, top=10):
+		"""
+		The nodes with the highest value of a metric e.g. 'timeouts', 'retransmission_ratio' or 'inflight'.
+
+		:return: up to top (NodeID, value) pairs, the highest first
+		:rtype: list
+		"""
+		values = [(_node(remote), link.as_dict()[metric]) for remote, link in self.links.items()]
+		values.sort(key=lambda pair: pair[1], reverse=True)
+		return values[:top]
+
+	def start(self, interval, report=None):
+		"""
+		Take a snapshot every interval seconds and pass it to report, or log a summary if no report is given.
+		"""
+		self.stop()
+		self.loop = task.LoopingCall(self._report, report)
+		self.loop.clock = self.clock
+		self.loop.start(interval, now=False)
+
+	def stop(self):
+		if self.loop is not None and self.loop.running:
+			self.loop.stop()
+		self.loop = None
+
+	def _report(self, report):
+		if report is not None:
+			report(self.snapshot())
+			return
+		total = self.total.as_dict()
+		logg.info('Telemetry: ' + str(total['requests']) + ' requests, ' + str(total['inflight']) + ' in flight, ' +
+				str(total['retransmissions']) + ' retransmissions, ' + str(total['timeouts']) + ' timeouts, RTT p50=' +
+				str(total['rtt']['p50']) + ' p95=' + str(total['rtt']['p95']) + ', ' + str(total['bytes_out']) +
+				'B out, ' + str(total['bytes_in']) + 'B in, worst links ' + str(self.rank('retransmission_ratio', 3)))
@@ -0,0 +1,133 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the asyncio communicator over UDP on the loopback interface, run from the root of the repository:
+#python -m example.Asyncio_Test (needs asyncio, or trollius on Python 2)
+
+from core.client import AsyncioCommunicator, RttEstimator, asyncio
+from core.node import NodeID
+from util.emulator import VirtualNode
+from util import codec
+from ipaddress import ip_address
+from twisted.internet import defer
+from txthings import coap
+import json
+import socket
+import sys
+
+if asyncio is None:
+	print('Asyncio skipped: neither asyncio nor trollius is installed')
+	sys.exit(0)
+
+class NodeServer(object):
+	"""A virtual node answering CoAP over UDP, with piggybacked responses and observe notifications"""
+
+	def __init__(self, node):
+		self.node = node
+		self.transport = None
+		self.observers = {}
+		self.notifications = 1
+		self.drop = set()
+		self.requests = 0
+		node.listeners.append(self.changed)
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def connection_lost(self, exc):
+		pass
+
+	def error_received(self, exc):
+		pass
+
+	def datagram_received(self, data, addr):
+		request = coap.Message.decode(data, addr)
+		if request.mtype != coap.CON or not coap.isRequest(request.code):
+			return
+		self.requests += 1
+		if tuple(request.opt.uri_path) in self.drop:
+			# lost once, answered when retransmitted
+			self.drop.discard(tuple(request.opt.uri_path))
+			return
+		response = self.node.serve(request)
+		response.mtype = coap.ACK
+		response.mid = request.mid
+		response.token = request.token
+		if request.opt.observe == 0:
+			self.observers[tuple(request.opt.uri_path)] = (request, addr)
+			response.opt.observe = self.notifications
+		self.transport.sendto(response.encode(), addr)
+
+	def changed(self, path):
+		for observed, (request, addr) in self.observers.items():
+			if observed[:len(path)] == path:
+				self.notifications += 1
+				notification = self.node.serve(request)
+				notification.mtype = coap.NON
+				notification.mid = self.notifications
+				notification.token = request.token
+				notification.opt.observe = self.notifications
+				self.transport.sendto(notification.encode(), addr)
+
+loop = asyncio.get_event_loop()
+
+def wait(predicate, limit=5.0):
+	deadline = loop.time() + limit
+	def check():
+		if predicate() or loop.time() > deadline:
+			loop.stop()
+		else:
+			loop.call_later(0.01, check)
+	loop.call_soon(check)
+	loop.run_forever()
+	assert predicate()
+
+server = NodeServer(VirtualNode('212:7400:0:1'))
+transport, protocol = loop.run_until_complete(loop.create_datagram_endpoint(lambda: server, local_addr=('::1', 0), family=socket.AF_INET6))
+node = NodeID(ip_address(u'::1'), transport.get_extra_info('sockname')[1])
+
+c = AsyncioCommunicator(50, 5, loop=loop)
+c.estimators[(node.ip, node.port)] = RttEstimator(0.1)
+
+#a GET is answered through its callback, its token resolving to its ticket
+replies = []
+c.GET(node, '6top/slotFrame', 1, replies.append)
+wait(lambda: replies)
+assert replies[0].code == coap.CONTENT and c.ticket(replies[0].token) == 1
+assert json.loads(replies[0].payload) == [{'frame': 0, 'slots': 101}]
+
+#an observation passes the first reply and every notification to its callback
+notified = []
+c.OBSERVE(node, '6top/slotFrame', 2, notified.append)
+wait(lambda: notified)
+posted = []
+c.POST(node, '6top/slotFrame', {'frame': 1, 'slots': 25}, 3, posted.append)
+wait(lambda: posted and len(notified) == 2)
+assert json.loads(posted[0].payload) == [1]
+assert [c.ticket(n.token) for n in notified] == [2, 2]
+assert len(codec.decode(notified[1])) == 2
+
+#a lost request is retransmitted with the RTT estimate of the node
+server.drop.add(('6top', 'nbrList'))
+replies = []
+c.GET(node, '6top/nbrList', 4, replies.append)
+wait(lambda: replies)
+assert c.telemetry.snapshot(node)['retransmissions'] == 1
+
+#a deadline runs on the loop and fails the request with TimeoutError
+silent = NodeID(ip_address(u'::1'), 9)
+failures = []
+c.GET(silent, '6top/slotFrame', 5, None, errback=lambda f, ticket: failures.append((f.type, ticket)), timeout=0.2)
+wait(lambda: failures)
+assert failures == [(defer.TimeoutError, 5)] and c.telemetry.snapshot(silent)['timeouts'] == 1
+
+#started from the running loop e.g. by an asyncio application, the communicator does not run the loop itself
+started = []
+loop.call_soon(lambda: started.append(c.start()))
+wait(lambda: started)
+
+c.stop()
+transport.close()
+print('Asyncio ok')
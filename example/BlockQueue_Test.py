@@ -0,0 +1,109 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the blocks of commands of a session, run from the root of the repository: python -m example.BlockQueue_Test
+
+from core.interface import BlockQueue, Command
+import copy
+import time
+
+def commands(n, node='n'):
+	return [Command('get', node, '6top/cellList?id=' + str(i)) for i in range(n)]
+
+#commands of a block are popped together, the next block only once all of them are released
+a, b, c, d = commands(4)
+q = BlockQueue()
+q.push(a)
+q.push(b)
+assert q.push(b) is False
+q.block()
+q.push(c)
+q.block()
+q.push(d)
+q.block()
+assert len(q) == 4 and [i.id for i in q] == [a.id, b.id, c.id, d.id]
+assert q.pop() is a and q.pop() is b and q.pop() is None
+assert q.release(c) is False
+assert q.release(a) is True and q.pop() is None
+#sessions release copies of the commands they sent
+assert q.release(copy.copy(b)) is True
+assert q.pop() is c and q.pop() is None
+q.release(c)
+assert not q.finished() and q.pop() is d
+assert len(q) == 0 and q.finished()
+
+#indexing and assignment count from the next command to pop
+q = BlockQueue()
+cs = commands(5)
+q.push(cs)
+q.block()
+q.pop()
+assert q[0] is cs[1] and q[-1] is cs[4]
+q[0] = cs[0]
+assert q[0] is cs[0]
+for index in (4, -5):
+	try:
+		q[index]
+		assert False
+	except IndexError:
+		pass
+
+#unblock reopens the last block
+a, b, c = commands(3)
+q = BlockQueue()
+q.push(a)
+q.block()
+assert q.ready() and q.unblock() and not q.ready()
+q.push(b)
+q.block()
+q.push(c)
+assert q.pop() is a and q.pop() is b and q.pop() is None
+
+#a queue pushed into another keeps its blocks
+first, second = commands(2)
+inner = BlockQueue()
+inner.push(first)
+inner.block()
+inner.push(second)
+inner.block()
+x = commands(1)[0]
+q = BlockQueue()
+q.push(x)
+q.block()
+q.push(inner)
+assert len(q) == 3
+assert q.pop() is x and q.pop() is None
+q.release(x)
+assert q.pop() is first and q.pop() is None
+q.release(first)
+assert q.pop() is second and q.finished()
+
+#a queue whose first block is popped but not released cannot be pushed
+q = BlockQueue()
+q.push(commands(2))
+q.block()
+q.pop()
+q.pop()
+try:
+	BlockQueue().push(q)
+	assert False
+except Exception as e:
+	assert str(e) == 'Impossible to append'
+
+#long queues keep the popped commands from piling up and iterate in linear time
+q = BlockQueue()
+cs = commands(3000)
+for i in cs:
+	q.push(i)
+	q.block()
+start = time.time()
+assert [i.id for i in q] == [i.id for i in cs]
+assert time.time() - start < 1
+for i in cs:
+	assert q.pop() is i
+	q.release(i)
+assert q.finished() and len(q.commands) < 32 and len(q.barriers) == 1
+
+print('BlockQueue ok')
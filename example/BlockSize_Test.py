@@ -0,0 +1,59 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the block size negotiated with every node, run from the root of the repository: python -m example.BlockSize_Test
+
+from core.client import Communicator, CoapEndpoint, MemoryCommunicator
+from core.node import NodeID
+from util.emulator import Fleet
+from twisted.internet import task
+from twisted.test import proto_helpers
+from txthings import coap
+import json
+
+#the first block of a request goes in the size of its Block1 option, the module-wide size is left as it is
+endpoint = CoapEndpoint(None, Communicator(task.Clock()))
+endpoint.transport = proto_helpers.FakeDatagramTransport()
+default = coap.DEFAULT_BLOCK_SIZE_EXP
+for size_exp in (1, default):
+	req = coap.Message(mtype=coap.CON, code=coap.POST, payload='x' * 2000)
+	req.opt.uri_path = ('6top', 'cellList')
+	req.opt.block1 = (0, True, size_exp)
+	req.remote = ('::1', 5684)
+	endpoint.request(req)
+	sent = coap.Message.decode(endpoint.transport.written[-1][0])
+	assert len(sent.payload) == 2 ** (size_exp + 4) and sent.opt.block1.size_exponent == size_exp
+	assert coap.DEFAULT_BLOCK_SIZE_EXP == default
+try:
+	endpoint.request(coap.Message(mtype=coap.CON, code=coap.CONTENT, payload='x' * 2000))
+	assert False
+except ValueError:
+	assert coap.DEFAULT_BLOCK_SIZE_EXP == default
+
+#a node refusing the blocks with 4.13 gets the request again in blocks of its Size1, the reply reaching its ticket
+fleet = Fleet(3, seed=1, clock=task.Clock())
+fleet.start(listen=False)
+node = fleet.nodes[1]
+serve = node.serve
+attempts = []
+def refusing(request):
+	attempts.append(request.opt.block1)
+	if request.opt.block1 is not None and request.opt.block1.size_exponent > 2:
+		response = coap.Message(code=coap.REQUEST_ENTITY_TOO_LARGE)
+		response.opt.addOption(coap.UintOption(60, 64))
+		return response
+	return serve(request)
+node.serve = refusing
+communicator = MemoryCommunicator(fleet, 20, 5)
+to_node = NodeID(fleet.address(node), 5684)
+cells = [{'frame': 0, 'slot': i, 'channel': 1, 'option': 1, 'type': 0, 'tna': ''} for i in range(3, 43)]
+replies = []
+communicator.POST(to_node, '6top/cellList', cells, 5, replies.append)
+fleet.clock.pump([0.05] * 40)
+assert [block1.size_exponent for block1 in attempts] == [default, 2] and communicator.block_size(to_node) == 2
+assert len(replies) == 1 and replies[0].code == coap.CONTENT and communicator.ticket(replies[0].token) == 5
+assert json.loads(replies[0].payload) == range(1, 41)
+
+print('BlockSize ok')
@@ -0,0 +1,79 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the bounded cache of commands waiting for replies, run from the root of the repository: python -m example.Cache_Test
+
+import os
+if not os.path.isdir('logs'):
+	os.mkdir('logs')
+
+from core.client import MemoryCommunicator
+from core.interface import BlockQueue, Command
+from core.node import NodeID
+from core.schedule import CommandCache, Pending, SchedulerInterface
+from util.emulator import Fleet
+from util.exception import Expired
+from twisted.internet import task
+
+N1 = NodeID('aaaa::212:7400:0:2')
+
+def pending(op, uri='6top/slotFrame'):
+	return Pending(Command(op, N1, uri), 1)
+
+#requests beyond size are stale, the least recently sent first, observations do not count
+clock = task.Clock()
+cache = CommandCache(clock, size=2)
+entries = [pending('get'), pending('observe', 'rpl/dag'), pending('post'), pending('get', '6top/cellList')]
+for entry in entries:
+	cache[entry.command.id] = entry
+assert len(cache) == 4 and cache.stale() == [entries[0].command.id]
+del cache[entries[0].command.id]
+assert cache.stale() == [] and cache.bounded()
+
+#requests older than ttl and observations not notified for observe_ttl are stale, touching renews an entry
+clock = task.Clock()
+cache = CommandCache(clock, ttl=10, observe_ttl=30)
+request, observation = pending('get'), pending('observe', 'rpl/dag')
+cache[observation.command.id] = observation
+clock.advance(5)
+cache[request.command.id] = request
+clock.advance(5)
+assert cache.stale() == []
+clock.advance(5)
+assert cache.stale() == [request.command.id]
+clock.advance(20)
+cache.touch(observation.command.id)
+assert cache.stale() == [request.command.id] and list(cache.entries)[-1] == observation.command.id
+clock.advance(30)
+assert cache.stale() == [request.command.id, observation.command.id]
+assert not CommandCache(clock).bounded() and CommandCache(clock).stale() == []
+
+#the report counts the entries per command and per age
+report = cache.report()
+assert report['entries'] == 2 and report['oldest'] == 60 and report['by_command'] == {'get 6top/slotFrame': 1, 'observe rpl/dag': 1}
+assert sum(report['by_age'].values()) == 2
+
+#a scheduler evicts a request nobody answers, releases its session and reports it as failed
+fleet = Fleet(3, seed=1, clock=task.Clock())
+fleet.start(listen=False)
+s = SchedulerInterface('CacheTest', fleet.root.eui64, 5684, 'aaaa', client=MemoryCommunicator(fleet, 20, 5), cache_ttl=5)
+failures = []
+s.failed = lambda command, reason: failures.append((command.id, type(reason)))
+s.start()
+fleet.clock.pump([0.1] * 20)
+fleet.nodes[1].online = False
+lost = Command('get', NodeID(fleet.address(fleet.nodes[1]), 5684), '6top/slotFrame')
+q = BlockQueue()
+q.push(lost)
+q.block()
+s.communicate(q)
+sid = s.count_sessions
+fleet.clock.advance(0.1)
+assert lost.id in s.cache and s.leaks()['sessions'] >= 1
+fleet.clock.pump([0.1] * 80)
+assert failures == [(lost.id, Expired)] and lost.id not in s.cache and sid not in s.sessions
+assert lost.id not in s.client.exchanges and s.leaks()['stalled'] == []
+
+print('Cache ok')
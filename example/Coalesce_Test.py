@@ -0,0 +1,58 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the coalescing of identical GETs by the communicator, run from the root of the repository:
+#python -m example.Coalesce_Test
+
+from core.client import MemoryCommunicator
+from core.node import NodeID
+from util.emulator import Fleet
+from twisted.internet import defer, task
+
+fleet = Fleet(3, seed=1, clock=task.Clock())
+fleet.start(listen=False)
+clock = fleet.clock
+node = NodeID(fleet.root.eui64)
+communicator = MemoryCommunicator(fleet, 20, 5)
+
+def get(ticket, timeout=None):
+	communicator.GET(node, '6top/slotFrame', ticket, lambda reply: replies.append((ticket, communicator.ticket(reply.token))),
+					errback=lambda reason, ticket: failures.append((ticket, reason.type)), timeout=timeout)
+
+#identical GETs are sent once and every one of them gets the reply under a token of its own
+replies = []
+failures = []
+for ticket in (1, 2, 3):
+	get(ticket)
+clock.pump([0.05] * 40)
+assert sorted(replies) == [(1, 1), (2, 2), (3, 3)] and communicator.telemetry.snapshot(node)['requests'] == 1
+
+#a waiting GET fails on its own timeout, the others still get the reply
+replies = []
+failures = []
+fleet.root.online = False
+get(4, timeout=30)
+get(5, timeout=1)
+get(6)
+clock.pump([0.1] * 15)
+assert failures == [(5, defer.TimeoutError)] and not replies
+fleet.root.online = True
+clock.pump([1.0] * 30)
+assert sorted(replies) == [(4, 4), (6, 6)] and failures == [(5, defer.TimeoutError)]
+assert not communicator.deadlines
+
+#a waiting GET sent in place of a cancelled one keeps the time left to its timeout
+replies = []
+failures = []
+fleet.root.online = False
+get(7)
+get(8, timeout=2)
+clock.pump([0.1] * 10)
+assert communicator.cancel(7)
+clock.pump([0.1] * 15)
+assert failures == [(7, defer.CancelledError), (8, defer.TimeoutError)] and not replies
+assert not communicator.deadlines and not communicator.inflight
+
+print('Coalesce ok')
@@ -0,0 +1,95 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the payload codecs, run from the root of the repository: python -m example.Codec_Test
+
+from util import codec, parser
+from core.client import MemoryCommunicator
+from core.node import NodeID
+from util.emulator import Fleet
+from twisted.internet import task
+from txthings import coap
+import binascii
+
+#examples of RFC 7049 appendix A
+for value, encoded in [(0, '00'), (23, '17'), (24, '1818'), (1000, '1903e8'), (1000000, '1a000f4240'),
+					   (1000000000000, '1b000000e8d4a51000'), (-1, '20'), (-1000, '3903e7'), (False, 'f4'), (True, 'f5'),
+					   (None, 'f6'), (1.5, 'fa3fc00000'), (1.1, 'fb3ff199999999999a'), (u'', '60'), (u'IETF', '6449455446'),
+					   (u'\u00fc', '62c3bc'), ([], '80'), ([1, [2, 3], [4, 5]], '8301820203820405'), ({}, 'a0'),
+					   ({u'a': 1}, 'a1616101'), (bytearray('\x01\x02\x03\x04'), '4401020304')]:
+	assert binascii.hexlify(codec.cbor_dumps(value)) == encoded, value
+	assert codec.cbor_loads(binascii.unhexlify(encoded)) == value, encoded
+#half precision floats and tags are decoded too
+assert codec.cbor_loads(binascii.unhexlify('f93c00')) == 1.0
+assert codec.cbor_loads(binascii.unhexlify('f9c400')) == -4.0
+assert codec.cbor_loads(binascii.unhexlify('c11a514b67b0')) == 1363896240
+
+#malformed payloads raise ValueError, like json.loads
+for encoded in ['', '19', '6449', '8301', '0000', '1f', '9f']:
+	try:
+		codec.cbor_loads(binascii.unhexlify(encoded))
+		assert False, encoded
+	except ValueError:
+		pass
+
+#cells of a slotframe are smaller than in JSON and read back the same
+cells = [{'so': i, 'co': i % 16, 'fd': 1, 'lo': 1, 'lt': 0, 'tna': 'aaaa::212:7400:0:' + str(i + 2), 'cd': i} for i in range(8)]
+json_payload = codec.codec_of(codec.JSON).encode(cells)
+cbor_payload = codec.codec_of(codec.CBOR).encode(cells)
+assert len(cbor_payload) < len(json_payload)
+assert codec.codec_of(codec.CBOR).decode(cbor_payload) == codec.codec_of(codec.JSON).decode(json_payload)
+assert codec.codec_of(None) is codec.codec_of(codec.JSON) and codec.codec_of(99) is codec.codec_of(codec.JSON)
+
+#replies are decoded according to their Content-Format option
+response = coap.Message(code=coap.CONTENT, payload=cbor_payload)
+response.opt.content_format = codec.CBOR
+assert codec.decode(response) == codec.cbor_loads(cbor_payload)
+assert parser.clean_payload(codec.text(response)) == codec.text(response)
+response = coap.Message(code=coap.CONTENT, payload=json_payload)
+assert codec.decode(response) == codec.decode(coap.Message(code=coap.CONTENT, payload=json_payload))
+
+#the communicator speaks CBOR to the nodes that understand it and falls back to JSON with the others
+def get(fleet, content_format):
+	clock = fleet.clock
+	communicator = MemoryCommunicator(fleet, 20, 5)
+	communicator.content_format = content_format
+	root = NodeID(fleet.root.eui64)
+	replies = []
+	communicator.GET(root, '6top/slotFrame', 1, replies.append)
+	clock.pump([0.05] * 40)
+	assert len(replies) == 1 and replies[0].code == coap.CONTENT
+	return communicator.payload_format(root), replies[0].opt.content_format, codec.decode(replies[0])
+
+fleet = Fleet(3, seed=1, clock=task.Clock())
+fleet.start(listen=False)
+plain = get(fleet, codec.JSON)
+fleet.root.formats.add(codec.CBOR)
+compact = get(fleet, codec.CBOR)
+fleet.root.formats.discard(codec.CBOR)
+fallback = get(fleet, codec.CBOR)
+assert plain[0] == codec.JSON and compact[:2] == (codec.CBOR, codec.CBOR) and fallback[0] == codec.JSON
+assert plain[2] == compact[2] == fallback[2]
+
+#an observation sent again in JSON keeps its ticket, its notifications arrive and it is cancelled at the node
+fleet = Fleet(10, seed=1, clock=task.Clock())
+fleet.start(listen=False)
+communicator = MemoryCommunicator(fleet, 20, 5)
+communicator.content_format = codec.CBOR
+observed = fleet.nodes[5]
+node = NodeID(fleet.address(observed), 5684)
+notified = []
+communicator.OBSERVE(node, 'rpl/dag', 7, notified.append)
+fleet.clock.pump([0.05] * 40)
+fleet.rewire(observed, fleet.root)
+fleet.clock.pump([0.05] * 40)
+assert [communicator.ticket(n.token) for n in notified] == [7, 7]
+communicator.CANCEL_OBSERVE(node, 'rpl/dag', 7, None)
+fleet.clock.pump([0.05] * 40)
+fleet.rewire(observed, fleet.nodes[1])
+fleet.clock.pump([0.05] * 40)
+assert len(notified) == 2 and len(communicator.observers) == 0
+assert not communicator.protocols[node.ip.version].observations
+
+print('Codec ok')
@@ -0,0 +1,95 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the slotframes kept in numpy columns, run from the root of the repository:
+#python -m example.Columnar_Test (needs numpy)
+
+from core.node import NodeID
+from core.slotframe import Slotframe, ColumnarSlotframe, CellTable, Cell, NONE, numpy
+import random
+import sys
+
+if numpy is None:
+	print('Columnar skipped: numpy is not installed')
+	sys.exit(0)
+
+def cells_of(cells):
+	return sorted((str(c.owner), c.slot, c.channel, c.slotframe, c.type, c.option, str(c.tna)) for c in cells)
+
+root = NodeID('aaaa::212:7400:0:1')
+N1 = NodeID('aaaa::212:7400:0:2')
+N2 = NodeID('aaaa::212:7400:0:3')
+N3 = NodeID('aaaa::212:7400:0:4')
+
+#cells come back as they were added, in order, with None kept apart from the integers
+table = CellTable(capacity=2)
+added = [Cell(root, 0, 0, 0, 1, 7, None), Cell(N1, 3, 2, 1, 0, 1, root), Cell(N2, 4, 5, None, 0, 2, N1)]
+keys = [table.append(c) for c in added]
+assert len(table) == 3 and keys == sorted(keys)
+assert cells_of(table.cells()) == cells_of(added) and [c.key for c in table.cells()] == keys
+assert [c.tna for c in table.cells()] == [None, root, N1] and table.cells()[2].slotframe is None
+assert table.match(frame=None).tolist() == [False, False, True]
+assert table.match(owner=N3).tolist() == [False] * 3 and table.match(slot='3').tolist() == [False] * 3
+assert table.match(slot=3, owner=N1).tolist() == [False, True, False]
+assert NONE not in table.node_index.values() and table.nodes == [root, N1, N2]
+
+#cells read twice from a row are equal, changing one leaves the table as it was
+first, second = table.cells()[1], table.cells()[1]
+assert first == second and not first != second and hash(first) == hash(second) and first != table.cells()[0]
+first.slot = 9
+assert table.cells()[1].slot == 3 and first == table.cells()[1]
+
+#deleted rows are skipped, then compacted away once more than half are deleted, keys still locate the rows left
+table.delete(table.match(owner=root))
+assert len(table) == 2 and table.locate(keys) == [None, 1, 2] and table.size == 3
+table.delete(table.match(owner=N1))
+assert len(table) == 1 and table.size == 1 and table.dead == 0 and table.locate(keys) == [None, None, 0]
+assert not table.occupancy.busy(3, N1) and table.occupancy.busy(4, N2)
+
+#a columnar slotframe answers the queries of a slotframe the same, as cells come and go
+nodes = [root, N1, N2, N3]
+r = random.Random(3)
+plain = Slotframe('plain', 101)
+columnar = ColumnarSlotframe('columnar', 101)
+for step in range(600):
+	if r.random() < 0.7 or not len(plain.cell_container):
+		cell = Cell(r.choice(nodes), r.randrange(101), r.randrange(16), r.choice([0, 1]), r.choice([0, 1]), r.choice([1, 2, 7]), r.choice(nodes + [None]))
+		plain.append_link(cell)
+		columnar.append_link(Cell(cell.owner, cell.slot, cell.channel, cell.slotframe, cell.type, cell.option, cell.tna))
+	else:
+		victim = r.choice(list(plain.cell_container))
+		plain.delete_cells([victim])
+		twins = columnar.get_cells_similar_to(owner=victim.owner, slot=victim.slot, channel=victim.channel, slotframe=victim.slotframe,
+											link_type=victim.type, link_option=victim.option, tna=victim.tna)
+		columnar.delete_cells(twins[:1])
+	if step % 50 == 0:
+		assert cells_of(plain.cell_container) == cells_of(columnar.cell_container)
+		for node in nodes:
+			assert cells_of(plain.get_cells_of(node)) == cells_of(columnar.get_cells_of(node))
+			assert cells_of(plain.get_cells_similar_to(tna=node, link_option=1)) == cells_of(columnar.get_cells_similar_to(tna=node, link_option=1))
+		for slot in range(0, 101, 7):
+			assert cells_of(plain.get_link_by_coords(slot, None, N1)) == cells_of(columnar.get_link_by_coords(slot, None, N1))
+			assert plain.free_channels(slot) == columnar.free_channels(slot)
+		assert plain.free_cells(root, N1) == columnar.free_cells(root, N1)
+assert cells_of(plain.delete_links_of(N2)) == cells_of(columnar.delete_links_of(N2))
+assert cells_of(plain.cell_container) == cells_of(columnar.cell_container) and not columnar.get_cells_similar_to(tna=N2)
+
+#cells not in the slotframe are refused with ValueError, after the others are deleted
+kept = columnar.get_cells_of(N1)
+gone = columnar.get_cells_of(N3)
+columnar.delete_cells(gone[:1])
+try:
+	columnar.delete_cells(gone[:2] + [Cell(N1, 5, 5, 1, 0, 1, None)])
+	assert False
+except ValueError:
+	pass
+assert cells_of(columnar.get_cells_of(N3)) == cells_of(gone[2:]) and cells_of(columnar.get_cells_of(N1)) == cells_of(kept)
+
+#setting the cells replaces the table and its occupancy
+columnar.cell_container = [Cell(root, 1, 1, 0, 1, 7, None)]
+assert len(columnar.cell_container) == 1 and columnar.busy(1, root) and not columnar.busy(1, N1)
+assert columnar.free_channels(1) == [c for c in range(16) if c != 1]
+
+print('Columnar ok')
@@ -0,0 +1,94 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the commands of a session with dependencies, run from the root of the repository: python -m example.CommandGraph_Test
+
+from core.interface import BlockQueue, CommandGraph, Command
+import copy
+
+def chain(node, n):
+	return [Command('post', node, '6top/cellList', {'so': i, 'co': 1}) for i in range(n)]
+
+def popall(g):
+	popped = []
+	while True:
+		c = g.pop()
+		if c is None:
+			return popped
+		popped.append(c)
+
+#independent chains progress concurrently, a command waits only on the commands it was pushed after
+g = CommandGraph()
+n1 = chain('n1', 3)
+n2 = chain('n2', 3)
+for cs in (n1, n2):
+	previous = None
+	for c in cs:
+		g.push(c, after=previous)
+		previous = c
+assert len(g) == 6 and [c.id for c in g] == [c.id for c in n1 + n2]
+assert popall(g) == [n1[0], n2[0]]
+g.release(n2[0])
+assert popall(g) == [n2[1]]
+#sessions release copies of the commands they sent
+g.release(copy.copy(n2[1]))
+assert popall(g) == [n2[2]]
+assert g.release(n2[2]) and not g.release(n2[2])
+assert not g.finished() and popall(g) == []
+g.release(n1[0])
+assert popall(g) == [n1[1]]
+g.release(n1[1])
+assert popall(g) == [n1[2]] and g.finished()
+
+#a command after several others waits on all of them, commands pushed after released ones are ready at once
+g = CommandGraph()
+a, b, c, d = chain('n', 4)
+g.push([a, b])
+g.push(c, after=[a, b])
+assert popall(g) == [a, b]
+g.release(a)
+assert popall(g) == []
+g.release(b)
+assert popall(g) == [c]
+g.push(d, after=a)
+assert popall(g) == [d]
+
+#a command is pushed once and dependencies must be in the graph
+g = CommandGraph()
+a, b = chain('n', 2)
+g.push(a)
+assert g.push(a) == [] and len(g) == 1
+try:
+	g.push(b, after=Command('get', 'n', '6top/slotFrame'))
+	assert False
+except ValueError:
+	pass
+
+#a BlockQueue builds part of a graph, each block after the previous one
+frame = Command('post', 'n', '6top/slotFrame', {'ns': 101})
+cells = chain('n', 2)
+check = Command('get', 'n', '6top/cellList')
+q = BlockQueue()
+q.push(cells)
+q.block()
+q.push(check)
+q.block()
+g = CommandGraph()
+g.push(frame)
+ends = g.push(q, after=frame)
+assert ends == [check]
+other = chain('m', 1)[0]
+g.push(other, after=ends)
+assert popall(g) == [frame]
+g.release(frame)
+assert popall(g) == cells
+g.release(cells[0])
+assert popall(g) == []
+g.release(cells[1])
+assert popall(g) == [check]
+g.release(check)
+assert popall(g) == [other] and g.finished()
+
+print('CommandGraph ok')
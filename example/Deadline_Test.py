@@ -0,0 +1,82 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the deadlines and cancellation of commands and sessions, run from the root of the repository:
+#python -m example.Deadline_Test
+
+import os
+if not os.path.isdir('logs'):
+	os.mkdir('logs')
+
+from core.client import MemoryCommunicator
+from core.interface import BlockQueue, Command
+from core.node import NodeID
+from core.schedule import SchedulerInterface
+from util.emulator import Fleet
+from util.exception import Expired
+from twisted.internet import defer, task
+
+def scheduler(**kwargs):
+	fleet = Fleet(3, seed=1, clock=task.Clock())
+	fleet.start(listen=False)
+	s = SchedulerInterface('DeadlineTest', fleet.root.eui64, 5684, 'aaaa', client=MemoryCommunicator(fleet, 20, 5), **kwargs)
+	s.failures = []
+	s.failed = lambda command, reason: s.failures.append((command.id, type(reason)))
+	s.start()
+	fleet.clock.pump([0.1] * 20)
+	return fleet, s
+
+def session(s, *blocks):
+	q = BlockQueue()
+	for block in blocks:
+		q.push(block)
+		q.block()
+	s.communicate(q)
+	return s.count_sessions
+
+#a command not answered by its deadline fails, and its session carries on with the next block
+fleet, s = scheduler()
+silent = NodeID(fleet.address(fleet.nodes[1]), 5684)
+alive = NodeID(fleet.address(fleet.nodes[2]), 5684)
+fleet.nodes[1].online = False
+lost = Command('get', silent, '6top/slotFrame', deadline=2)
+after = Command('get', alive, '6top/slotFrame')
+sid = session(s, lost, after)
+fleet.clock.pump([0.1] * 19)
+assert not s.failures and sid in s.sessions
+fleet.clock.pump([0.1] * 30)
+assert s.failures == [(lost.id, defer.TimeoutError)] and sid not in s.sessions and lost.id not in s.cache
+
+#commands without a deadline get the command timeout of the scheduler
+fleet, s = scheduler(command_timeout=1)
+fleet.nodes[1].online = False
+lost = Command('get', NodeID(fleet.address(fleet.nodes[1]), 5684), '6top/nbrList')
+sid = session(s, lost)
+fleet.clock.pump([0.1] * 15)
+assert s.failures == [(lost.id, defer.TimeoutError)] and sid not in s.sessions
+
+#a session not finished in time is cancelled and its pending commands fail as expired
+fleet, s = scheduler(session_timeout=3)
+fleet.nodes[1].online = False
+silent = NodeID(fleet.address(fleet.nodes[1]), 5684)
+first, second = Command('get', silent, '6top/slotFrame'), Command('get', silent, '6top/cellList')
+sid = session(s, first, second)
+fleet.clock.pump([0.1] * 40)
+assert s.failures == [(first.id, Expired)] and sid not in s.sessions and first.id not in s.cache
+assert sid not in s.session_timers
+
+#a cancelled session stops at once, without reporting its commands as failed
+fleet, s = scheduler()
+fleet.nodes[1].online = False
+silent = NodeID(fleet.address(fleet.nodes[1]), 5684)
+first = Command('get', silent, '6top/slotFrame')
+sid = session(s, first, Command('get', silent, '6top/cellList'))
+fleet.clock.pump([0.1] * 5)
+assert first.id in s.client.exchanges
+assert s.cancel_session(sid) and not s.cancel_session(sid)
+fleet.clock.pump([1.0] * 120)
+assert not s.failures and first.id not in s.cache and first.id not in s.client.exchanges
+
+print('Deadline ok')
@@ -0,0 +1,81 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the desired-state diff of a schedule, run from the root of the repository: python -m example.Diff_Test
+
+import os
+if not os.path.isdir('logs'):
+	os.mkdir('logs')
+
+from core.client import MemoryCommunicator
+from core.node import NodeID
+from core.schedule import SchedulerInterface
+from core.slotframe import Slotframe, Cell, CellDiff
+from util.emulator import Fleet
+from twisted.internet import task
+
+root = NodeID('aaaa::212:7400:0:1')
+N1 = NodeID('aaaa::212:7400:0:2')
+N2 = NodeID('aaaa::212:7400:0:3')
+N3 = NodeID('aaaa::212:7400:0:4')
+
+def schedule():
+	frame = Slotframe('unicast', 101)
+	for node, alias in ((root, 1), (N1, 1), (N2, 2)):
+		frame.set_alias_id(node, alias)
+	cells = [Cell(N1, 3, 2, 1, 0, 1, root), Cell(root, 3, 2, 1, 0, 2, N1), Cell(N2, 5, 4, 2, 0, 1, root),
+			Cell(root, 5, 4, 1, 0, 2, N2), Cell(N1, 7, 0, 1, 1, 9, None)]
+	for cell in cells:
+		frame.append_link(cell)
+	return frame, cells
+
+#desired cells equivalent to the installed ones cost nothing, whatever their slotframe id
+frame, cells = schedule()
+changes = frame.diff({N1: [Cell(N1, 3, 2, None, 0, 1, root), Cell(N1, 7, 0, 5, 1, 9, None)], root: [cells[1], cells[3]]})
+assert len(changes) == 0 and not changes.nodes()
+
+#changed cells are deleted and added, a cell with the same option, type and target elsewhere is a move
+changes = frame.diff({N1: [Cell(N1, 4, 6, 1, 0, 1, root), Cell(N1, 7, 0, 1, 1, 9, None), Cell(N1, 9, 1, 1, 0, 1, N2)],
+					  N2: [Cell(N2, 5, 4, 2, 0, 2, root)]})
+assert changes.moved == {N1: [(cells[0], changes.to_add(N1)[1])]} and (changes.to_add(N1)[1].slot, changes.to_add(N1)[1].channel) == (4, 6)
+assert changes.added[N1][0].tna == N2 and N1 not in changes.deleted
+assert changes.deleted == {N2: [cells[2]]} and changes.added[N2][0].option == 2
+assert changes.to_delete(N1) == [cells[0]] and changes.nodes() == set([N1, N2])
+assert len(changes) == 5 and str(changes) == '-1 +2 ~1 cells at 2 nodes'
+assert CellDiff.key(cells[0]) == (3, 2, 1, 0, root)
+
+#a node with no desired cells loses all of them, nodes left out keep theirs
+changes = frame.diff({N1: []})
+assert changes.to_delete(N1) == [cells[0], cells[4]] and changes.nodes() == set([N1]) and len(changes) == 2
+
+#reconcile deletes the changed cells of every node in a first block and posts the new ones in a second
+fleet = Fleet(3, seed=1, clock=task.Clock())
+scheduler = SchedulerInterface('DiffTest', fleet.root.eui64, 5684, 'aaaa', client=MemoryCommunicator(fleet, 20, 5))
+frame, cells = schedule()
+queues = scheduler.reconcile(frame, {N1: [Cell(N1, 3, 2, 1, 0, 1, root), Cell(N1, 9, 1, 1, 0, 1, N2)],
+									 N2: [Cell(N2, 6, 4, 2, 0, 1, root)], N3: [Cell(N3, 8, 0, 1, 0, 1, root)]})
+assert len(queues) == 2
+commands = {}
+for q in queues:
+	first = []
+	while True:
+		c = q.pop()
+		if c is None:
+			break
+		first.append(c)
+	for c in first:
+		q.release(c)
+	second = [q.pop() for i in range(len(q))]
+	commands[first[0].to if first else second[0].to] = (first, second)
+deleted, posted = commands[N1]
+assert [(c.op, c.path, sorted(c.query.split('&'))) for c in deleted] == [('delete', '6top/cellList', ['channel=0', 'frame=1', 'slot=7'])]
+assert [(c.op, c.payload['slot'], c.payload['frame']) for c in posted] == [('post', 9, 1)]
+deleted, posted = commands[N2]
+assert [(c.op, c.path, sorted(c.query.split('&'))) for c in deleted] == [('delete', '6top/cellList', ['channel=4', 'frame=2', 'slot=5'])]
+assert [(c.op, c.payload['slot'], c.payload['frame']) for c in posted] == [('post', 6, 2)]
+#deleted cells leave the slotframe at once, posted ones join once the nodes confirm them
+assert list(frame.cell_container) == [cells[0], cells[1], cells[3]]
+
+print('Diff ok')
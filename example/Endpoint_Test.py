@@ -0,0 +1,54 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the shared CoAP endpoint of a communicator, run from the root of the repository: python -m example.Endpoint_Test
+
+from core.client import Communicator, CoapEndpoint, MemoryCommunicator, RttEstimator
+from core.node import NodeID
+from util.emulator import Fleet
+from ipaddress import ip_address
+from twisted.internet import reactor, task
+from twisted.test import proto_helpers
+from txthings import coap
+
+def triggers():
+	return len(reactor._eventTriggers['shutdown'].before) if 'shutdown' in reactor._eventTriggers else 0
+
+#retransmissions and RTT samples run on the clock of the communicator
+clock = task.Clock()
+communicator = Communicator(clock)
+remote = (ip_address(u'::1'), 5684)
+communicator.estimators[remote] = RttEstimator(1.0)
+endpoint = CoapEndpoint(None, communicator)
+endpoint.transport = proto_helpers.FakeDatagramTransport()
+message = coap.Message(mtype=coap.CON, code=coap.GET)
+message.opt.uri_path = ('6top', 'slotFrame')
+message.remote = remote
+message.mid = 7
+endpoint.sendMessage(message)
+assert len(endpoint.transport.written) == 1 and clock.getDelayedCalls()
+clock.advance(1.0 * coap.ACK_RANDOM_FACTOR)
+assert len(endpoint.transport.written) == 2 and communicator.telemetry.snapshot()['total']['retransmissions'] == 1
+clock.advance(0.5)
+endpoint.removeExchange(message)
+assert not clock.getDelayedCalls() and not endpoint.active_exchanges
+assert communicator.estimator(remote).rto > 1.0
+
+#only communicators with UDP ports open hook the reactor shutdown, until they are stopped
+before = triggers()
+fleet = Fleet(3, seed=1, clock=task.Clock())
+fleet.start(listen=False)
+emulated = MemoryCommunicator(fleet, 20, 5)
+emulated.GET(NodeID(fleet.root.eui64), '6top/slotFrame', 1, lambda reply: None)
+fleet.clock.pump([0.05] * 40)
+udp = Communicator(task.Clock())
+assert triggers() == before
+udp.endpoint(NodeID(ip_address(u'::1'), 5684))
+udp.endpoint(NodeID(ip_address(u'::1'), 5685))
+assert triggers() == before + 1 and udp.ports
+udp.stop()
+assert triggers() == before and not udp.ports
+
+print('Endpoint ok')
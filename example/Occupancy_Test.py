@@ -0,0 +1,58 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the slot x channel occupancy of a slotframe, run from the root of the repository: python -m example.Occupancy_Test
+
+from core.node import NodeID
+from core.slotframe import Occupancy, Slotframe, ColumnarSlotframe, Cell, CHANNELS, numpy
+import random
+
+root = NodeID('aaaa::212:7400:0:1')
+N1 = NodeID('aaaa::212:7400:0:2')
+N2 = NodeID('aaaa::212:7400:0:3')
+
+#a bit stays set as long as a cell uses it, cells without integer coordinates are not counted
+o = Occupancy()
+o.add(3, 2, N1, root)
+o.add(3, 2, root, N1)
+o.add(3, 5, N2, None)
+o.add(None, 1, N2, None)
+assert o.channels == {3: 1 << 2 | 1 << 5} and o.busy(3, N1) and o.busy(3, root) and o.busy(3, N2) and not o.busy(4, N1)
+assert o.free_channels(3) == [c for c in range(CHANNELS) if c not in (2, 5)] and o.free_channels(4) == range(CHANNELS)
+o.remove(3, 2, N1, root)
+assert o.channels[3] >> 2 & 1 and o.busy(3, N1)
+o.remove(3, 2, root, N1)
+assert o.channels[3] == 1 << 5 and not o.busy(3, N1) and not o.busy(3, root)
+assert o.free_cells(5, N2, root) == [(s, c) for s in range(5) if s != 3 for c in range(CHANNELS)]
+assert (3, 0) in o.free_cells(5, N1, root) and (3, 5) not in o.free_cells(5, N1)
+
+def brute(cells, slots, tx, rx=None):
+	busy = set(c.slot for c in cells if tx in (c.owner, c.tna) or (rx is not None and rx in (c.owner, c.tna)))
+	used = set((c.slot, c.channel) for c in cells)
+	return [(s, ch) for s in range(slots) if s not in busy for ch in range(CHANNELS) if (s, ch) not in used]
+
+#slotframes answer from their occupancy what a scan of their cells would, as cells come and go
+kinds = [Slotframe] + ([ColumnarSlotframe] if numpy is not None else [])
+nodes = [root, N1, N2, NodeID('aaaa::212:7400:0:4')]
+for kind in kinds:
+	r = random.Random(7)
+	frame = kind('random', 31)
+	for step in range(400):
+		if r.random() < 0.7 or not len(frame.cell_container):
+			owner = r.choice(nodes)
+			frame.append_link(Cell(owner, r.randrange(31), r.randrange(CHANNELS), 1, 0, 1, r.choice(nodes + [None])))
+		else:
+			frame.delete_cells([r.choice(list(frame.cell_container))])
+		if step % 20 == 0:
+			cells = list(frame.cell_container)
+			for tx, rx in ((root, N1), (N2, None)):
+				assert frame.free_cells(tx, rx) == brute(cells, 31, tx, rx), kind
+			for slot in range(31):
+				assert frame.free_channels(slot) == [c for c in range(CHANNELS) if (slot, c) not in set((x.slot, x.channel) for x in cells)]
+				assert frame.busy(slot, N1) == any(x.slot == slot and N1 in (x.owner, x.tna) for x in cells)
+	frame.delete_links_of(root)
+	assert not any(frame.busy(slot, root) for slot in range(31))
+
+print('Occupancy ok')
@@ -0,0 +1,75 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the token bucket pacing of the communicator, run from the root of the repository: python -m example.Pacing_Test
+
+from core.client import PacedCommunicator, TokenBucket
+from core.node import NodeID
+from twisted.internet import task
+
+N1 = NodeID('aaaa::212:7400:0:2')
+N2 = NodeID('aaaa::212:7400:0:3')
+N3 = NodeID('aaaa::212:7400:0:4')
+
+class Recorder(PacedCommunicator):
+	"""Paced communicator noting when every request leaves instead of sending it"""
+
+	def __init__(self, *args, **kwargs):
+		super(Recorder, self).__init__(*args, **kwargs)
+		self.sent = []
+
+	def request(self, to_node, operation, uri, ticket, callback, payload=None, errback=None, timeout=None):
+		self.sent.append((round(self.clock.seconds(), 6), to_node, ticket))
+
+def run(clock):
+	"""Advance the clock from one scheduled call to the next until none is left"""
+	while clock.getDelayedCalls():
+		clock.advance(max(0, min(call.getTime() for call in clock.getDelayedCalls()) - clock.seconds()))
+
+def get(communicator, to_node, tickets):
+	for ticket in tickets:
+		communicator.GET(to_node, '6top/cellList?slot=' + str(ticket), ticket, None)
+
+#a bucket refills at its rate up to its burst
+clock = task.Clock()
+bucket = TokenBucket(4, 2, clock)
+assert bucket.ready() and bucket.wait() == 0.0
+bucket.consume()
+bucket.consume()
+assert not bucket.ready() and bucket.wait() == 0.25
+clock.advance(10)
+assert bucket.ready() and bucket.tokens == 2
+
+#every node gets a burst then one request per 1/rate seconds, nodes are paced independently
+clock = task.Clock()
+c = Recorder(10, 2, clock=clock)
+get(c, N1, range(5))
+get(c, N2, range(5, 7))
+assert c.queue_depth()['node'] == {N1: 5, N2: 2}
+run(clock)
+assert [(t, ticket) for t, node, ticket in c.sent if node == N1] == [(0, 0), (0, 1), (0.1, 2), (0.2, 3), (0.3, 4)]
+assert [(t, ticket) for t, node, ticket in c.sent if node == N2] == [(0, 5), (0, 6)]
+assert c.queue_depth() == {'node': {}, 'subtree': {}, 'priority': {}}
+#an idle node has its burst again
+clock.advance(0.5)
+get(c, N1, range(7, 9))
+run(clock)
+assert [t for t, node, ticket in c.sent[-2:]] == [0.8, 0.8]
+
+#nodes behind the same bottleneck share its bucket too, the others do not
+clock = task.Clock()
+branch = {N1: 'left', N2: 'left', N3: 'right'}
+c = Recorder(10, 2, subtree=branch.get, subtree_rate=5, subtree_burst=1, clock=clock)
+get(c, N1, range(3))
+get(c, N2, range(3, 6))
+get(c, N3, range(6, 8))
+assert c.queue_depth()['subtree'] == {'left': 6, 'right': 2}
+run(clock)
+left = [(t, ticket) for t, node, ticket in c.sent if node != N3]
+assert [t for t, ticket in left] == [0, 0.2, 0.4, 0.6, 0.8, 1.0]
+assert sorted(ticket for t, ticket in left) == range(6)
+assert [t for t, node, ticket in c.sent if node == N3] == [0, 0.2]
+
+print('Pacing ok')
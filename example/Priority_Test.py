@@ -0,0 +1,81 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the priority classes of outbound requests, run from the root of the repository: python -m example.Priority_Test
+
+import os
+if not os.path.isdir('logs'):
+	os.mkdir('logs')
+
+from core.client import PacedCommunicator, MemoryCommunicator
+from core.interface import Command, TOPOLOGY, SCHEDULE, MONITORING
+from core.node import NodeID
+from core.schedule import SchedulerInterface
+from util.emulator import Fleet
+from twisted.internet import task
+
+N1 = NodeID('aaaa::212:7400:0:2')
+N2 = NodeID('aaaa::212:7400:0:3')
+
+class Recorder(PacedCommunicator):
+	"""Paced communicator noting the order in which requests leave instead of sending them"""
+
+	def __init__(self, *args, **kwargs):
+		super(Recorder, self).__init__(*args, **kwargs)
+		self.sent = []
+
+	def request(self, to_node, operation, uri, ticket, callback, payload=None, errback=None, timeout=None):
+		self.sent.append(ticket)
+
+def run(clock):
+	while clock.getDelayedCalls():
+		clock.advance(max(0, min(call.getTime() for call in clock.getDelayedCalls()) - clock.seconds()))
+
+def fill(communicator, to_node, counts):
+	for priority, count in counts:
+		for i in range(count):
+			communicator.POST(to_node, '6top/cellList', {}, (priority, i), None, priority)
+
+#the classes share the sending opportunities of a node by weight, each in the order its requests came
+clock = task.Clock()
+c = Recorder(1, 1, clock=clock)
+fill(c, N1, [(MONITORING, 26), (SCHEDULE, 26), (TOPOLOGY, 26)])
+assert c.queue_depth()['priority'] == {TOPOLOGY: 26, SCHEDULE: 26, MONITORING: 26}
+run(clock)
+first = c.sent[:26]
+assert [sum(1 for p, i in first if p == priority) for priority in (TOPOLOGY, SCHEDULE, MONITORING)] == [16, 8, 2]
+for priority in (TOPOLOGY, SCHEDULE, MONITORING):
+	assert [i for p, i in c.sent if p == priority] == range(26)
+#monitoring is never starved for more than a round of the weights
+rounds = [n for n, (p, i) in enumerate(first) if p == MONITORING]
+assert rounds[0] < 13 and rounds[1] - rounds[0] == 13
+
+#a class alone uses all the opportunities, other weights and unknown classes (weight 1) may be given
+clock = task.Clock()
+c = Recorder(1, 1, weights={TOPOLOGY: 1, SCHEDULE: 1}, clock=clock)
+fill(c, N1, [(MONITORING, 2)])
+run(clock)
+fill(c, N1, [(TOPOLOGY, 4), (SCHEDULE, 4), (MONITORING, 4)])
+run(clock)
+assert c.sent[:2] == [(MONITORING, 0), (MONITORING, 1)]
+assert sorted(p for p, i in c.sent[2:5]) == [TOPOLOGY, SCHEDULE, MONITORING]
+
+#a class is served from any node whose bucket allows it, the oldest request first
+clock = task.Clock()
+c = Recorder(1, 1, clock=clock)
+fill(c, N1, [(SCHEDULE, 2)])
+c.POST(N2, '6top/cellList', {}, 'n2', None, SCHEDULE)
+run(clock)
+assert c.sent == [(SCHEDULE, 0), 'n2', (SCHEDULE, 1)]
+
+#the scheduler classifies the commands the application gave no priority
+fleet = Fleet(3, seed=1, clock=task.Clock())
+scheduler = SchedulerInterface('PriorityTest', fleet.root.eui64, 5684, 'aaaa', client=MemoryCommunicator(fleet, 20, 5))
+for op, uri, priority in [('observe', 'rpl/dag', TOPOLOGY), ('get', 'rpl/dag', TOPOLOGY), ('post', '6top/slotFrame', SCHEDULE),
+						  ('delete', '6top/cellList?slot=3', SCHEDULE), ('get', '6top/cellList', MONITORING),
+						  ('observe', '6top/nbrList', MONITORING), ('get', '6top/stats', MONITORING)]:
+	assert scheduler._priority_of(Command(op, N1, uri)) == priority, uri
+
+print('Priority ok')
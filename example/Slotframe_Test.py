@@ -0,0 +1,69 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the indexed cells of a slotframe, run from the root of the repository: python -m example.Slotframe_Test
+
+from core.node import NodeID
+from core.slotframe import Slotframe, Cell
+import copy
+
+root = NodeID('aaaa::212:7400:0:1')
+N1 = NodeID('aaaa::212:7400:0:2')
+N2 = NodeID('aaaa::212:7400:0:3')
+
+#queries answer from the indexes what a scan of the cells would
+frame = Slotframe('unicast', 101)
+cells = [Cell(N1, 3, 2, 1, 0, 1, root), Cell(root, 3, 2, 1, 0, 2, N1), Cell(N2, 5, 4, 1, 0, 1, root),
+		Cell(root, 5, 4, 1, 0, 2, N2), Cell(N1, 7, 0, 1, 1, 9, None)]
+for cell in cells:
+	frame.append_link(cell)
+#a node has one cell per slot
+assert not frame.add_link(Cell(N1, 3, 6, 1, 0, 1, N2))
+assert list(frame.cell_container) == cells and len(frame.cell_container) == 5
+assert frame.get_cells_of(N1) == [cells[0], cells[4]]
+assert frame.get_link_by_coords(5, 4, None) == [cells[2], cells[3]]
+assert frame.get_cells_similar_to(tna=root) == [cells[0], cells[2]]
+assert frame.get_cells_similar_to(owner=root, link_option=2, slot=5) == [cells[3]]
+assert frame.busy(7, N1) and not frame.busy(7, root) and 2 not in frame.free_channels(3)
+assert frame.delete_links_of(N2) == [cells[2], cells[3]]
+assert list(frame.cell_container) == [cells[0], cells[1], cells[4]] and frame.free_channels(5)[4] == 4
+try:
+	frame.delete_cells([cells[2]])
+	assert False
+except ValueError:
+	pass
+
+#the cells change only through the slotframe, copies of its cells may change freely
+for change in (lambda: frame.cell_container.append(cells[2]), lambda: setattr(cells[0], 'slot', 9),
+			   lambda: setattr(cells[0], 'option', 2), lambda: setattr(cells[4], 'tna', root)):
+	try:
+		change()
+		assert False
+	except (AttributeError, TypeError):
+		pass
+moved = copy.copy(cells[0])
+moved.slot = 9
+frame.delete_cells([cells[0]])
+frame.append_link(moved)
+cells[0].slot = 11
+assert cells[0].slot == 11 and moved.option == 1
+assert frame.get_link_by_coords(9, 2, N1) == [moved] and frame.get_link_by_coords(3, 2, N1) == []
+assert frame.busy(9, N1) and frame.get_cells_of(N1) == [cells[4], moved]
+
+#a cell in two slotframes stays immutable until both let it go, assigning cell_container replaces all the cells
+other = Slotframe('other', 25)
+other.append_link(moved)
+frame.cell_container = [cells[1]]
+assert list(frame.cell_container) == [cells[1]] and frame.get_cells_of(N1) == [] and not frame.busy(9, N1)
+try:
+	moved.channel = 3
+	assert False
+except TypeError:
+	pass
+other.delete_cells([moved])
+moved.channel = 3
+assert moved.channel == 3
+
+print('Slotframe ok')
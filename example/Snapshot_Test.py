@@ -0,0 +1,113 @@
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+
+#testfile for the snapshots of the schedule and topology, run from the root of the repository: python -m example.Snapshot_Test
+
+from core import snapshot
+from core.graph import DoDAG
+from core.node import NodeID
+from core.slotframe import Slotframe, ColumnarSlotframe, Cell, numpy
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+def cells_of(frame):
+	return sorted((str(c.owner), c.slot, c.channel, c.slotframe, c.type, c.option, str(c.tna)) for c in frame)
+
+def resealed(data):
+	return data + struct.pack('>I', zlib.crc32(data) & 0xffffffff)
+
+#the DoDAG, the slotframes and the blacklists come back as they were
+root = NodeID('aaaa::212:7400:0:1')
+N1 = NodeID('aaaa::212:7400:0:2')
+N2 = NodeID('aaaa::212:7400:0:3')
+N3 = NodeID('aaaa::212:7400:0:4')
+dodag = DoDAG('SnapshotTest', root)
+dodag.attach_child(N1, root)
+dodag.attach_child(N2, root)
+dodag.attach_child(N3, N1)
+
+frames = {'broadcast': Slotframe('broadcast', 25), 'unicast': Slotframe('unicast', 101)}
+if numpy is not None:
+	frames['bulk'] = ColumnarSlotframe('bulk', 1000)
+for name, frame in frames.items():
+	for node, alias in ((root, 0), (N1, 1), (N2, 1), (N3, None)):
+		frame.set_alias_id(node, alias)
+frames['broadcast'].append_link(Cell(root, 0, 0, 0, 1, 7, None))
+frames['unicast'].append_link(Cell(N1, 3, 2, 1, 0, 1, root))
+frames['unicast'].append_link(Cell(root, 3, 2, None, 0, 2, N1))
+frames['unicast'].append_link(Cell(N3, 9, 15, 1, 0, 1, N1))
+if numpy is not None:
+	for slot in range(500):
+		frames['bulk'].append_link(Cell(N2, slot, slot % 16, 1, 0, 1, root))
+blacklisted = {'broadcast': [], 'unicast': [[2, 3], [15, 9]]}
+
+data = snapshot.dumps(dodag, frames, blacklisted, 1234.5)
+restored = snapshot.loads(data)
+assert restored.time == 1234.5 and restored.root == root
+assert sorted((str(c), str(p)) for c, p in restored.edges) == sorted([(str(N1), str(root)), (str(N2), str(root)), (str(N3), str(N1))])
+assert restored.nodes() == set([root, N1, N2, N3])
+assert sorted(name for name, slots, columnar, fds, cells in restored.frames) == sorted(frames)
+for name, slots, columnar, fds, cells in restored.frames:
+	frame = frames[name]
+	assert slots == frame.slots and columnar == isinstance(frame, ColumnarSlotframe)
+	assert fds == frame.fds
+	assert cells_of(cells) == cells_of(frame.cell_container)
+assert restored.blacklisted == blacklisted
+
+#cells without a target, type or option, or with a slot, channel, type or option that cannot be stored
+frame = Slotframe('odd', 101)
+frame.append_link(Cell(root, 6, 0, 1, 1, 1, None))
+frame.append_link(Cell(root, 8, 0, 1, None, None, None))
+frame.append_link(Cell(root, 9, 0, 1, 254, 0, None))
+frame.append_link(Cell(root, None, 0, 2, 1, 1, None))
+frame.append_link(Cell(root, 7, 70000, 2, 1, 1, None))
+frame.append_link(Cell(root, 10, 0, 2, 255, 1, None))
+frame.append_link(Cell(root, 11, 0, 2, 1, 256, None))
+frame.append_link(Cell(root, 12, 0, 2, -1, 1, None))
+cells = snapshot.loads(snapshot.dumps(dodag, {'odd': frame}, {})).frames[0][4]
+assert [(c.owner, c.slot, c.type, c.option, c.tna) for c in cells] == [(root, 6, 1, 1, None), (root, 8, None, None, None),
+																		 (root, 9, 254, 0, None)]
+try:
+	snapshot.dumps(dodag, {}, {'odd': [[None, 1]]})
+	assert False
+except ValueError:
+	pass
+
+#truncated, corrupt, foreign and inconsistent data is refused with ValueError
+body = data[:-4]
+table = snapshot._HEADER.size + 4 * snapshot._NODE.size
+for bad in ['', data[:10], data[:-1], data[:20] + chr(ord(data[20]) ^ 1) + data[21:], resealed('XXXX' + body[4:]),
+			resealed(body[:table] + struct.pack('>H', 4) + body[table + 2:]), resealed(body + '\x00')]:
+	try:
+		snapshot.loads(bad)
+		assert False
+	except ValueError:
+		pass
+
+#saving replaces a snapshot atomically and leaves no temporary file behind
+directory = tempfile.mkdtemp()
+try:
+	path = os.path.join(directory, 'plexi.snapshot')
+	snapshot.save(path, data)
+	assert snapshot.load(path).root == root
+	snapshot.save(path, snapshot.dumps(DoDAG('SnapshotTest', N1), {}, {}))
+	assert snapshot.load(path).root == N1 and os.listdir(directory) == ['plexi.snapshot']
+	try:
+		snapshot.save(os.path.join(directory, 'missing', 'plexi.snapshot'), data)
+		assert False
+	except OSError:
+		pass
+	try:
+		snapshot.load(os.path.join(directory, 'missing.snapshot'))
+		assert False
+	except IOError:
+		pass
+finally:
+	shutil.rmtree(directory)
+
+print('Snapshot ok')
@@ -0,0 +1,195 @@
+"""
+Payload codecs keyed by CoAP Content-Format. JSON is what every plexi node speaks; CBOR (RFC 7049) carries the same
+cells, slotframes, statistics and DoDAG structures in fewer bytes, hence fewer 6LoWPAN fragments and blockwise round
+trips. The communicator picks the codec per node and falls back to JSON for nodes that refuse CBOR, see
+:func:`core.client.Communicator.payload_format`.
+"""
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2014, The RICH Project"
+#__credits__ = ["XYZ"]
+#__maintainer__ = "XYZ"
+#__license__ = "GPL"
+#__status__ = "Production"
+
+from util import parser
+import json
+import math
+import struct
+
+# CoAP Content-Format identifiers
+JSON = 50
+CBOR = 60
+
+
+def _head(major, n):
+	if n < 24:
+		return chr(major << 5 | n)
+	elif n < 0x100:
+		return chr(major << 5 | 24) + struct.pack('>B', n)
+	elif n < 0x10000:
+		return chr(major << 5 | 25) + struct.pack('>H', n)
+	elif n < 0x100000000:
+		return chr(major << 5 | 26) + struct.pack('>I', n)
+	return chr(major << 5 | 27) + struct.pack('>Q', n)
+
+
+def _half(h):
+	exponent = (h >> 10) & 0x1f
+	mantissa = h & 0x3ff
+	if exponent == 0:
+		value = math.ldexp(mantissa, -24)
+	elif exponent != 31:
+		value = math.ldexp(mantissa + 1024, exponent - 25)
+	else:
+		value = float('inf') if mantissa == 0 else float('nan')
+	return -value if h & 0x8000 else value
+
+
+def cbor_dumps(content):
+	"""
+	Encode a structure of dict, list, tuple, str, unicode, int, long, float, bool and None as CBOR. Any other object (e.g.
+	a :class:`core.node.NodeID`) is encoded as its str(), as :func:`util.parser.construct_payload` does.
+
+	:rtype: str
+	"""
+	if content is None:
+		return '\xf6'
+	elif content is True:
+		return '\xf5'
+	elif content is False:
+		return '\xf4'
+	elif isinstance(content, (int, long)):
+		return _head(0, content) if content >= 0 else _head(1, -1 - content)
+	elif isinstance(content, float):
+		single = struct.pack('>f', content)
+		if struct.unpack('>f', single)[0] == content:
+			return '\xfa' + single
+		return '\xfb' + struct.pack('>d', content)
+	elif isinstance(content, bytearray):
+		return _head(2, len(content)) + str(content)
+	elif isinstance(content, (list, tuple)):
+		return _head(4, len(content)) + ''.join(cbor_dumps(i) for i in content)
+	elif isinstance(content, dict):
+		return _head(5, len(content)) + ''.join(cbor_dumps(k) + cbor_dumps(v) for k, v in content.items())
+	text = content.encode('utf-8') if isinstance(content, unicode) else str(content)
+	return _head(3, len(text)) + text
+
+
+def _decode(data, i):
+	initial = ord(data[i])
+	major = initial >> 5
+	info = initial & 0x1f
+	i += 1
+	if major == 7:
+		if info == 20:
+			return False, i
+		elif info == 21:
+			return True, i
+		elif info in (22, 23):
+			return None, i
+		elif info == 25:
+			return _half(struct.unpack('>H', data[i:i + 2])[0]), i + 2
+		elif info == 26:
+			return struct.unpack('>f', data[i:i + 4])[0], i + 4
+		elif info == 27:
+			return struct.unpack('>d', data[i:i + 8])[0], i + 8
+		raise ValueError('CBOR simple value ' + str(info))
+	if info < 24:
+		n = info
+	elif info < 28:
+		size = 1 << (info - 24)
+		n = struct.unpack({1: '>B', 2: '>H', 4: '>I', 8: '>Q'}[size], data[i:i + size])[0]
+		i += size
+	else:
+		raise ValueError('CBOR additional information ' + str(info))
+	if major == 0:
+		return n, i
+	elif major == 1:
+		return -1 - n, i
+	elif major == 2:
+		return bytearray(data[i:i + n]), i + n
+	elif major == 3:
+		return data[i:i + n].decode('utf-8'), i + n
+	elif major == 4:
+		items = []
+		for _ in range(n):
+			item, i = _decode(data, i)
+			items.append(item)
+		return items, i
+	elif major == 5:
+		items = {}
+		for _ in range(n):
+			key, i = _decode(data, i)
+			items[key], i = _decode(data, i)
+		return items, i
+	# Tags (major 6) are dropped, their content is kept
+	return _decode(data, i)
+
+
+def cbor_loads(data):
+	"""
+	Decode a CBOR payload. Text strings are returned as unicode, like json.loads does.
+
+	:raises: ValueError, like json.loads, if the payload is not well-formed or uses indefinite lengths
+	"""
+	try:
+		content, end = _decode(data, 0)
+	except (IndexError, struct.error, UnicodeDecodeError):
+		raise ValueError('truncated CBOR payload')
+	if end != len(data):
+		raise ValueError('trailing bytes after CBOR payload')
+	return content
+
+
+class JsonCodec(object):
+	content_format = JSON
+
+	def encode(self, content):
+		return parser.construct_payload(content) or ''
+
+	def decode(self, payload):
+		return json.loads(parser.clean_payload(payload))
+
+
+class CborCodec(object):
+	content_format = CBOR
+
+	def encode(self, content):
+		return cbor_dumps(content)
+
+	def decode(self, payload):
+		return cbor_loads(payload)
+
+
+CODECS = {JSON: JsonCodec(), CBOR: CborCodec()}
+
+
+def codec_of(content_format):
+	"""
+	:param content_format: a CoAP Content-Format, None for JSON
+	:return: the codec of the format, JSON if unknown
+	"""
+	return CODECS.get(content_format, CODECS[JSON])
+
+
+def decode(response):
+	"""
+	Parse the payload of a response with the codec of its Content-Format option.
+
+	:type response: :class:`txthings.coap.Message`
+	"""
+	return codec_of(response.opt.content_format).decode(response.payload)
+
+
+def text(response):
+	"""
+	Printable JSON text of the payload of a response, whatever its Content-Format.
+
+	:type response: :class:`txthings.coap.Message`
+	:rtype: str
+	"""
+	if response.opt.content_format == CBOR:
+		return json.dumps(decode(response))
+	return parser.clean_payload(response.payload)
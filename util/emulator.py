@@ -0,0 +1,501 @@
+#!/bin/python
+"""
+Emulated fleet of plexi nodes for exercising the NME without motes.
+
+Every virtual node runs the CoAP resources of the Contiki plexi interface (rpl/dag, 6top/slotFrame, 6top/cellList,
+6top/nbrList, 6top/stats and 6top/qList) on its own IPv6 address and port 5684, replying with the JSON documents the
+:class:`core.schedule.Reflector` parses. Nodes form a DoDAG rooted at the first node (the border router). They join
+over time, get rewired at random and answer after a delay that grows with their depth, and they may lose datagrams.
+
+The addresses of the nodes must be routed to the loopback interface, once per boot (as root)::
+
+	ip -6 route add local aaaa::/64 dev lo
+
+and then e.g.::
+
+	python -m util.emulator -n 500 -f 4 --rtt=0.02 --loss=0.01 --join=0.05 --churn=10
+	python -m example.monitor -b 212:7400:0:1 -p aaaa
+
+Each node holds a UDP socket, so the open files limit (ulimit -n) caps the size of the fleet.
+"""
+
+__author__ = "George Exarchakos"
+__email__ = "g.exarchakos@tue.nl"
+__version__ = "0.0.1"
+__copyright__ = "Copyright 2015, The RICH Project"
+#__credits__ = ["XYZ"]
+#__maintainer__ = "XYZ"
+#__license__ = "GPL"
+#__status__ = "Production"
+
+
+import getopt
+import json
+import logging
+import random
+import re
+import socket
+import sys
+from twisted.internet import defer, reactor, task, udp
+import txthings.coap as coap
+import txthings.resource as resource
+from ipaddress import ip_address
+from util import codec
+
+logg = logging.getLogger('emulator')
+
+IP_FREEBIND = getattr(socket, 'IP_FREEBIND', 15)
+
+# Paths of the resources served by every node
+RESOURCES = [('rpl', 'dag'), ('rpl', 'dag', 'parent'), ('rpl', 'dag', 'child'), ('6top', 'slotFrame'),
+			('6top', 'cellList'), ('6top', 'cellList', 'link'), ('6top', 'cellList', 'stats'), ('6top', 'nbrList'),
+			('6top', 'stats'), ('6top', 'qList')]
+
+# Cell fields a query may filter on
+CELL_FIELDS = ['link', 'frame', 'slot', 'channel', 'option', 'type', 'tna']
+
+
+def _load(payload):
+	"""
+	Parse a JSON request payload. Addresses are sent unquoted by :func:`util.parser.construct_payload` (e.g.
+	{"tna":::212:7400:0:2}), so they are quoted before parsing.
+	"""
+	if not payload:
+		return None
+	if not isinstance(payload, basestring):
+		return payload
+	try:
+		return json.loads(payload)
+	except ValueError:
+		return json.loads(re.sub(r'":([0-9a-fA-F]*:[0-9a-fA-F:]*)(?=[,}\]])', r'":"\1"', payload))
+
+
+class VirtualNode(object):
+	"""
+	State of the plexi interface of one node, independent of the transport. :func:`handle` executes a request on it and
+	every listener is called with the path of every resource whose representation changed (for observers).
+	"""
+
+	def __init__(self, eui64, frames=None):
+		self.eui64 = eui64
+		self.parent = None
+		self.children = []
+		self.online = True
+		self.frames = dict(frames) if frames else {0: 101}
+		self.cells = {}
+		self.next_link = 1
+		self.stats = {}
+		self.asn = 0
+		self.listeners = []
+		self.random = random.Random(eui64)
+		# Content-Formats the node understands
+		self.formats = set([codec.JSON])
+
+	def __str__(self):
+		return self.eui64
+
+	def depth(self):
+		hops = 0
+		node = self.parent
+		while node is not None:
+			hops += 1
+			node = node.parent
+		return hops
+
+	def neighbors(self):
+		return ([self.parent] if self.parent else []) + self.children
+
+	def dag(self):
+		return {'parent': [self.parent.eui64] if self.parent else [], 'child': [c.eui64 for c in self.children]}
+
+	def changed(self, *path):
+		for listener in list(self.listeners):
+			listener(path)
+
+	def handle(self, method, path, query=None, payload=None):
+		"""
+		Execute a request on the node.
+
+		:param method: 'GET', 'POST' or 'DELETE'
+		:type method: str
+		:param path: the segments of the uri path e.g. ('6top', 'cellList')
+		:type path: tuple
+		:param query: the uri query items e.g. ['frame=1', 'slot=3']
+		:type query: list
+		:param payload: the JSON payload of the request
+		:type payload: str
+		:return: the CoAP response code and payload
+		:rtype: tuple
+		"""
+		path = tuple(path)
+		filters = dict(q.split('=', 1) for q in query or [] if '=' in q)
+		handler = getattr(self, '_' + method.lower() + '_' + '_'.join(path[1:]).lower(), None)
+		if path not in RESOURCES or handler is None:
+			return coap.NOT_FOUND, ''
+		try:
+			return handler(filters, _load(payload))
+		except (ValueError, KeyError, TypeError, AttributeError):
+			return coap.BAD_REQUEST, ''
+
+	def serve(self, request):
+		"""
+		Answer a CoAP request, decoding and encoding payloads with the codecs of its Content-Format and Accept options.
+		Formats the node does not understand get 4.15 (Unsupported Content-Format) or 4.06 (Not Acceptable).
+
+		:type request: :class:`txthings.coap.Message`
+		:return: the response, without message type, ID or token
+		:rtype: :class:`txthings.coap.Message`
+		"""
+		content_format = request.opt.content_format
+		accept = request.opt.accept
+		if content_format is not None and content_format not in self.formats:
+			return coap.Message(code=coap.UNSUPPORTED_CONTENT_FORMAT)
+		if accept is not None and accept not in self.formats:
+			return coap.Message(code=coap.NOT_ACCEPTABLE)
+		payload = request.payload
+		if content_format is not None and payload:
+			try:
+				payload = codec.codec_of(content_format).decode(payload)
+			except ValueError:
+				return coap.Message(code=coap.BAD_REQUEST)
+		code, body = self.handle(coap.requests[request.code], request.opt.uri_path, request.opt.uri_query, payload)
+		response = coap.Message(code=code, payload=body)
+		if accept is not None and accept != codec.JSON:
+			if body:
+				response.payload = codec.codec_of(accept).encode(json.loads(body))
+			response.opt.content_format = accept
+		return response
+
+	def _get_dag(self, filters, payload):
+		return coap.CONTENT, json.dumps(self.dag())
+
+	def _get_dag_parent(self, filters, payload):
+		return coap.CONTENT, json.dumps(self.dag()['parent'])
+
+	def _get_dag_child(self, filters, payload):
+		return coap.CONTENT, json.dumps(self.dag()['child'])
+
+	def _get_slotframe(self, filters, payload):
+		frames = [{'frame': k, 'slots': v} for k, v in sorted(self.frames.items())]
+		for key in ['frame', 'slots']:
+			if key in filters:
+				frames = [f for f in frames if str(f[key]) == filters[key]]
+		return coap.CONTENT, json.dumps(frames)
+
+	def _post_slotframe(self, filters, payload):
+		result = []
+		for frame in payload if isinstance(payload, list) else [payload]:
+			if frame['frame'] in self.frames:
+				result.append(0)
+			else:
+				self.frames[frame['frame']] = frame['slots']
+				result.append(1)
+		self.changed('6top', 'slotFrame')
+		return coap.CONTENT, json.dumps(result)
+
+	def _matching(self, filters):
+		cells = sorted(self.cells.values(), key=lambda c: c['link'])
+		for key in CELL_FIELDS:
+			if key in filters:
+				cells = [c for c in cells if str(c.get(key)) == filters[key]]
+		return cells
+
+	def _get_celllist(self, filters, payload):
+		cells = self._matching(filters)
+		if 'link' in filters:
+			return (coap.CONTENT, json.dumps(cells[0])) if cells else (coap.NOT_FOUND, '')
+		return coap.CONTENT, json.dumps(cells)
+
+	def _get_celllist_link(self, filters, payload):
+		return coap.CONTENT, json.dumps(sorted(self.cells.keys()))
+
+	def _get_celllist_stats(self, filters, payload):
+		cells = self._matching(filters)
+		if not cells:
+			return coap.NOT_FOUND, ''
+		rng = random.Random(cells[0]['link'])
+		return coap.CONTENT, json.dumps({'etx': rng.randint(1, 4), 'pdr': rng.randint(60, 100), 'rssi': -rng.randint(40, 90), 'lqi': rng.randint(80, 110)})
+
+	def _post_celllist(self, filters, payload):
+		result = []
+		for cell in payload if isinstance(payload, list) else [payload]:
+			frame = cell['frame']
+			busy = [c for c in self.cells.values() if c['frame'] == frame and c['slot'] == cell['slot'] and c['channel'] == cell['channel']]
+			if frame not in self.frames or not 0 <= cell['slot'] < self.frames[frame] or busy:
+				result.append(0)
+				continue
+			stored = dict(cell)
+			stored['link'] = self.next_link
+			self.cells[self.next_link] = stored
+			result.append(self.next_link)
+			self.next_link += 1
+		self.changed('6top', 'cellList')
+		return coap.CONTENT, json.dumps(result)
+
+	def _delete_celllist(self, filters, payload):
+		cells = self._matching(filters)
+		for cell in cells:
+			del self.cells[cell['link']]
+		self.changed('6top', 'cellList')
+		return coap.CONTENT, json.dumps(cells)
+
+	def _get_nbrlist(self, filters, payload):
+		neighbors = []
+		for n in self.neighbors():
+			if 'tna' in filters and filters['tna'] != n.eui64:
+				continue
+			rng = random.Random(n.eui64)
+			neighbors.append({'tna': n.eui64, 'rssi': -rng.randint(40, 90), 'lqi': rng.randint(80, 110), 'asn': self.asn})
+		return coap.CONTENT, json.dumps(neighbors)
+
+	def _get_stats(self, filters, payload):
+		if 'id' in filters:
+			if int(filters['id']) not in self.stats:
+				return coap.NOT_FOUND, ''
+			stat = dict(self.stats[int(filters['id'])])
+			stat['value'] = self.random.randint(0, 100)
+			return coap.CONTENT, json.dumps(stat)
+		return coap.CONTENT, json.dumps(self.stats.values())
+
+	def _post_stats(self, filters, payload):
+		self.stats[payload['id']] = payload
+		return coap.CHANGED, ''
+
+	def _get_qlist(self, filters, payload):
+		return coap.CONTENT, json.dumps(dict((n.eui64, self.random.randint(0, 4)) for n in self.neighbors()))
+
+
+class NodeResource(resource.CoAPResource):
+	"""CoAP face of one resource of a :class:`VirtualNode`"""
+
+	observable = True
+
+	def __init__(self, node, path):
+		resource.CoAPResource.__init__(self)
+		self.node = node
+		self.path = path
+
+	def render(self, request):
+		if request.code not in (coap.GET, coap.POST, coap.DELETE):
+			return resource.CoAPResource.render(self, request)
+		return defer.succeed(self.node.serve(request))
+
+
+class LossyCoap(coap.Coap):
+	"""
+	CoAP protocol of a virtual node. Datagrams sent to an offline node are dropped, others are lost with the loss rate
+	of the fleet and the rest are processed after the round trip time of the node's depth.
+	"""
+
+	def __init__(self, node, fleet):
+		self.node = node
+		self.fleet = fleet
+		self.resources = {}
+		root = resource.CoAPResource()
+		for path in RESOURCES:
+			parent = root
+			for segment in path[:-1]:
+				if segment not in parent.children:
+					parent.putChild(segment, resource.CoAPResource())
+				parent = parent.children[segment]
+			self.resources[path] = NodeResource(node, path)
+			parent.putChild(path[-1], self.resources[path])
+		coap.Coap.__init__(self, resource.Endpoint(root))
+		node.listeners.append(self.notify)
+
+	def notify(self, path):
+		for p, r in self.resources.items():
+			if p[:len(path)] == path and r.observers:
+				r.updatedState()
+
+	def datagramReceived(self, data, remote):
+		if not self.node.online or self.fleet.random.random() < self.fleet.loss:
+			return
+		reactor.callLater(self.fleet.delay(self.node), coap.Coap.datagramReceived, self, data, remote)
+
+
+class FreePort(udp.Port):
+	"""UDP port that can bind an address not configured on any interface (IP_FREEBIND)"""
+
+	def createInternetSocket(self):
+		skt = udp.Port.createInternetSocket(self)
+		skt.setsockopt(socket.SOL_IP, IP_FREEBIND, 1)
+		return skt
+
+
+class Fleet(object):
+	"""
+	A DoDAG of :class:`VirtualNode`. Node i (counting from 1, the border router) has the address prefix::212:7400:0:i
+	and its parent is node (i-2)/fanout+1, until churn rewires it.
+
+	:param size: number of nodes, border router included
+	:param fanout: children per node of the initial DoDAG
+	:param rtt: round trip time (sec) of a single hop; a node at depth d answers after (d+1)*rtt
+	:param jitter: relative variation of the round trip time, 0 <= jitter < 1
+	:param loss: probability a datagram sent to a node is lost
+	:param clock: clock of joins and churn, the reactor unless a virtual one (see :class:`core.client.MemoryCommunicator`)
+	:param cbor: probability a node understands CBOR payloads besides JSON
+	"""
+
+	def __init__(self, size, fanout=3, prefix='aaaa', port=5684, rtt=0.02, jitter=0.5, loss=0.0, seed=None, clock=None, cbor=0.0):
+		self.prefix = prefix
+		self.port = port
+		self.rtt = rtt
+		self.jitter = jitter
+		self.loss = loss
+		self.fanout = fanout
+		self.random = random.Random(seed)
+		self.nodes = [VirtualNode('212:7400:%x:%x' % (i >> 16, i & 0xffff)) for i in range(1, size + 1)]
+		self.root = self.nodes[0]
+		for node in self.nodes:
+			if cbor and self.random.random() < cbor:
+				node.formats.add(codec.CBOR)
+		self.clock = clock if clock else reactor
+		self.by_address = dict((ip_address(unicode(self.address(n))), n) for n in self.nodes)
+		self.attached = set([self.root])
+		self.ports = []
+		self.loops = []
+
+	def address(self, node):
+		return self.prefix + '::' + node.eui64
+
+	def node_at(self, ip):
+		return self.by_address.get(ip)
+
+	def delay(self, node):
+		return (node.depth() + 1) * self.rtt * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+
+	def _subtree(self, node):
+		nodes = [node]
+		for n in nodes:
+			nodes.extend(n.children)
+		return nodes
+
+	def attach(self, node, parent):
+		"""Let node join the DoDAG as a child of parent"""
+		node.parent = parent
+		parent.children.append(node)
+		self.attached.update(self._subtree(node))
+		node.changed('rpl', 'dag')
+		parent.changed('rpl', 'dag')
+		logg.debug(str(node) + ' joined under ' + str(parent))
+
+	def detach(self, node):
+		"""Remove node and its subtree from the DoDAG; they stop answering"""
+		if node.parent is not None:
+			node.parent.children.remove(node)
+			node.parent.changed('rpl', 'dag')
+		node.parent = None
+		for n in self._subtree(node):
+			n.online = False
+			self.attached.discard(n)
+		logg.debug(str(node) + ' left')
+
+	def rewire(self, node, parent):
+		"""Move node (and its subtree) under a new parent"""
+		old = node.parent
+		old.children.remove(node)
+		node.parent = parent
+		parent.children.append(node)
+		for n in [old, parent, node]:
+			n.changed('rpl', 'dag')
+		logg.debug(str(node) + ' rewired from ' + str(old) + ' to ' + str(parent))
+
+	def _churn(self):
+		candidates = [n for n in self.nodes if n in self.attached and n is not self.root]
+		if not candidates:
+			return
+		node = self.random.choice(candidates)
+		excluded = set(self._subtree(node) + [node.parent])
+		parents = [n for n in self.nodes if n in self.attached and n not in excluded]
+		if parents:
+			self.rewire(node, self.random.choice(parents))
+
+	def _join(self, index):
+		node = self.nodes[index]
+		self.attach(node, self.nodes[(index - 1) // self.fanout])
+
+	def start(self, join=0.0, churn=0.0, listen=True):
+		"""
+		Open the CoAP endpoints of all nodes and build the DoDAG.
+
+		:param join: seconds between consecutive joins of nodes, 0 to have all of them attached from the start
+		:param churn: seconds between random rewires, 0 for a static DoDAG
+		:param listen: False to skip the UDP endpoints, when the nodes are reached in-process
+		"""
+		if listen:
+			for node in self.nodes:
+				port = FreePort(self.port, LossyCoap(node, self), interface=self.address(node), reactor=reactor)
+				port.startListening()
+				self.ports.append(port)
+		for i in range(1, len(self.nodes)):
+			if join:
+				self.clock.callLater(i * join, self._join, i)
+			else:
+				self._join(i)
+		if churn:
+			loop = task.LoopingCall(self._churn)
+			loop.clock = self.clock
+			loop.start(churn, now=False)
+			self.loops.append(loop)
+		logg.info(str(len(self.nodes)) + ' nodes emulated, border router at ' + self.address(self.root))
+
+	def stop(self):
+		for loop in self.loops:
+			loop.stop()
+		for port in self.ports:
+			port.stopListening()
+		self.loops = []
+		self.ports = []
+
+
+def usage():
+	print('Command:\temulator.py [-h][-n][-f][-p][--rtt][--loss][--join][--churn][--seed][--cbor]')
+	print('Options:')
+	print('\t-h,\t--help\t\t\tthis usage message')
+	print('\t-n,\t--nodes=\t\tnumber of nodes including the border router (default 50)')
+	print('\t-f,\t--fanout=\t\tchildren per node of the initial DoDAG (default 3)')
+	print('\t-p,\t--prefix=\t\t4-character address prefix e.g. aaaa')
+	print('\t\t--rtt=\t\t\tround trip time per hop in seconds (default 0.02)')
+	print('\t\t--loss=\t\t\tprobability a datagram to a node is lost (default 0)')
+	print('\t\t--join=\t\t\tseconds between node joins, 0 for all at once (default 0)')
+	print('\t\t--churn=\t\tseconds between random rewires, 0 for none (default 0)')
+	print('\t\t--seed=\t\t\tseed of the random generator')
+	print('\t\t--cbor=\t\t\tprobability a node understands CBOR payloads (default 0)')
+
+if __name__ == '__main__':
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "hn:f:p:", ["help", "nodes=", "fanout=", "prefix=", "rtt=", "loss=", "join=", "churn=", "seed=", "cbor="])
+	except getopt.GetoptError as err:
+		print(str(err))
+		usage()
+		sys.exit(2)
+	settings = {'size': 50, 'fanout': 3, 'prefix': 'aaaa', 'rtt': 0.02, 'loss': 0.0, 'seed': None, 'cbor': 0.0}
+	join = 0.0
+	churn = 0.0
+	for o, a in opts:
+		if o in ("-h", "--help"):
+			usage()
+			sys.exit(0)
+		elif o in ("-n", "--nodes"):
+			settings['size'] = int(a)
+		elif o in ("-f", "--fanout"):
+			settings['fanout'] = int(a)
+		elif o in ("-p", "--prefix"):
+			settings['prefix'] = a
+		elif o == "--rtt":
+			settings['rtt'] = float(a)
+		elif o == "--loss":
+			settings['loss'] = float(a)
+		elif o == "--join":
+			join = float(a)
+		elif o == "--churn":
+			churn = float(a)
+		elif o == "--seed":
+			settings['seed'] = int(a)
+		elif o == "--cbor":
+			settings['cbor'] = float(a)
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+	fleet = Fleet(**settings)
+	reactor.callWhenRunning(fleet.start, join, churn)
+	reactor.run()
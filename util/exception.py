@@ -30,3 +30,10 @@ class UnsupportedCase(Exception):
 
 	def __str__(self):
 		return str(self.value)
+
+class Expired(Exception):
+	def __init__(self, value):
+		self.value = value
+
+	def __str__(self):
+		return str(self.value)
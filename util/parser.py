@@ -39,6 +39,9 @@ def construct_payload(content):
 			first_item = 0
 		return str_payload + "}"
 	elif isinstance(content, list):
+		# a list of cells/frames is sent as a JSON array of objects
+		if any(isinstance(i, dict) for i in content):
+			return "[" + ",".join(construct_payload(i) if isinstance(i, dict) else str(i) for i in content) + "]"
 		return str(content)
 
 